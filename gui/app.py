@@ -11,7 +11,7 @@ from PySide6 import QtCore as qtc
 
 from gui.chat_component import ChatComponent
 from gui.tool_control_bar import ToolControlBar
-from modules.chat_history.convo_manager import ConversationManager
+from modules.chat_history.async_convo_manager import AsyncConversationManager
 from modules.user_accounts.login import LoginComponent
 from modules.user_accounts.user_account_db import UserAccountDatabase
 from modules.user_accounts.sign_up import SignUpComponent
@@ -25,6 +25,9 @@ from modules.Tools.Internet_Tools.Browser.browser import Browser
 from modules.Tools.Planning.calendar import Calendar
 from modules.Providers.model_manager import ModelManager
 from modules.Tools.Code_Execution.code_genius_ui import CodeGeniusUI
+from modules.Analytics.event_loop_monitor import EventLoopLagMonitor
+from modules.Analytics.tracing import report as report_traces
+from modules.Providers.transport import close_all_transports
 # from modules.config import ConfigManager
 
 logger = setup_logger('app.py')
@@ -171,8 +174,10 @@ class SCOUT(QtWidgets.QMainWindow):
 
             self.provider_manager = ProviderManager(self, self.model_manager)
 
-            self.chat_history_database = ConversationManager(self.user, current_persona['name'], self.provider_manager)
+            self.chat_history_database = AsyncConversationManager(self.user, current_persona['name'], self.provider_manager)
             logger.info("Conversation History Database instantiated successfully.")
+            # Resume background jobs queued before the last shutdown.
+            self.chat_history_database.job_scheduler.start()
 
             self.conversation_id = self.chat_history_database.init_conversation_id()
             logger.info(f"User is set: {self.user}, Session ID: {self.session_id}, Conversation ID: {self.conversation_id}, Current Persona: {current_persona['name'] if current_persona else 'None'}")
@@ -381,9 +386,21 @@ class SCOUT(QtWidgets.QMainWindow):
             self.on_closing(event)
 
     async def async_main(self):
+        # Reports how long the loop, and with it the Qt event queue, was kept from running.
+        self.loop_monitor = EventLoopLagMonitor()
+        self.loop_monitor.start()
         try:
             while True:
                 await asyncio.sleep(0.01)
                 QtWidgets.QApplication.processEvents()
         except asyncio.CancelledError:
             logger.info("async_main task cancelled gracefully.")
+        finally:
+            self.loop_monitor.stop()
+            report_traces()
+            if hasattr(self, 'chat_history_database'):
+                # Drains the database executor and write-behind queue off the loop thread, so
+                # queued rows are committed before the process exits.
+                await asyncio.get_running_loop().run_in_executor(None, self.chat_history_database.close_connection)
+            # Closes the kept-alive provider connections while the loop can still run it.
+            await close_all_transports()
@@ -7,6 +7,75 @@ from modules.logging.logger import setup_logger
 
 logger = setup_logger('chist_functions.py')
 
+# Conversations fetched per page; more are loaded as the list is scrolled to the bottom.
+CHAT_HISTORY_PAGE_SIZE = 50
+
+def format_chat_history_entry(conversation):
+    display_name = conversation["name"] if conversation["name"] else conversation["persona"]
+    formatted_timestamp = datetime.strptime(conversation["timestamp"], "%Y-%m-%d %H:%M:%S").strftime("%b %d, %Y")
+    return f"{display_name}: {formatted_timestamp}@@{conversation['conversation_id']}"  # Include conversation_id
+
+async def load_more_chat_history(chat_component):
+    # Scroll signals keep firing while a page is loading; only one load per listing runs at a time.
+    request = chat_component.chat_history_request
+    if chat_component.chat_history_exhausted or chat_component.chat_history_loading is request:
+        return
+
+    chat_component.chat_history_loading = request
+    persona_name = chat_component.current_persona.get('name') if chat_component.current_persona else 'Unknown'
+    try:
+        conversations, cursor = await chat_component.conversation_manager.list_conversations(
+            chat_component.user, persona=persona_name, limit=CHAT_HISTORY_PAGE_SIZE, after=chat_component.chat_history_cursor
+        )
+    finally:
+        if chat_component.chat_history_loading is request:
+            chat_component.chat_history_loading = None
+    if chat_component.chat_history_request is not request:
+        # The list was cleared by a search while this page was loading.
+        return
+    chat_component.chat_history_cursor = cursor
+    chat_component.chat_history_exhausted = cursor is None
+
+    for conversation in conversations:
+        chat_component.chat_log_listbox.addItem(format_chat_history_entry(conversation))
+    logger.info(f"Loaded {len(conversations)} chat logs for {persona_name}")
+
+def on_chat_history_scrolled(chat_component, value):
+    scroll_bar = chat_component.chat_log_listbox.verticalScrollBar()
+    if value >= scroll_bar.maximum() - scroll_bar.pageStep():
+        asyncio.create_task(load_more_chat_history(chat_component))
+
+def reset_chat_history_listing(chat_component):
+    chat_component.chat_log_listbox.clear()
+    chat_component.chat_history_cursor = None
+    chat_component.chat_history_exhausted = False
+    chat_component.chat_history_request = object()
+    chat_component.chat_history_loading = None
+
+async def search_chat_history(chat_component, text):
+    reset_chat_history_listing(chat_component)
+    if not text.strip():
+        await load_more_chat_history(chat_component)
+        return
+
+    # Search results are not paginated; stop the scroll handlers from appending the regular listing.
+    chat_component.chat_history_exhausted = True
+    persona_name = chat_component.current_persona.get('name') if chat_component.current_persona else 'Unknown'
+    request = chat_component.chat_history_request
+    results = await chat_component.conversation_manager.search(chat_component.user, text, persona=persona_name, limit=CHAT_HISTORY_PAGE_SIZE)
+    if chat_component.chat_history_request is not request:
+        return
+    for result in results:
+        label = result["name"] if result["name"] else result["role"] or result["persona"]
+        snippet = " ".join(result["snippet"].split())
+        chat_component.chat_log_listbox.addItem(f"{label}: {snippet}@@{result['conversation_id']}")
+    logger.info(f"Chat history search returned {len(results)} results")
+
+def on_chat_history_range_changed(chat_component, maximum):
+    # Keep loading until the list overflows the dialog, otherwise there is nothing to scroll.
+    if maximum == 0:
+        asyncio.create_task(load_more_chat_history(chat_component))
+
 def load_chat_history(chat_component, provider_manager):
     logger.info("Opening chat history")
     chat_component.popup = QtWidgets.QDialog(chat_component)
@@ -16,28 +85,26 @@ def load_chat_history(chat_component, provider_manager):
     font = QtGui.QFont(chat_component.appearance_settings_instance.history_font_family, int(chat_component.appearance_settings_instance.history_font_size), QtGui.QFont.Normal)
     chat_component.popup.setFont(font)
 
-    user = chat_component.user
     persona_name = chat_component.current_persona.get('name') if chat_component.current_persona else 'Unknown'
     logger.info(f"Current persona_name: {persona_name}")
 
-    # Use chat_component.conversation_manager directly
-    conversation_manager = chat_component.conversation_manager
+    search_box = QtWidgets.QLineEdit(chat_component.popup)
+    search_box.setFont(font)
+    search_box.setPlaceholderText("Search chat history...")
+    search_box.returnPressed.connect(lambda: asyncio.create_task(search_chat_history(chat_component, search_box.text())))
 
-    chat_logs = conversation_manager.get_conversations(user, persona=persona_name)
-    logger.debug(f"Chat logs fetched for {persona_name}: {chat_logs}")
-    logger.info(f"Chat logs fetched for {persona_name}")
     chat_component.chat_log_listbox = QtWidgets.QListWidget(chat_component.popup)
     chat_component.chat_log_listbox.setFont(font)
     chat_component.chat_log_listbox.setStyleSheet(f"background-color: {chat_component.appearance_settings_instance.history_frame_bg}; color: {chat_component.appearance_settings_instance.history_font_color};")
 
-    for chat_log_tuple in chat_logs:
-        _, timestamp, persona, conversation_id, name = chat_log_tuple
-        display_name = name if name else persona
-        formatted_timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").strftime("%b %d, %Y")
-        entry = f"{display_name}: {formatted_timestamp}@@{conversation_id}"  # Include conversation_id
-        chat_component.chat_log_listbox.addItem(entry)
+    reset_chat_history_listing(chat_component)
+    asyncio.create_task(load_more_chat_history(chat_component))
+    scroll_bar = chat_component.chat_log_listbox.verticalScrollBar()
+    scroll_bar.valueChanged.connect(lambda value: on_chat_history_scrolled(chat_component, value))
+    scroll_bar.rangeChanged.connect(lambda minimum, maximum: on_chat_history_range_changed(chat_component, maximum))
 
     layout = QtWidgets.QVBoxLayout(chat_component.popup)
+    layout.addWidget(search_box)
     layout.addWidget(chat_component.chat_log_listbox)
 
     save_chat_button = QtWidgets.QPushButton("Save Current Chat", chat_component.popup)
@@ -55,7 +122,7 @@ def load_chat_history(chat_component, provider_manager):
     delete_button = QtWidgets.QPushButton("Delete", chat_component.popup)
     delete_button.setFont(font)
     delete_button.setStyleSheet(f"background-color: #7289da; color: {chat_component.appearance_settings_instance.history_font_color};")
-    delete_button.clicked.connect(lambda: delete_conversation(chat_component, chat_component.provider_manager))
+    delete_button.clicked.connect(lambda: asyncio.create_task(delete_conversation(chat_component, chat_component.provider_manager)))
     layout.addWidget(delete_button)
 
     chat_component.popup.setModal(False)  
@@ -72,7 +139,7 @@ async def load_chat(chat_component, selected_chat_log=None, provider_manager=Non
         logger.warning("No chat log entry selected.")
         return
 
-    _, conversation_id = selected_chat_log.split("@@", 1)  
+    _, conversation_id = selected_chat_log.rsplit("@@", 1)  
 
     user = chat_component.user
 
@@ -88,7 +155,7 @@ async def load_chat(chat_component, selected_chat_log=None, provider_manager=Non
     # Use chat_component.conversation_manager directly
     conversation_manager = chat_component.conversation_manager
 
-    actual_chat_log = conversation_manager.get_chat_log(user, conversation_id)
+    actual_chat_log = await conversation_manager.get_chat_log(user, conversation_id)
 
     if actual_chat_log:
         chat_component.chat_log.setPlainText(actual_chat_log)
@@ -97,7 +164,7 @@ async def load_chat(chat_component, selected_chat_log=None, provider_manager=Non
     else:
         logger.error(f"No chat log found for Conversation ID: {conversation_id}")
 
-def delete_conversation(chat_component, provider_manager):
+async def delete_conversation(chat_component, provider_manager):
     selected_item = chat_component.chat_log_listbox.currentItem()
     if not selected_item:
         logger.error("No chat log selected for deletion")        
@@ -105,8 +172,7 @@ def delete_conversation(chat_component, provider_manager):
 
     selected_chat_log = selected_item.text()
 
-    parts = selected_chat_log.split("@@")
-    conversation_id = parts[0], parts[1]  
+    _, conversation_id = selected_chat_log.rsplit("@@", 1)
     user = chat_component.user
 
     persona_name = chat_component.current_persona.get('name') if chat_component.current_persona else 'Unknown'
@@ -115,21 +181,12 @@ def delete_conversation(chat_component, provider_manager):
     # Use chat_component.conversation_manager directly
     conversation_manager = chat_component.conversation_manager
 
-    conversation_manager.delete_conversation(user, conversation_id)
+    await conversation_manager.delete_conversation(user, conversation_id)
 
     chat_component.chat_log_listbox.takeItem(chat_component.chat_log_listbox.row(selected_item))
 
     logger.info(f"Chat log deleted: {selected_chat_log}")
 
-    chat_component.chat_log_listbox.clear()
-    chat_logs = conversation_manager.get_conversations(user, persona=persona_name)
-    for chat_log_tuple in chat_logs:
-        _, timestamp, persona, conversation_id, name = chat_log_tuple
-        display_name = name if name else persona
-        formatted_timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").strftime("%b %d, %Y")
-        entry = f"{display_name}: {formatted_timestamp}@@{conversation_id}"
-        chat_component.chat_log_listbox.addItem(entry)
-
 async def clear_chat_log(chat_component, provider_manager, cognitive_services):
     logger.info("Clearing chat log in the chat component")
     
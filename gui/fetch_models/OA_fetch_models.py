@@ -1,6 +1,6 @@
-import aiohttp
 import os
 from modules.logging.logger import setup_logger
+from modules.Providers.transport import get_transport
 
 logger = setup_logger('OA_fetch_models.py')
 
@@ -14,27 +14,26 @@ async def fetch_models_openai(chat_log):
     url = "https://api.openai.com/v1/models"
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    models = await response.json()
-
-                    # Enable editing in the QTextEdit
-                    chat_log.setReadOnly(False)
-
-                    # Append available models to the QTextEdit
-                    chat_log.append("Available models:\n")
-                    for model in models["data"]:
-                        chat_log.append(f"{model['id']}\n")
-
-                    # Disable editing in the QTextEdit
-                    chat_log.setReadOnly(True)
-
-                    # Scroll to the bottom of the QTextEdit
-                    scrollbar = chat_log.verticalScrollBar()
-                    scrollbar.setValue(scrollbar.maximum())
-                else:
-                    logger.error(f"Error fetching OpenAI models: HTTP {response.status}")
+        async with get_transport("OpenAI").request("GET", url, headers=headers) as response:
+            if response.status == 200:
+                models = await response.json()
+
+                # Enable editing in the QTextEdit
+                chat_log.setReadOnly(False)
+
+                # Append available models to the QTextEdit
+                chat_log.append("Available models:\n")
+                for model in models["data"]:
+                    chat_log.append(f"{model['id']}\n")
+
+                # Disable editing in the QTextEdit
+                chat_log.setReadOnly(True)
+
+                # Scroll to the bottom of the QTextEdit
+                scrollbar = chat_log.verticalScrollBar()
+                scrollbar.setValue(scrollbar.maximum())
+            else:
+                logger.error(f"Error fetching OpenAI models: HTTP {response.status}")
     except Exception as e:
         logger.error("An error occurred while fetching OpenAI models", exc_info=True)
 
@@ -1,6 +1,8 @@
 # gui/send_message.py
 
 import asyncio
+from modules.Analytics.tracing import span
+from modules.Background_Services.job_scheduler import foreground
 from modules.logging.logger import setup_logger
 
 logger = setup_logger('send_message.py')
@@ -18,26 +20,33 @@ async def send_message(chat_component, user, message, session_id, conversation_i
 async def process_message(chat_component, user, message, session_id, conversation_id, conversation_manager, model_manager, provider_manager):
     logger.info("process_message called")
 
-    try:
-        response = await asyncio.create_task(
-            chat_component.provider_manager.generate_response(
-                user, 
-                chat_component.current_persona, 
-                message, 
-                session_id, 
-                conversation_id, 
-                chat_component.temperature, 
-                chat_component.top_p, 
-                chat_component.top_k,
-                conversation_manager, 
-                model_manager,  
-                provider_manager  
-            )
-        )
-        logger.info("Response received")
-        chat_component.show_message("system", response)
-    except Exception as e:
-        logger.error(f"Error in process_message: {e}")
-        chat_component.show_message("system", "An error occurred while processing your message.")
+    # One trace per turn; the provider, tool, database and TTS spans below nest under it.
+    with span("turn", user=user, conversation_id=conversation_id) as turn:
+        try:
+            # Background jobs wait while the user is waiting on a reply.
+            async with foreground.active():
+                with span("provider.generate_response", provider=chat_component.provider_manager.current_llm_provider):
+                    response = await asyncio.create_task(
+                        chat_component.provider_manager.generate_response(
+                            user, 
+                            chat_component.current_persona, 
+                            message, 
+                            session_id, 
+                            conversation_id, 
+                            chat_component.temperature, 
+                            chat_component.top_p, 
+                            chat_component.top_k,
+                            conversation_manager, 
+                            model_manager,  
+                            provider_manager  
+                        )
+                    )
+            logger.info("Response received")
+            with span("gui.show_message"):
+                chat_component.show_message("system", response)
+        except Exception as e:
+            logger.error(f"Error in process_message: {e}")
+            turn.set("error", f"{type(e).__name__}: {e}")
+            chat_component.show_message("system", "An error occurred while processing your message.")
     
     logger.info("process_message completed")
\ No newline at end of file
@@ -0,0 +1,83 @@
+# modules/Analytics/event_loop_monitor.py
+
+import asyncio
+from collections import deque
+
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('event_loop_monitor.py')
+
+# How often the loop is probed, in seconds.
+PROBE_INTERVAL = 0.05
+
+# Number of probes kept when computing percentiles.
+LAG_WINDOW = 4096
+
+# A single probe late by more than this many seconds is logged as a stall.
+STALL_THRESHOLD = 0.1
+
+
+class EventLoopLagMonitor:
+    """
+    Measures how long the asyncio event loop takes to get back to a task that asked to sleep.
+
+    Anything that blocks the loop - a synchronous SQLite commit, a large json.dumps, a blocking
+    HTTP call - delays every other task and, because the same loop pumps the Qt event queue,
+    freezes the window. A probe task sleeps PROBE_INTERVAL and records how late it woke up;
+    summary() reports the p50/p99/max of that lag over the most recent window of probes.
+    """
+
+    def __init__(self, interval=PROBE_INTERVAL, window=LAG_WINDOW, stall_threshold=STALL_THRESHOLD):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.lags = deque(maxlen=window)
+        self.stalls = 0
+        self._task = None
+
+    def start(self):
+        """Starts probing on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._probe())
+        return self._task
+
+    async def _probe(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                start = loop.time()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - start - self.interval)
+                self.lags.append(lag)
+                if lag > self.stall_threshold:
+                    self.stalls += 1
+                    logger.warning(f"Event loop stalled for {lag * 1000:.0f} ms")
+        except asyncio.CancelledError:
+            pass
+
+    def summary(self):
+        """Returns the probe count and the p50/p99/max lag in milliseconds."""
+        lags = sorted(self.lags)
+        if not lags:
+            return {"count": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0, "stalls": self.stalls}
+        return {
+            "count": len(lags),
+            "p50_ms": lags[len(lags) // 2] * 1000,
+            "p99_ms": lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000,
+            "max_ms": lags[-1] * 1000,
+            "stalls": self.stalls,
+        }
+
+    def report(self):
+        row = self.summary()
+        logger.info(f"Event loop lag over {row['count']} probes: p50={row['p50_ms']:.1f}ms p99={row['p99_ms']:.1f}ms max={row['max_ms']:.1f}ms, {row['stalls']} stalls")
+
+    def reset(self):
+        self.lags.clear()
+        self.stalls = 0
+
+    def stop(self):
+        """Stops probing and logs the final report."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.report()
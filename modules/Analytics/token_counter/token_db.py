@@ -1,32 +1,51 @@
 # modules/token_counter/token_db.py
 
+import atexit
+import queue
 import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from modules.chat_history.DatabaseContextManager import DatabaseContextManager
+from modules.chat_history.connection_pool import get_pool
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('token_db.py')
 
 DATABASE_PATH = 'modules/Analytics/token_counter/token.db'
 
-def setup_database():
-    """
-    Sets up the database tables if they do not exist.
-    Adds an 'organization' column to the 'token_usage' table.
-    """
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+# Seconds a recorded usage may wait in memory before its batch is written, and the most rows per batch.
+FLUSH_INTERVAL = 2.0
+BATCH_SIZE = 500
+
+# Columns usage can be grouped by in TokenUsageRecorder.usage.
+GROUP_COLUMNS = ("organization", "user", "conversation_id", "model", "day", "hour")
 
-    cursor.execute('''
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+DAY_FORMAT = "%Y-%m-%d"
+
+_STOP = object()
+# Ends the current batch early, so flush() does not wait out FLUSH_INTERVAL.
+_FLUSH = object()
+
+
+def _baseline(conn):
+    """Version 1: the original tables."""
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS token_usage (
             id INTEGER PRIMARY KEY,
             organization TEXT,
             user TEXT,
             session_id TEXT,
-            conversation_id TEXT,  
+            conversation_id TEXT,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
             model TEXT,
             prompt_tokens INTEGER,
             completion_tokens INTEGER,
             total_tokens INTEGER
         )''')
-    
-    cursor.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS model_token_counters (
             model TEXT PRIMARY KEY,
             organization TEXT,
@@ -35,13 +54,400 @@ def setup_database():
             cumulative_total_tokens INTEGER DEFAULT 0
         )''')
 
-    conn.commit()
-    conn.close()
+
+_ROLLUP_COLUMNS = '''
+            organization TEXT NOT NULL DEFAULT '',
+            user TEXT NOT NULL DEFAULT '',
+            conversation_id TEXT NOT NULL DEFAULT '',
+            model TEXT NOT NULL DEFAULT '',
+            requests INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            total_tokens INTEGER NOT NULL DEFAULT 0,'''
+
+
+def _rollups(conn):
+    """
+    Version 2: counters keyed by organization and model, and hourly and daily rollups.
+
+    The counters and rollups are maintained with INSERT ... ON CONFLICT DO UPDATE, which needs a
+    unique key without NULLs, so a missing organization, user or conversation is stored as ''.
+    Both rollups are backfilled from the raw rows already recorded.
+    """
+    conn.execute('''
+        CREATE TABLE model_token_counters_new (
+            organization TEXT NOT NULL DEFAULT '',
+            model TEXT NOT NULL,
+            cumulative_prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            cumulative_completion_tokens INTEGER NOT NULL DEFAULT 0,
+            cumulative_total_tokens INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (organization, model)
+        )''')
+    conn.execute('''
+        INSERT INTO model_token_counters_new
+        SELECT COALESCE(organization, ''), model, SUM(cumulative_prompt_tokens), SUM(cumulative_completion_tokens), SUM(cumulative_total_tokens)
+        FROM model_token_counters WHERE model IS NOT NULL
+        GROUP BY COALESCE(organization, ''), model''')
+    conn.execute('DROP TABLE model_token_counters')
+    conn.execute('ALTER TABLE model_token_counters_new RENAME TO model_token_counters')
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_token_usage_timestamp ON token_usage (timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_token_usage_conversation ON token_usage (conversation_id, timestamp)')
+
+    for table, bucket, expression in (
+        ("token_usage_hourly", "hour", "strftime('%Y-%m-%d %H:00:00', timestamp)"),
+        ("token_usage_daily", "day", "date(timestamp)"),
+    ):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {bucket} TEXT NOT NULL,{_ROLLUP_COLUMNS}
+                PRIMARY KEY ({bucket}, organization, user, conversation_id, model)
+            )''')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_model ON {table} (model, {bucket})')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_user ON {table} (user, {bucket})')
+        conn.execute(f'''
+            INSERT INTO {table} ({bucket}, organization, user, conversation_id, model, requests, prompt_tokens, completion_tokens, total_tokens)
+            SELECT {expression}, COALESCE(organization, ''), COALESCE(user, ''), COALESCE(conversation_id, ''), COALESCE(model, ''),
+                   COUNT(*), SUM(COALESCE(prompt_tokens, 0)), SUM(COALESCE(completion_tokens, 0)), SUM(COALESCE(total_tokens, 0))
+            FROM token_usage
+            GROUP BY 1, 2, 3, 4, 5''')
+
+
+# Ordered list of (version, step), applied like the chat history migrations: every step above the
+# database's PRAGMA user_version runs in its own transaction, together with the version bump.
+MIGRATIONS = [
+    (1, _baseline),
+    (2, _rollups),
+]
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def setup_database(db_path=DATABASE_PATH):
+    """
+    Sets up the database tables if they do not exist and upgrades an older database in place.
+    """
+    with _migrate_lock:
+        if db_path in _migrated:
+            return
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            version = conn.execute("PRAGMA user_version;").fetchone()[0]
+            for target, step in MIGRATIONS:
+                if target <= version:
+                    continue
+                conn.execute("BEGIN IMMEDIATE;")
+                try:
+                    step(conn)
+                    conn.execute(f"PRAGMA user_version={int(target)};")
+                    conn.execute("COMMIT;")
+                except sqlite3.Error:
+                    conn.execute("ROLLBACK;")
+                    raise
+                logger.info(f"Token usage database migrated to version {target}")
+        finally:
+            conn.close()
+        _migrated.add(db_path)
+
+
+def _utc_timestamp(seconds=None):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(seconds))
+
+
+def _parse_time(value):
+    """Accepts a datetime (naive means UTC) or a 'YYYY-MM-DD[ HH:MM:SS]' string in UTC."""
+    if value is None or isinstance(value, datetime):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+    return datetime.strptime(value, TIMESTAMP_FORMAT if len(value) > 10 else DAY_FORMAT)
+
+
+class TokenUsageRecorder:
+    """
+    Records token usage without touching the disk on the caller's thread.
+
+    record() only appends to an in-memory queue. A writer thread collects whatever arrives within
+    FLUSH_INTERVAL seconds, up to BATCH_SIZE rows, and commits it in one transaction: the raw
+    rows with one executemany, and the per-model counters and the hourly and daily rollups with
+    one INSERT ... ON CONFLICT DO UPDATE per distinct key, already summed over the batch.
+    Concurrent recorders on the same file therefore add to the counters instead of overwriting them.
+
+    usage() answers from the rollups, so its cost depends on the number of hours and days in the
+    range, not on the number of requests recorded.
+    """
+
+    def __init__(self, db_path=DATABASE_PATH, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self.batches_committed = 0
+        setup_database(db_path)
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"token-usage-writer:{db_path}", daemon=True)
+        self._thread.start()
+
+    def record(self, model, prompt_tokens, completion_tokens, total_tokens=None, user=None, conversation_id=None,
+               session_id=None, organization=None, timestamp=None):
+        """
+        Queues the token usage of one request.
+
+        Parameters:
+        - model (str): The model used for the query.
+        - prompt_tokens (int): The number of tokens used in the prompt.
+        - completion_tokens (int): The number of tokens generated as completion.
+        - total_tokens (int, optional): The total number of tokens used; prompt plus completion by default.
+        - user (str, optional): The user who made the query.
+        - conversation_id (str, optional): The conversation the query was made from.
+        - session_id (str, optional): The session ID during which the query was made.
+        - organization (str, optional): The organization under which the query was made.
+        - timestamp (float, optional): Unix time of the request; now by default.
+        """
+        if self._closed:
+            raise RuntimeError("Token usage recorder is closed")
+        prompt_tokens = prompt_tokens or 0
+        completion_tokens = completion_tokens or 0
+        if total_tokens is None:
+            total_tokens = prompt_tokens + completion_tokens
+        self._queue.put((organization, user, session_id, conversation_id, _utc_timestamp(timestamp), model,
+                         prompt_tokens, completion_tokens, total_tokens))
+
+    def flush(self):
+        """Blocks until every usage recorded so far has been committed."""
+        self._queue.put(_FLUSH)
+        self._queue.join()
+
+    def close(self):
+        """Writes outstanding usage and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        logger.info(f"Token usage recorder closed after {self.rows_written} rows in {self.batches_committed} batches")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+            if item is _FLUSH:
+                self._queue.task_done()
+                continue
+
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _FLUSH:
+                    self._queue.task_done()
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            if stop:
+                self._queue.task_done()
+                return
+
+    def _write(self, rows):
+        counters, hourly, daily = {}, {}, {}
+        for organization, user, session_id, conversation_id, timestamp, model, prompt, completion, total in rows:
+            key = (organization or '', user or '', conversation_id or '', model or '')
+            for totals, bucket_key in (
+                (counters, (key[0], key[3])),
+                (hourly, (timestamp[:13] + ":00:00",) + key),
+                (daily, (timestamp[:10],) + key),
+            ):
+                sums = totals.setdefault(bucket_key, [0, 0, 0, 0])
+                sums[0] += 1
+                sums[1] += prompt
+                sums[2] += completion
+                sums[3] += total
+
+        conn = get_pool(self.db_path).connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            conn.executemany('''
+                INSERT INTO token_usage (organization, user, session_id, conversation_id, timestamp, model, prompt_tokens, completion_tokens, total_tokens)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+            conn.executemany('''
+                INSERT INTO model_token_counters (organization, model, cumulative_prompt_tokens, cumulative_completion_tokens, cumulative_total_tokens)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (organization, model) DO UPDATE SET
+                    cumulative_prompt_tokens = cumulative_prompt_tokens + excluded.cumulative_prompt_tokens,
+                    cumulative_completion_tokens = cumulative_completion_tokens + excluded.cumulative_completion_tokens,
+                    cumulative_total_tokens = cumulative_total_tokens + excluded.cumulative_total_tokens''',
+                [key + tuple(sums[1:]) for key, sums in counters.items()])
+            for table, bucket, totals in (("token_usage_hourly", "hour", hourly), ("token_usage_daily", "day", daily)):
+                conn.executemany(f'''
+                    INSERT INTO {table} ({bucket}, organization, user, conversation_id, model, requests, prompt_tokens, completion_tokens, total_tokens)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT ({bucket}, organization, user, conversation_id, model) DO UPDATE SET
+                        requests = requests + excluded.requests,
+                        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                        completion_tokens = completion_tokens + excluded.completion_tokens,
+                        total_tokens = total_tokens + excluded.total_tokens''',
+                    [key + tuple(sums) for key, sums in totals.items()])
+            conn.commit()
+            self.rows_written += len(rows)
+            self.batches_committed += 1
+        except sqlite3.Error as e:
+            conn.rollback()
+            logger.error(f"Dropping token usage batch of {len(rows)} rows: {e}")
+
+    def usage(self, start=None, end=None, group_by=("model",), model=None, user=None, conversation_id=None, organization=None):
+        """
+        Sums token usage over a time range from the hourly and daily rollups.
+
+        The range is [start, end) in UTC at hour resolution: start is rounded down and end up to
+        a whole hour. Whole days inside it are read from the daily rollup, the hours at either
+        edge from the hourly one. Usage still waiting in memory is flushed first.
+
+        Parameters:
+        - start, end (datetime or str, optional): Bounds of the range; unbounded when None.
+        - group_by (tuple): Columns to group by, from GROUP_COLUMNS; "day" and "hour" give a time series.
+        - model, user, conversation_id, organization (str, optional): Only count matching usage.
+
+        Returns:
+        A list of dictionaries with the group_by columns and requests, prompt_tokens,
+        completion_tokens and total_tokens, ordered by the group_by columns.
+        """
+        for column in group_by:
+            if column not in GROUP_COLUMNS:
+                raise ValueError(f"Cannot group token usage by {column!r}")
+        self.flush()
+
+        start = _parse_time(start)
+        end = _parse_time(end)
+        if start is not None:
+            start = start.replace(minute=0, second=0, microsecond=0)
+        if end is not None and end != end.replace(minute=0, second=0, microsecond=0):
+            end = end.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+        # Whole days in the range, unless the series is per hour.
+        day_start = start if start is None or start.hour == 0 else start.replace(hour=0) + timedelta(days=1)
+        day_end = end if end is None else end.replace(hour=0)
+        use_days = "hour" not in group_by and (day_start is None or day_end is None or day_start < day_end)
+
+        filters, filter_parameters = [], []
+        for column, value in (("model", model), ("user", user), ("conversation_id", conversation_id), ("organization", organization)):
+            if value is not None:
+                filters.append(f"{column} = ?")
+                filter_parameters.append(value)
+
+        def select(table, bucket, day_expression, hour_expression, ranges):
+            conditions, parameters = [], []
+            for low, high in ranges:
+                bounds = []
+                if low is not None:
+                    bounds.append(f"{bucket} >= ?")
+                    parameters.append(low)
+                if high is not None:
+                    bounds.append(f"{bucket} < ?")
+                    parameters.append(high)
+                conditions.append(" AND ".join(bounds) or "1")
+            where = [f"({' OR '.join(f'({condition})' for condition in conditions)})"] + filters
+            return (f'''
+                SELECT {day_expression} AS day, {hour_expression} AS hour, organization, user, conversation_id, model,
+                       requests, prompt_tokens, completion_tokens, total_tokens
+                FROM {table} WHERE {" AND ".join(where)}''', parameters + filter_parameters)
+
+        def hour_key(value):
+            return None if value is None else value.strftime(TIMESTAMP_FORMAT)
+
+        parts = []
+        if use_days:
+            parts.append(select("token_usage_daily", "day", "day", "NULL", [(
+                None if day_start is None else day_start.strftime(DAY_FORMAT),
+                None if day_end is None else day_end.strftime(DAY_FORMAT),
+            )]))
+            edges = []
+            if start is not None and start != day_start:
+                edges.append((hour_key(start), hour_key(day_start)))
+            if end is not None and end != day_end:
+                edges.append((hour_key(day_end), hour_key(end)))
+            if edges:
+                parts.append(select("token_usage_hourly", "hour", "substr(hour, 1, 10)", "hour", edges))
+        else:
+            parts.append(select("token_usage_hourly", "hour", "substr(hour, 1, 10)", "hour", [(hour_key(start), hour_key(end))]))
+
+        columns = ", ".join(group_by)
+        sql = f'''
+            SELECT {columns + ", " if columns else ""}SUM(requests), SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens)
+            FROM ({" UNION ALL ".join(part[0] for part in parts)})
+            {f"GROUP BY {columns} ORDER BY {columns}" if columns else ""}'''
+        parameters = [parameter for part in parts for parameter in part[1]]
+
+        with DatabaseContextManager(self.db_path) as cursor:
+            cursor.execute(sql, parameters)
+            rows = cursor.fetchall()
+        keys = tuple(group_by) + ("requests", "prompt_tokens", "completion_tokens", "total_tokens")
+        return [dict(zip(keys, row)) for row in rows if row[len(group_by)] is not None]
+
+    def model_counters(self, organization=None):
+        """Returns the cumulative token counters per model, optionally of one organization."""
+        self.flush()
+        with DatabaseContextManager(self.db_path) as cursor:
+            cursor.execute('''
+                SELECT organization, model, cumulative_prompt_tokens, cumulative_completion_tokens, cumulative_total_tokens
+                FROM model_token_counters WHERE ? IS NULL OR organization = ? ORDER BY organization, model''',
+                (organization, organization))
+            return [
+                {"organization": row[0], "model": row[1], "prompt_tokens": row[2], "completion_tokens": row[3], "total_tokens": row[4]}
+                for row in cursor.fetchall()
+            ]
+
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+def get_token_usage_recorder(db_path=DATABASE_PATH):
+    """Returns the recorder shared by every component writing to db_path."""
+    recorder = _recorders.get(db_path)
+    if recorder is None:
+        with _recorders_lock:
+            recorder = _recorders.get(db_path)
+            if recorder is None:
+                recorder = _recorders[db_path] = TokenUsageRecorder(db_path)
+    return recorder
+
+
+def close_token_usage_recorder(db_path=DATABASE_PATH):
+    with _recorders_lock:
+        recorder = _recorders.pop(db_path, None)
+    if recorder is not None:
+        recorder.close()
+
+
+@atexit.register
+def close_all_token_usage_recorders():
+    with _recorders_lock:
+        recorders = list(_recorders.values())
+        _recorders.clear()
+    for recorder in recorders:
+        recorder.close()
 
 
 def insert_token_usage(organization, user, session_id, conversation_id, model, prompt_tokens, completion_tokens, total_tokens):
     """
-    Inserts the token usage into the SQLite database.
+    Records the token usage of one query; the cumulative model counters are updated with it.
 
     Parameters:
     - organization (str): The organization under which the query was made.
@@ -53,51 +459,5 @@ def insert_token_usage(organization, user, session_id, conversation_id, model, p
     - completion_tokens (int): The number of tokens generated as completion.
     - total_tokens (int): The total number of tokens used.
     """
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        INSERT INTO token_usage (organization, user, session_id, conversation_id, model, prompt_tokens, completion_tokens, total_tokens) 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                   (organization, user, session_id, conversation_id, model, prompt_tokens, completion_tokens, total_tokens))
-    conn.commit()
-    conn.close()
-
-def update_model_token_counters(organization, model, prompt_tokens, completion_tokens, total_tokens):
-    """
-    Updates the rolling counters of individual model token usage.
-
-    Parameters:
-    - organization (str): The organization under which the query was made.
-    - model (str): The model for which the tokens are counted.
-    - prompt_tokens (int), completion_tokens (int), total_tokens (int): The token counts to be updated.
-    """
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT cumulative_prompt_tokens, cumulative_completion_tokens, cumulative_total_tokens 
-        FROM model_token_counters WHERE model = ? AND organization = ?''', (model, organization))
-    row = cursor.fetchone()
-
-    if row:
-        new_prompt_tokens = row[0] + prompt_tokens
-        new_completion_tokens = row[1] + completion_tokens
-        new_total_tokens = row[2] + total_tokens
-
-        cursor.execute('''
-            UPDATE model_token_counters 
-            SET cumulative_prompt_tokens = ?, cumulative_completion_tokens = ?, cumulative_total_tokens = ? 
-            WHERE model = ? AND organization = ?''',
-                       (new_prompt_tokens, new_completion_tokens, new_total_tokens, model, organization))
-    else:
-        cursor.execute('''
-            INSERT INTO model_token_counters (organization, model, cumulative_prompt_tokens, cumulative_completion_tokens, cumulative_total_tokens)
-            VALUES (?, ?, ?, ?, ?)''',
-                       (organization, model, prompt_tokens, completion_tokens, total_tokens))
-
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    get_token_usage_recorder().record(model, prompt_tokens, completion_tokens, total_tokens, user, conversation_id,
+                                      session_id, organization)
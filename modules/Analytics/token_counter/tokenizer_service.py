@@ -0,0 +1,247 @@
+# modules/Analytics/token_counter/tokenizer_service.py
+
+import argparse
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('tokenizer_service.py')
+
+# BPE vocabularies shipped with the application. tiktoken reads them from here instead of
+# downloading them, so exact counts work offline; fill it once with --bundle.
+VOCABULARY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vocabularies')
+
+# Tokenizer family per model, matched against the start of the model name in this order.
+# Families ending in _base are tiktoken encodings; the others are counted heuristically.
+MODEL_FAMILIES = [
+    ("gpt-4o", "o200k_base"),
+    ("chatgpt-4o", "o200k_base"),
+    ("o1", "o200k_base"),
+    ("gpt-4", "cl100k_base"),
+    ("gpt-3.5", "cl100k_base"),
+    ("claude", "claude"),
+    ("gemini", "gemini"),
+    ("models/gemini", "gemini"),
+    ("mistral", "mistral"),
+    ("open-mistral", "mistral"),
+]
+
+# Average characters per token of each family, used when no exact tokenizer is available.
+# "default" is what the chat history stores its model-independent token counts with.
+CHARS_PER_TOKEN = {
+    "default": 4.0,
+    "o200k_base": 4.0,
+    "cl100k_base": 4.0,
+    "claude": 3.5,
+    "gemini": 4.0,
+    "mistral": 3.7,
+}
+
+# Tokens every message costs on top of its content (role and separators in the chat format).
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# USD per million prompt / completion tokens, matched like MODEL_FAMILIES. List prices at the
+# time of writing; models not listed get no cost estimate.
+PRICES_PER_MILLION = [
+    ("gpt-4o-mini", 0.15, 0.60),
+    ("gpt-4o", 2.50, 10.00),
+    ("chatgpt-4o", 5.00, 15.00),
+    ("o1-mini", 3.00, 12.00),
+    ("o1", 15.00, 60.00),
+    ("gpt-4-turbo", 10.00, 30.00),
+    ("gpt-4-1106", 10.00, 30.00),
+    ("gpt-4-0125", 10.00, 30.00),
+    ("gpt-4", 30.00, 60.00),
+    ("claude-3-5-sonnet", 3.00, 15.00),
+    ("claude-3-opus", 15.00, 75.00),
+    ("claude-3-sonnet", 3.00, 15.00),
+    ("claude-3-haiku", 0.25, 1.25),
+    ("gemini-1.5-pro", 1.25, 5.00),
+    ("gemini-1.5-flash", 0.075, 0.30),
+    ("mistral-large", 2.00, 6.00),
+    ("open-mistral-nemo", 0.15, 0.15),
+]
+
+# Memoized counts kept per service; one entry per distinct (family, content).
+MEMO_SIZE = 65536
+
+
+def _match(table, model):
+    if model:
+        for entry in table:
+            if model.startswith(entry[0]):
+                return entry
+    return None
+
+
+class HeuristicTokenizer:
+    """Estimates tokens from the text length."""
+
+    exact = False
+
+    def __init__(self, chars_per_token):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text):
+        return math.ceil(len(text) / self.chars_per_token) if text else 0
+
+
+class TiktokenTokenizer:
+    """Counts tokens exactly with a tiktoken BPE encoding."""
+
+    exact = True
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+
+    def count(self, text):
+        # Special-token markers in user text are counted as plain text, as the API does.
+        return len(self.encoding.encode(text, disallowed_special=())) if text else 0
+
+
+class TokenizerService:
+    """
+    Counts prompt tokens locally, before a request is sent.
+
+    The model name selects a tokenizer family. OpenAI families are counted exactly with
+    tiktoken when it is installed and its vocabulary is available (bundled in VOCABULARY_DIR or
+    in tiktoken's own cache); everything else falls back to a per-family characters-per-token
+    estimate. Tokenizers are created once per family, and counts are memoized by family and
+    content hash, so counting a history again only tokenizes the messages added since.
+    """
+
+    def __init__(self, memo_size=MEMO_SIZE):
+        self.memo_size = memo_size
+        self._tokenizers = {}
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def family(model=None):
+        entry = _match(MODEL_FAMILIES, model)
+        return entry[1] if entry else "default"
+
+    def tokenizer(self, family):
+        tokenizer = self._tokenizers.get(family)
+        if tokenizer is None:
+            tokenizer = self._load(family)
+            with self._lock:
+                tokenizer = self._tokenizers.setdefault(family, tokenizer)
+        return tokenizer
+
+    def _load(self, family):
+        if tiktoken is not None and family.endswith("_base"):
+            if "TIKTOKEN_CACHE_DIR" not in os.environ and os.path.isdir(VOCABULARY_DIR):
+                os.environ["TIKTOKEN_CACHE_DIR"] = VOCABULARY_DIR
+            try:
+                return TiktokenTokenizer(tiktoken.get_encoding(family))
+            except Exception as e:
+                # No bundled or cached vocabulary and no network.
+                logger.warning(f"Tokenizer {family} unavailable, estimating its token counts instead: {e}")
+        return HeuristicTokenizer(CHARS_PER_TOKEN.get(family, CHARS_PER_TOKEN["default"]))
+
+    def count_text(self, text, model=None):
+        """Returns the number of tokens text takes for model; model-independent estimate when model is None."""
+        if not text:
+            return 0
+        family = self.family(model)
+        key = (family, hash(text), len(text))
+        count = self._memo.get(key)
+        if count is not None:
+            return count
+        count = self.tokenizer(family).count(text)
+        with self._lock:
+            self._memo[key] = count
+            if len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return count
+
+    def count_message(self, message, model=None):
+        """Tokens of one chat message: its content, any tool call it carries, and the per-message overhead."""
+        content = message.get("content")
+        if content is not None and not isinstance(content, str):
+            content = json.dumps(content, ensure_ascii=False)
+        tokens = self.count_text(content, model) + MESSAGE_OVERHEAD_TOKENS
+        for key in ("function_call", "tool_calls"):
+            if message.get(key):
+                tokens += self.count_text(json.dumps(message[key], ensure_ascii=False), model)
+        return tokens
+
+    def count_messages(self, messages, model=None, functions=None):
+        """Prompt tokens of a request made of messages, plus the function definitions sent with it."""
+        tokens = sum(self.count_message(message, model) for message in messages)
+        if functions:
+            tokens += self.count_text(json.dumps(functions), model)
+        return tokens
+
+    def estimate_cost(self, messages, model, max_completion_tokens=0, functions=None):
+        """
+        Estimates what a request will cost before it is sent.
+
+        Returns:
+        Dictionary with prompt_tokens, max_completion_tokens, exact (whether the prompt was
+        counted with the model's own tokenizer) and prompt_cost / max_total_cost in USD, which
+        are None for models without a known price.
+        """
+        prompt_tokens = self.count_messages(messages, model, functions)
+        price = _match(PRICES_PER_MILLION, model)
+        estimate = {
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "max_completion_tokens": max_completion_tokens,
+            "exact": self.tokenizer(self.family(model)).exact,
+            "prompt_cost": None,
+            "max_total_cost": None,
+        }
+        if price:
+            estimate["prompt_cost"] = prompt_tokens * price[1] / 1_000_000
+            estimate["max_total_cost"] = estimate["prompt_cost"] + max_completion_tokens * price[2] / 1_000_000
+        return estimate
+
+    def clear(self):
+        with self._lock:
+            self._memo.clear()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_tokenizer_service():
+    """Returns the process-wide tokenizer service."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = TokenizerService()
+    return _service
+
+
+if __name__ == "__main__":
+    # python -m modules.Analytics.token_counter.tokenizer_service --bundle
+    parser = argparse.ArgumentParser(description="Count tokens locally, or bundle the BPE vocabularies for offline use.")
+    parser.add_argument("--bundle", action="store_true", help=f"download the tiktoken vocabularies into {VOCABULARY_DIR}")
+    parser.add_argument("--model", help="model to count for")
+    parser.add_argument("text", nargs="?", help="text to count")
+    args = parser.parse_args()
+
+    if args.bundle:
+        if tiktoken is None:
+            raise SystemExit("tiktoken is not installed")
+        os.makedirs(VOCABULARY_DIR, exist_ok=True)
+        os.environ["TIKTOKEN_CACHE_DIR"] = VOCABULARY_DIR
+        for family in sorted({family for _, family in MODEL_FAMILIES if family.endswith("_base")}):
+            tiktoken.get_encoding(family)
+            print(f"bundled {family}")
+    if args.text is not None:
+        service = get_tokenizer_service()
+        print(service.count_text(args.text, args.model))
@@ -0,0 +1,354 @@
+# modules/Analytics/tracing.py
+
+import argparse
+import atexit
+import contextvars
+import functools
+import glob
+import inspect
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from logging.handlers import QueueListener, RotatingFileHandler
+
+from modules.chat_history.connection_pool import StatementStats
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('tracing.py')
+
+# Where spans go, read at startup: "memory", "file" or both ("memory,file"); empty turns tracing off.
+TRACE_ENV = 'SCOUT_TRACE'
+
+TRACE_FILE = 'modules/logging/traces.jsonl'
+TRACE_FILE_MAX_BYTES = 20 * 1024 * 1024
+TRACE_FILE_BACKUPS = 3
+
+# Finished spans kept by the in-process ring buffer.
+RING_BUFFER_SIZE = 20000
+
+# Turns listed by summarize() and the summary command.
+SLOWEST_TURNS = 10
+
+_current_span = contextvars.ContextVar('scout_current_span', default=None)
+_span_ids = itertools.count(1)
+_tracer = None
+
+
+class _NoopSpan:
+    """What span() returns while tracing is off: entering and leaving it costs one method call each."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    One timed stage of a turn.
+
+    Entering a span makes it the current span of the running task or thread, so spans opened
+    inside it, including in coroutines it awaits and in work it hands to a DatabaseExecutor,
+    become its children. A span without a parent starts a new trace; every span of a turn shares
+    its trace_id.
+    """
+
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'attributes', 'start', '_perf', '_token')
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start = None
+        self._perf = None
+        self._token = None
+
+    def set(self, key, value):
+        """Adds an attribute, e.g. a result known only at the end of the stage."""
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.start = time.time()
+        self._perf = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._perf
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Left in another context than it was entered in; nothing to restore there.
+            pass
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": duration * 1000,
+            "thread": threading.current_thread().name,
+            "status": "ok" if exc_type is None else "error",
+        }
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        if self.attributes:
+            record["attributes"] = self.attributes
+        self.tracer.export(record)
+        return False
+
+
+class RingBufferExporter:
+    """Keeps the most recent finished spans in memory."""
+
+    def __init__(self, size=RING_BUFFER_SIZE):
+        self.spans = deque(maxlen=size)
+
+    def export(self, record):
+        self.spans.append(record)
+
+    def close(self):
+        pass
+
+
+class _SpanFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+
+class JsonlExporter:
+    """
+    Appends finished spans to a rotating JSON-lines file.
+
+    Spans are handed to a writer thread through a queue, like log records, so serializing and
+    writing them never happens on the traced code path.
+    """
+
+    def __init__(self, path=TRACE_FILE, max_bytes=TRACE_FILE_MAX_BYTES, backups=TRACE_FILE_BACKUPS):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+        handler.setFormatter(_SpanFormatter())
+        self._listener = QueueListener(self._queue, handler)
+        self._listener.start()
+
+    def export(self, record):
+        self._queue.put_nowait(logging.makeLogRecord({"msg": record}))
+
+    def close(self):
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
+
+
+class Tracer:
+    """Hands every finished span to its exporters."""
+
+    def __init__(self, exporters):
+        self.exporters = exporters
+
+    def export(self, record):
+        for exporter in self.exporters:
+            exporter.export(record)
+
+    def ring_buffer(self):
+        for exporter in self.exporters:
+            if isinstance(exporter, RingBufferExporter):
+                return exporter
+        return None
+
+    def close(self):
+        for exporter in self.exporters:
+            exporter.close()
+
+
+def span(name, root=True, **attributes):
+    """
+    Returns a context manager timing the stage name, with attributes stored on the span.
+
+    While tracing is off this returns NOOP_SPAN without doing anything else. With root=False the
+    span is only recorded inside a trace that is already running, so shared code such as the
+    database executor does not start traces of its own for background work.
+    """
+    if _tracer is None:
+        return NOOP_SPAN
+    parent = _current_span.get()
+    if parent is None and not root:
+        return NOOP_SPAN
+    return Span(_tracer, name, parent, attributes)
+
+
+def traced(name, root=True):
+    """Decorator running every call of a function or coroutine function in span(name)."""
+    def decorate(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return await function(*args, **kwargs)
+                with span(name, root):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return function(*args, **kwargs)
+                with span(name, root):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def current_span():
+    """Returns the span the caller runs in, or None outside a trace or while tracing is off."""
+    return _current_span.get()
+
+
+def enable_tracing(memory=True, path=None):
+    """
+    Starts recording spans, into the in-process ring buffer and/or the JSON-lines file at path.
+
+    Replaces the exporters of a previous call.
+    """
+    global _tracer
+    exporters = []
+    if memory:
+        exporters.append(RingBufferExporter())
+    if path:
+        exporters.append(JsonlExporter(path))
+    previous, _tracer = _tracer, Tracer(exporters) if exporters else None
+    if previous is not None:
+        previous.close()
+    logger.info(f"Tracing {'enabled' if _tracer else 'disabled'} (memory={bool(memory)}, file={path})")
+
+
+@atexit.register
+def disable_tracing():
+    """Stops recording spans and flushes the trace file."""
+    global _tracer
+    previous, _tracer = _tracer, None
+    if previous is not None:
+        previous.close()
+
+
+def tracing_enabled():
+    return _tracer is not None
+
+
+def recent_spans():
+    """Returns the spans in the ring buffer, oldest first; empty when it is not enabled."""
+    ring = _tracer.ring_buffer() if _tracer is not None else None
+    return list(ring.spans) if ring is not None else []
+
+
+def load_spans(path=TRACE_FILE):
+    """Reads the spans of a trace file and its rotated backups, oldest first."""
+    spans = []
+    for file_path in sorted(glob.glob(f"{glob.escape(path)}.*"), reverse=True) + [path]:
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A line cut short by a crash.
+                    continue
+    return spans
+
+
+def summarize(spans, slowest=SLOWEST_TURNS):
+    """
+    Breaks the recorded time down by stage and lists the slowest turns.
+
+    Returns:
+    - Dictionary with "stages", the count and p50/p99/max milliseconds per span name, and
+      "slowest_turns", the longest finished traces with their total milliseconds per stage.
+      Stage times include the stages nested in them, e.g. a tool call's database writes.
+    """
+    stats = StatementStats()
+    traces = {}
+    for record in spans:
+        stats.record(record["name"], record["duration_ms"] / 1000)
+        traces.setdefault(record["trace_id"], []).append(record)
+
+    turns = []
+    for trace_id, records in traces.items():
+        roots = [record for record in records if record["parent_id"] is None]
+        if not roots:
+            # Still running, or its root rotated out of the buffer or file.
+            continue
+        root = roots[0]
+        stages = {}
+        for record in records:
+            if record is not root:
+                stages[record["name"]] = stages.get(record["name"], 0.0) + record["duration_ms"]
+        turns.append({
+            "trace_id": trace_id, "name": root["name"], "start": root["start"],
+            "duration_ms": root["duration_ms"], "status": root["status"],
+            "attributes": root.get("attributes", {}), "stages": stages,
+        })
+    turns.sort(key=lambda turn: turn["duration_ms"], reverse=True)
+    return {"stages": stats.summary(), "slowest_turns": turns[:slowest]}
+
+
+def format_summary(summary):
+    lines = ["Stage latency:"]
+    for name, row in sorted(summary["stages"].items(), key=lambda item: item[1]["p99_ms"], reverse=True):
+        lines.append(f"  [{row['count']} spans] p50={row['p50_ms']:.1f}ms p99={row['p99_ms']:.1f}ms max={row['max_ms']:.1f}ms :: {name}")
+    lines.append("Slowest turns:")
+    for turn in summary["slowest_turns"]:
+        started = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(turn["start"]))
+        stages = ", ".join(f"{name}={ms:.0f}ms" for name, ms in sorted(turn["stages"].items(), key=lambda item: item[1], reverse=True))
+        lines.append(f"  {started} {turn['trace_id']} {turn['name']} {turn['duration_ms']:.0f}ms ({turn['status']}): {stages}")
+    return "\n".join(lines)
+
+
+def report(slowest=5):
+    """Logs the summary of the spans in the ring buffer."""
+    spans = recent_spans()
+    if spans:
+        logger.info(format_summary(summarize(spans, slowest)))
+
+
+def _configure(spec):
+    targets = {target.strip() for target in spec.split(',') if target.strip()}
+    if targets:
+        enable_tracing(memory='memory' in targets, path=TRACE_FILE if 'file' in targets else None)
+
+
+_configure(os.environ.get(TRACE_ENV, ''))
+
+
+if __name__ == "__main__":
+    # python -m modules.Analytics.tracing --slowest 5
+    parser = argparse.ArgumentParser(description="Summarize recorded traces: latency per stage and the slowest turns.")
+    parser.add_argument("--file", default=TRACE_FILE, help="trace file written with SCOUT_TRACE=file")
+    parser.add_argument("--slowest", type=int, default=SLOWEST_TURNS, help="number of turns to list")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+
+    summary = summarize(load_spans(args.file), args.slowest)
+    if args.json:
+        sys.stdout.write(json.dumps(summary, indent=2) + "\n")
+    else:
+        sys.stdout.write(format_summary(summary) + "\n")
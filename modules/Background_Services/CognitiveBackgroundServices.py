@@ -1,14 +1,34 @@
 # modules/Background_Services/CognitiveBackgroundServices.py
 
-import os
+import hashlib
 import json
+import logging
 import sqlite3
 import re
+import time
 from modules.chat_history.DatabaseContextManager import DatabaseContextManager
+from modules.chat_history.db_executor import get_database_executor
+from modules.chat_history.context_builder import count_tokens
+from modules.user_accounts.profile_store import get_profile_store
 from modules.logging.logger import setup_logger
+from modules.logging.structured import log_payload
 
 logger = setup_logger('CognitiveBackgroundServices.py')
 
+NAMING_PROMPT = "You are ConversationManager. You excel at examining conversations and finding creative names for them. You pay close attention to details; if a conversation is strictly a story and it has a name, use it. "
+NEW_CONVERSATION_PROMPT = "The following conversation does not currently have a name. "
+CONTINUED_CONVERSATION_PROMPT = "The following are the new turns of a conversation currently named \"{name}\", preceded by a summary of the turns before them. Keep that name unless the new turns change what the conversation is about. "
+OUTPUT_PROMPT = "You are to output a conversationally relevant name for this conversation enclosed in double quotation marks (\"\"). Additionally, return a JSON array with the following structure for updating the user profile: [{\"operation\": \"addfield\", \"fieldName\": \"New Field Name\", \"content\": \"New Content goes here\", \"observations\": \"Explanation of why this new field is relevant and not redundant\"}]. If there are no updates, return a JSON array with a single element: [{\"operation\": \"None\"}]. Separate the conversation name and the JSON array with a newline character. After the JSON array, on a new line, write \"Summary:\" followed by a summary of the whole conversation so far in at most 150 words."
+
+# Upper bound on the stored running summary, so what is sent per save stays roughly constant.
+SUMMARY_MAX_CHARS = 2000
+
+BATCH_PROMPT = "Each of the following conversations is introduced by a line \"### Conversation <number>\"; a conversation that already has a name starts with a summary of its earlier turns and continues with its new turns. For every conversation, find a conversationally relevant name and the updates for the user profile, as operations of the form {\"operation\": \"addfield\", \"fieldName\": \"New Field Name\", \"content\": \"New Content goes here\", \"observations\": \"Explanation of why this new field is relevant and not redundant\"}, or [{\"operation\": \"None\"}] if there are none, and summarize the whole conversation in at most 150 words. Output only a JSON object of the form {\"conversations\": [{\"conversation\": <number>, \"name\": \"...\", \"profile_updates\": [...], \"summary\": \"...\"}]} with one entry per conversation."
+
+# Estimated tokens of one batch request, and the per-conversation overhead counted against it.
+BATCH_TOKEN_BUDGET = 6000
+BATCH_ITEM_OVERHEAD_TOKENS = 40
+
 class CognitiveBackgroundServices:
     def __init__(self, db_file, user, provider_manager):
         self.user = user
@@ -20,12 +40,17 @@ class CognitiveBackgroundServices:
         Description:
         Asynchronously processes the conversation by generating the conversation name and profile update instructions.
 
+        Each conversation has a checkpoint of how much of its chat log was analyzed, its name and a running summary.
+        When the analyzed part is unchanged, only the turns after it are sent, together with the summary, so saving
+        a long conversation again costs about as much as its new turns.
+
         When a user selects a persona from the persona menu, this method is called to generate a meaningful name for the conversation based on its content and generate instructions for updating the user profile.
         
         Side Effects:
         - Calls the provider API to generate the conversation name and profile update instructions.
         - Updates the conversation name in the database using the update_conversation_name method.
         - Updates the user profile using the update_user_profile method.
+        - Stores the conversation's analysis checkpoint using the save_checkpoint method.
         
         Thread Safety:
         This method is asynchronous and should be called with the 'await' keyword to ensure proper execution.
@@ -37,6 +62,7 @@ class CognitiveBackgroundServices:
         - update_conversation_name method
         - update_user_profile method
         - get_profile method
+        - get_checkpoint and save_checkpoint methods
         - Provider specific API classes
         
         Error Handling:
@@ -54,11 +80,19 @@ class CognitiveBackgroundServices:
         logger.info("Processing conversation")
         logger.debug(f"with user: {user}, conversation_id: {conversation_id}")
         if chat_log:
-            conversation_data = [{"role": "user", "content": chat_log}]
+            executor = get_database_executor(self.db_file)
+            checkpoint, content = await self.prepare_analysis(executor, user, conversation_id, chat_log)
+            if content is None:
+                logger.info("Conversation unchanged since its last analysis.")
+                return
+            conversation_data = [{"role": "user", "content": content}]
             
             profile = self.get_profile()
             
-            system_message_content = "You are ConversationManager. You excel at examining conversations and finding creative names for them. You pay close attention to details; if a conversation is strictly a story and it has a name, use it. The following conversation does not currently have a name. You are to output a conversationally relevant name for this conversation enclosed in double quotation marks (\"\"). Additionally, return a JSON array with the following structure for updating the user profile: [{\"operation\": \"addfield\", \"fieldName\": \"New Field Name\", \"content\": \"New Content goes here\", \"observations\": \"Explanation of why this new field is relevant and not redundant\"}]. If there are no updates, return a JSON array with a single element: [{\"operation\": \"None\"}]. Separate the conversation name and the JSON array with a newline character."
+            if checkpoint:
+                system_message_content = NAMING_PROMPT + CONTINUED_CONVERSATION_PROMPT.format(name=checkpoint["name"] or "") + OUTPUT_PROMPT
+            else:
+                system_message_content = NAMING_PROMPT + NEW_CONVERSATION_PROMPT + OUTPUT_PROMPT
             
             profile_string = json.dumps(profile, ensure_ascii=False)
             system_message_content = system_message_content.replace('<<Profile>>', profile_string)
@@ -69,40 +103,202 @@ class CognitiveBackgroundServices:
                 #"model": "claude-3-sonnet-20240229",
                 "messages": [{"role": "system","content": system_message_content}] + conversation_data
             }
-            logger.info("Payload being sent")
-            logger.debug(f"to API: {json.dumps(payload, indent=2, ensure_ascii=False)}")
             logger.info("Payload being sent to API")
+            log_payload(logger, logging.DEBUG, "Analysis payload", payload=payload)
             
             response = await self.provider_manager.generate_cognitive_background_service(payload)
-            
-            if response and hasattr(response, 'content') and len(response.content) > 0:
-                text_block = response.content[0]
-                if hasattr(text_block, 'text'):
-                    response_text = text_block.text.strip()
-                    conversation_name = self.extract_conversation_name(response_text)
-                    update_instructions = self.extract_update_instructions(response_text)
-                else:
-                    logger.error("Invalid response format from the API.")
-                    return
-            elif response and 'choices' in response and len(response['choices']) > 0 and 'message' in response['choices'][0]:
-                response_text = response['choices'][0]['message']['content'].strip()
-                conversation_name = self.extract_conversation_name(response_text)
-                update_instructions = self.extract_update_instructions(response_text)
-            else:
-                logger.error("Empty or invalid response from the API.")
+            response_text = self.extract_response_text(response)
+            if response_text is None:
                 return
+            conversation_name = self.extract_conversation_name(response_text)
+            update_instructions = self.extract_update_instructions(response_text)
+            summary = self.extract_summary(response_text)
             
             if name:
                 conversation_name = name
             
-            if conversation_name:
-                self.update_conversation_name(user, conversation_id, conversation_name)
-                logger.info("Conversation Named.")
-                logger.debug(f": {conversation_name}")
-            else:
-                logger.error("Failed to generate conversation name.")
-            
-            await self.update_user_profile(user, update_instructions)
+            await self.apply_analysis(executor, user, conversation_id, chat_log, conversation_name, update_instructions, summary)
+
+    async def prepare_analysis(self, executor, user, conversation_id, chat_log):
+        """
+        Description:
+        Determines what has to be sent to analyze chat_log.
+
+        Returns:
+        A (checkpoint, content) tuple: the conversation's checkpoint or None, and the text to send, which is None if
+        nothing changed since the last analysis.
+        """
+        checkpoint = await executor.read(self.get_checkpoint, user, conversation_id, chat_log)
+        if checkpoint and checkpoint["analyzed_length"] == len(chat_log):
+            return checkpoint, None
+        if checkpoint:
+            new_turns = chat_log[checkpoint["analyzed_length"]:]
+            logger.info(f"Analyzing {len(new_turns)} new characters of a {len(chat_log)} character conversation")
+            return checkpoint, f"Summary of the conversation so far: {checkpoint['summary']}\n\nNew turns:\n{new_turns}"
+        return None, chat_log
+
+    async def apply_analysis(self, executor, user, conversation_id, chat_log, conversation_name, update_instructions, summary):
+        """
+        Description:
+        Stores the result of analyzing a conversation: its name, the profile updates and its new checkpoint.
+        """
+        if conversation_name:
+            await executor.write(self.update_conversation_name, user, conversation_id, conversation_name)
+            log_payload(logger, logging.INFO, "Conversation named", name=conversation_name)
+        else:
+            logger.error("Failed to generate conversation name.")
+        
+        await self.update_user_profile(user, update_instructions)
+
+        if summary:
+            await executor.write(self.save_checkpoint, user, conversation_id, chat_log, conversation_name, summary)
+        else:
+            # Without a summary the next save resends everything after the previous checkpoint.
+            logger.warning("No conversation summary in the response; checkpoint not advanced.")
+
+    async def process_conversations(self, user, conversations, token_budget=BATCH_TOKEN_BUDGET):
+        """
+        Description:
+        Processes several conversations of one user with as few requests as possible.
+
+        The conversations that need analysis are packed into batch requests of at most token_budget estimated
+        tokens each, and the model answers with one JSON result per conversation. A conversation that does not
+        fit a batch with others, or whose result is missing or malformed, is processed on its own with
+        process_conversation.
+        
+        Side Effects:
+        - Same as process_conversation, for every conversation.
+        
+        Parameters:
+        - user (str): The user associated with the conversations.
+        - conversations (list): (conversation_id, chat_log) tuples.
+        - token_budget (int, optional): Upper bound on the estimated tokens of one batch request.
+        
+        Returns:
+        None
+        """
+        executor = get_database_executor(self.db_file)
+        pending = []
+        for conversation_id, chat_log in conversations:
+            if not chat_log:
+                continue
+            checkpoint, content = await self.prepare_analysis(executor, user, conversation_id, chat_log)
+            if content is not None:
+                pending.append((conversation_id, chat_log, checkpoint, content))
+
+        batches = []
+        batch, batch_tokens = [], count_tokens(BATCH_PROMPT)
+        for item in pending:
+            item_tokens = count_tokens(item[3]) + BATCH_ITEM_OVERHEAD_TOKENS
+            if batch and batch_tokens + item_tokens > token_budget:
+                batches.append(batch)
+                batch, batch_tokens = [], count_tokens(BATCH_PROMPT)
+            batch.append(item)
+            batch_tokens += item_tokens
+        if batch:
+            batches.append(batch)
+
+        for batch in batches:
+            if len(batch) == 1:
+                conversation_id, chat_log = batch[0][:2]
+                await self.process_conversation(user, conversation_id, chat_log)
+                continue
+
+            results = await self.request_batch(batch)
+            for index, (conversation_id, chat_log, checkpoint, content) in enumerate(batch, start=1):
+                result = results.get(index)
+                if result is None:
+                    logger.warning(f"No batch result for conversation {index}; processing it on its own.")
+                    await self.process_conversation(user, conversation_id, chat_log)
+                    continue
+                name, updates, summary = result
+                await self.apply_analysis(executor, user, conversation_id, chat_log, name, updates, summary)
+
+    async def request_batch(self, batch):
+        """
+        Description:
+        Sends one request analyzing every conversation of batch and parses the per-conversation results.
+
+        Parameters:
+        - batch (list): (conversation_id, chat_log, checkpoint, content) tuples.
+
+        Returns:
+        A dictionary from the 1-based position of a conversation in batch to its (name, update_instructions, summary)
+        tuple, in the formats the single-conversation extract methods return. Conversations without a well-formed
+        result are left out; on a failed request or unparsable response the dictionary is empty.
+        """
+        sections = []
+        for index, (conversation_id, chat_log, checkpoint, content) in enumerate(batch, start=1):
+            header = f"### Conversation {index}"
+            if checkpoint:
+                header += f" (currently named \"{checkpoint['name'] or ''}\"; keep that name unless the new turns change what it is about)"
+            sections.append(f"{header}\n{content}")
+
+        payload = {
+            "model": "gpt-4-turbo",
+            "messages": [
+                {"role": "system", "content": NAMING_PROMPT + BATCH_PROMPT},
+                {"role": "user", "content": "\n\n".join(sections)},
+            ]
+        }
+        logger.info(f"Batch payload for {len(batch)} conversations being sent to API")
+        log_payload(logger, logging.DEBUG, "Batch analysis payload", payload=payload)
+        try:
+            response = await self.provider_manager.generate_cognitive_background_service(payload)
+        except Exception as e:
+            logger.error(f"Batch analysis request failed: {e}")
+            return {}
+        response_text = self.extract_response_text(response)
+        if response_text is None:
+            return {}
+
+        match = re.search(r'\{.*\}', response_text, re.DOTALL)
+        try:
+            entries = json.loads(match.group(0))["conversations"] if match else None
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            logger.error(f"Failed to parse batch analysis response: {e}")
+            return {}
+        if not isinstance(entries, list):
+            logger.error("Batch analysis response has no list of conversations.")
+            return {}
+
+        results = {}
+        for entry in entries:
+            try:
+                index = int(entry["conversation"])
+                name = entry.get("name")
+                updates = entry.get("profile_updates")
+                summary = entry.get("summary")
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+            if not 1 <= index <= len(batch) or not isinstance(name, str) or not isinstance(updates, list):
+                continue
+            results[index] = (
+                f'"{name.strip(chr(34))}"' if name else None,
+                json.dumps(updates, ensure_ascii=False),
+                summary[:SUMMARY_MAX_CHARS] if isinstance(summary, str) and summary else None,
+            )
+        return results
+
+    def extract_response_text(self, response):
+        """
+        Description:
+        Extracts the text of a provider response, which is either a message object with content blocks or a
+        dictionary in the chat completions format.
+
+        Returns:
+        The stripped response text, or None if the response is empty or invalid.
+        """
+        if response and hasattr(response, 'content') and len(response.content) > 0:
+            text_block = response.content[0]
+            if hasattr(text_block, 'text'):
+                return text_block.text.strip()
+            logger.error("Invalid response format from the API.")
+            return None
+        elif response and 'choices' in response and len(response['choices']) > 0 and 'message' in response['choices'][0]:
+            return response['choices'][0]['message']['content'].strip()
+        logger.error("Empty or invalid response from the API.")
+        return None
 
     def extract_conversation_name(self, response_text):
         """
@@ -166,12 +362,90 @@ class CognitiveBackgroundServices:
         Returns:
         The profile update instructions in JSON format, or None if not found.
         """
-        parts = response_text.split('\n', 1)
+        parts = self.split_summary(response_text)[0].split('\n', 1)
         if len(parts) > 1:
             return parts[1].strip()
         else:
             return None
 
+    @staticmethod
+    def split_summary(response_text):
+        """Splits the response text into the part before the 'Summary:' line and the summary, which is None if there is none."""
+        match = re.search(r'^\s*Summary:\s*', response_text, re.MULTILINE | re.IGNORECASE)
+        if not match:
+            return response_text, None
+        return response_text[:match.start()], response_text[match.end():].strip()[:SUMMARY_MAX_CHARS] or None
+
+    def extract_summary(self, response_text):
+        """
+        Description:
+        Extracts the running summary of the conversation from the API response text.
+
+        Parameters:
+        - response_text (str): The text response from the API.
+
+        Returns:
+        The summary, at most SUMMARY_MAX_CHARS characters long, or None if not found.
+        """
+        return self.split_summary(response_text)[1]
+
+    @staticmethod
+    def prefix_hash(chat_log, length):
+        return hashlib.sha1(chat_log[:length].encode('utf-8')).hexdigest()
+
+    def get_checkpoint(self, user, conversation_id, chat_log):
+        """
+        Description:
+        Retrieves the analysis checkpoint of a conversation if it still applies to chat_log.
+
+        Parameters:
+        - user (str): The user associated with the conversation.
+        - conversation_id (str): The ID of the conversation.
+        - chat_log (str): The chat log about to be analyzed.
+
+        Returns:
+        A dictionary with analyzed_length, name and summary, or None if the conversation was never analyzed or the
+        analyzed part of its chat log has changed since, in which case it is analyzed from the start.
+        """
+        with DatabaseContextManager(self.db_file) as cursor:
+            cursor.execute('''
+                SELECT analyzed_length, analyzed_hash, name, summary FROM conversation_analysis
+                WHERE user = ? AND conversation_id = ?;
+            ''', (user, conversation_id))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        analyzed_length, analyzed_hash, name, summary = row
+        if analyzed_length > len(chat_log) or self.prefix_hash(chat_log, analyzed_length) != analyzed_hash:
+            logger.info("Conversation changed before its last checkpoint; analyzing it from the start.")
+            return None
+        return {"analyzed_length": analyzed_length, "name": name, "summary": summary}
+
+    def save_checkpoint(self, user, conversation_id, chat_log, name, summary):
+        """
+        Description:
+        Records that chat_log has been analyzed, with the resulting name and running summary.
+
+        Parameters:
+        - user (str): The user associated with the conversation.
+        - conversation_id (str): The ID of the conversation.
+        - chat_log (str): The chat log that was analyzed.
+        - name (str): The conversation name, with or without double quotation marks.
+        - summary (str): The summary of the whole conversation.
+        """
+        with DatabaseContextManager(self.db_file) as cursor:
+            try:
+                cursor.execute('''
+                    INSERT INTO conversation_analysis (user, conversation_id, analyzed_length, analyzed_hash, name, summary, updated)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (user, conversation_id) DO UPDATE SET
+                        analyzed_length = excluded.analyzed_length, analyzed_hash = excluded.analyzed_hash,
+                        name = excluded.name, summary = excluded.summary, updated = excluded.updated;
+                ''', (user, conversation_id, len(chat_log), self.prefix_hash(chat_log, len(chat_log)),
+                      name.strip('"') if name else None, summary, time.strftime("%Y-%m-%d %H:%M:%S")))
+            except sqlite3.Error as e:
+                logger.error(f"Error saving conversation analysis checkpoint: {e}")
+
     def update_conversation_name(self, user, conversation_id, name):
         """
         Description:
@@ -226,20 +500,27 @@ class CognitiveBackgroundServices:
                 logger.error(f"Failed to parse update instructions: {e}")
                 return
 
-            for update_data in update_data_list:
-                operation = update_data.get("operation")
-                fieldName = update_data.get("fieldName")
-                content = update_data.get("content")
-                observations = update_data.get("observations", "")
-
-                if operation == "appendContentByField":
-                    self.append_content_by_field(user, fieldName, content, observations)
-                elif operation == "addfield":
-                    self.add_field(user, fieldName, content, observations)
-                elif operation == "None":
-                    logger.info("No update required for the user profile based on the latest conversation.")
-                else:
-                    logger.error("Unsupported operation.")
+            def apply_updates(profile):
+                for update_data in update_data_list:
+                    operation = update_data.get("operation")
+                    fieldName = update_data.get("fieldName")
+                    content = update_data.get("content")
+                    observations = update_data.get("observations", "")
+
+                    if operation == "appendContentByField":
+                        self.append_to_profile(profile, fieldName, content, observations)
+                    elif operation == "addfield":
+                        self.add_to_profile(profile, fieldName, content, observations)
+                    elif operation == "None":
+                        logger.info("No update required for the user profile based on the latest conversation.")
+                    else:
+                        logger.error("Unsupported operation.")
+
+            # All instructions of one conversation are applied together or not at all.
+            try:
+                get_profile_store(self.user).update(apply_updates)
+            except (AttributeError, KeyError, TypeError) as e:
+                logger.error(f"Failed to apply update instructions: {e}")
         else:
             logger.error("Invalid or empty update instructions.")
         
@@ -251,18 +532,17 @@ class CognitiveBackgroundServices:
         When a user selects a persona from the persona menu, this method is called to append content to a specific field in the user profile.
         
         Side Effects:
-        - Modifies the user profile by appending content to the specified field.
-        - Saves the updated profile using the save_profile method.
+        - Modifies the user profile in the shared profile store, which saves it shortly after.
         
         Thread Safety:
-        This method is not explicitly thread-safe. Proper synchronization should be implemented if accessed concurrently.
+        This method is thread-safe; the change is applied under the profile store's lock.
         
         Usage:
         append_content_by_field(user, field_name, content, observations)
         
         Dependencies:
-        - get_profile method
-        - save_profile method
+        - append_to_profile method
+        - profile_store module
         
         Error Handling:
         None
@@ -276,20 +556,7 @@ class CognitiveBackgroundServices:
         Returns:
         None
         """
-        profile = self.get_profile()
-        if field_name in profile:
-            if isinstance(profile[field_name]['Content'], list):
-                profile[field_name]['Content'].append(content)
-            elif profile[field_name]['Content']:
-                profile[field_name]['Content'] = [profile[field_name]['Content'], content]
-            else:
-                profile[field_name]['Content'] = content
-            if observations:
-                profile[field_name]['observations'] = observations
-        else:
-            profile[field_name] = {"Content": content, "observations": observations}
-        
-        self.save_profile(profile)
+        get_profile_store(self.user).update(lambda profile: self.append_to_profile(profile, field_name, content, observations))
 
     def add_field(self, user, field_name, content, observations):
         """
@@ -299,18 +566,17 @@ class CognitiveBackgroundServices:
         When a user selects a persona from the persona menu, this method is called to add a new field to the user profile.
         
         Side Effects:
-        - Modifies the user profile by adding a new field.
-        - Saves the updated profile using the save_profile method.
+        - Modifies the user profile in the shared profile store, which saves it shortly after.
         
         Thread Safety:
-        This method is not explicitly thread-safe. Proper synchronization should be implemented if accessed concurrently.
+        This method is thread-safe; the change is applied under the profile store's lock.
         
         Usage:
         add_field(user, field_name, content, observations)
         
         Dependencies:
-        - get_profile method
-        - save_profile method
+        - add_to_profile method
+        - profile_store module
         
         Error Handling:
         None
@@ -324,33 +590,50 @@ class CognitiveBackgroundServices:
         Returns:
         None
         """
-        profile = self.get_profile()
+        get_profile_store(self.user).update(lambda profile: self.add_to_profile(profile, field_name, content, observations))
+
+    @staticmethod
+    def append_to_profile(profile, field_name, content, observations):
+        """Appends content to field_name of a profile dictionary in place; see append_content_by_field."""
+        if field_name in profile:
+            if isinstance(profile[field_name]['Content'], list):
+                profile[field_name]['Content'].append(content)
+            elif profile[field_name]['Content']:
+                profile[field_name]['Content'] = [profile[field_name]['Content'], content]
+            else:
+                profile[field_name]['Content'] = content
+            if observations:
+                profile[field_name]['observations'] = observations
+        else:
+            profile[field_name] = {"Content": content, "observations": observations}
+
+    @staticmethod
+    def add_to_profile(profile, field_name, content, observations):
+        """Sets field_name of a profile dictionary in place; see add_field."""
         profile[field_name] = {"Content": content, "observations": observations}
-        self.save_profile(profile)
 
-   
     def save_profile(self, profile):
         """
         Description:
-        Saves the user profile to a JSON file.
+        Replaces the user profile with the given one.
 
         When a user selects a persona from the persona menu, this method is called to save the updated user profile to a JSON file.
         
         Side Effects:
-        - Writes the user profile to a JSON file.
+        - Replaces the profile in the shared profile store, which writes it to the JSON file shortly after.
         
         Thread Safety:
-        This method is not explicitly thread-safe. Proper synchronization should be implemented if accessed concurrently.
+        This method is thread-safe, but replacing the whole profile discards updates made since it was read;
+        prefer append_content_by_field and add_field.
         
         Usage:
         save_profile(profile)
         
         Dependencies:
-        - os module
-        - json module
+        - profile_store module
         
         Error Handling:
-        Logs an error if there is an issue saving the profile.
+        The profile store logs an error if there is an issue saving the profile.
         
         Parameters:
         - profile (dict): The user profile to save.
@@ -358,40 +641,30 @@ class CognitiveBackgroundServices:
         Returns:
         None
         """ 
-        try:
-            profile_path = os.path.abspath(os.path.join(
-                os.path.dirname(__file__), '..', '..', 'modules', 'user_accounts', 'user_profiles',
-                f"{self.user}.json"
-            ))
-            with open(profile_path, 'w', encoding='utf-8') as file:
-                json.dump(profile, file, ensure_ascii=False, indent=4)
-            logger.info("Profile updated successfully.")
-        except Exception as e:
-            logger.error(f"Error saving profile: {e}")
+        get_profile_store(self.user).replace(profile)
     
     def get_profile(self):
         """
         Description:
-        Retrieves the latest simplified profile for the current user from a JSON file.
+        Retrieves the latest simplified profile for the current user.
 
-        When a user selects a persona from the persona menu, this method is called to retrieve the user profile from a JSON file.
+        When a user selects a persona from the persona menu, this method is called to retrieve the user profile from the shared profile store,
+        which reads the JSON file only once.
         
         Side Effects:
         None
         
         Thread Safety:
-        This method is thread-safe as it only reads the user profile from a file.
+        This method is thread-safe; it returns a copy of the profile.
         
         Usage:
         get_profile()
         
         Dependencies:
-        - os module
-        - json module
+        - profile_store module
         
         Error Handling:
-        - Logs an error if the profile file does not exist.
-        - Logs an error if there is an issue loading the profile.
+        - The profile store logs an error if the profile file does not exist or cannot be loaded.
         
         Parameters:
         None
@@ -399,24 +672,4 @@ class CognitiveBackgroundServices:
         Returns:
         The user profile as a JSON object. If the profile file does not exist or an error occurs, an empty dictionary is returned.
         """
-        try:
-            profile_path = os.path.abspath(os.path.join(
-                os.path.dirname(__file__), '..', '..', 'modules', 'user_accounts', 'user_profiles',
-                f"{self.user}.json"
-            ))
-
-            logger.debug(f"Profile path: {profile_path}")
-
-            if not os.path.exists(profile_path):
-                logger.error(f"Profile file does not exist: {profile_path}")
-                return {}
-
-            with open(profile_path, 'r', encoding='utf-8') as file:
-                profile = json.load(file)
-                logger.info("Profile found")
-                logger.debug(f": {profile}")
-                return profile
-
-        except Exception as e:
-            logger.error(f"Error loading profile: {e}")
-            return {}
\ No newline at end of file
+        return get_profile_store(self.user).get()
@@ -0,0 +1,330 @@
+# modules/Background_Services/job_scheduler.py
+
+import asyncio
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+
+from modules.chat_history.DatabaseContextManager import DatabaseContextManager
+from modules.chat_history.codec import get_codec
+from modules.chat_history.connection_pool import StatementStats
+from modules.chat_history.db_executor import get_database_executor
+from modules.chat_history.migrations import migrate_database
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('job_scheduler.py')
+
+# Jobs run at the same time per database.
+MAX_WORKERS = 2
+
+# A failing job is retried this many times in total, waiting RETRY_DELAY * 2**attempt seconds in between.
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30
+
+# Idle workers look for retries that became due this often, in seconds, even without a new job.
+POLL_INTERVAL = 5
+
+# Background jobs only start once no user-facing generation has run for this many seconds.
+FOREGROUND_GRACE = 1.0
+
+
+class ForegroundActivity:
+    """
+    Tracks user-facing generation so background jobs can yield to it.
+
+    send_message wraps each response in active(); workers call wait_idle() before taking a job,
+    so a conversation being named never competes with the reply the user is waiting for. A job
+    that already started is not interrupted.
+    """
+
+    def __init__(self, grace=FOREGROUND_GRACE):
+        self.grace = grace
+        self.active_count = 0
+        self.last_active = 0.0
+        self._idle = None
+
+    def _event(self):
+        if self._idle is None:
+            self._idle = asyncio.Event()
+            self._idle.set()
+        return self._idle
+
+    @contextlib.asynccontextmanager
+    async def active(self):
+        self.active_count += 1
+        self._event().clear()
+        try:
+            yield
+        finally:
+            self.active_count -= 1
+            self.last_active = time.monotonic()
+            if self.active_count == 0:
+                self._event().set()
+
+    async def wait_idle(self):
+        while True:
+            await self._event().wait()
+            remaining = self.last_active + self.grace - time.monotonic()
+            if remaining <= 0 and self.active_count == 0:
+                return
+            await asyncio.sleep(max(remaining, 0.05))
+
+
+foreground = ForegroundActivity()
+
+
+class JobScheduler:
+    """
+    Persistent, bounded queue of background jobs for one persona database.
+
+    Jobs are rows of the background_jobs table, so work enqueued before the application closed
+    or crashed runs after the next start. A job is identified by its kind, user and conversation:
+    enqueueing it again while it is still pending only replaces its payload, so saving the same
+    conversation several times in a row leads to one run on the latest transcript. At most
+    max_workers jobs run at once, and only while no user-facing generation is in progress.
+
+    Handlers are coroutines registered per kind and called as handler(user, conversation_id,
+    payload). A handler that raises is retried with exponential backoff up to MAX_ATTEMPTS times
+    and then kept with status 'failed' and its error. A kind registered with register_batch
+    takes up to max_batch due jobs of the same user at once instead, so they can share one
+    request; the batch succeeds or fails as a whole.
+    """
+
+    def __init__(self, db_path, max_workers=MAX_WORKERS):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.handlers = {}
+        self.batch_sizes = {}
+        self.stats = StatementStats()
+        self.counts = {"completed": 0, "failed": 0, "retried": 0, "coalesced": 0, "batched": 0}
+        self._workers = []
+        self._loop = None
+        self._wakeup = None
+        migrate_database(db_path)
+
+    def register(self, kind, handler):
+        self.handlers[kind] = handler
+        self.batch_sizes.pop(kind, None)
+
+    def register_batch(self, kind, handler, max_batch):
+        """Registers handler(jobs) for kind, called with a list of up to max_batch (user, conversation_id, payload) tuples."""
+        self.handlers[kind] = handler
+        self.batch_sizes[kind] = max_batch
+
+    def enqueue(self, kind, user, conversation_id, payload):
+        """
+        Adds a job, or replaces the payload of the same job if it has not started yet.
+
+        Safe to call from any thread; the database write runs on the calling thread.
+
+        Returns:
+        - The id of the job.
+        """
+        now = time.time()
+        with DatabaseContextManager(self.db_path) as cursor:
+            try:
+                cursor.execute('''
+                    INSERT INTO background_jobs (kind, user, conversation_id, payload, enqueued_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (kind, user, conversation_id) WHERE status = 'pending'
+                    DO UPDATE SET payload = excluded.payload
+                    RETURNING id, enqueued_at;
+                ''', (kind, user, conversation_id, get_codec(self.db_path).encode(json.dumps(payload)), now))
+                job_id, enqueued_at = cursor.fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Error enqueueing background job: {e}")
+                raise
+        if enqueued_at != now:
+            self.counts["coalesced"] += 1
+            logger.info(f"Background job {kind} coalesced with pending job {job_id}")
+        self._notify()
+        return job_id
+
+    def _notify(self):
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def start(self):
+        """Starts the workers on the running event loop. Does nothing when they already run or there is no loop."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        if self._workers:
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._recover()
+        self._workers = [asyncio.create_task(self._work(index)) for index in range(self.max_workers)]
+        logger.info(f"Background job scheduler started with {self.max_workers} workers")
+
+    def _recover(self):
+        """Puts jobs left running by a previous process back in the queue."""
+        with DatabaseContextManager(self.db_path) as cursor:
+            # A job that was interrupted and has since been enqueued again is superseded by the new one.
+            cursor.execute('''
+                DELETE FROM background_jobs AS running
+                WHERE status = 'running' AND EXISTS (
+                    SELECT 1 FROM background_jobs AS pending
+                    WHERE pending.status = 'pending' AND pending.kind = running.kind
+                      AND pending.user = running.user AND pending.conversation_id = running.conversation_id
+                );
+            ''')
+            cursor.execute("UPDATE background_jobs SET status = 'pending' WHERE status = 'running';")
+            if cursor.rowcount:
+                logger.info(f"Requeued {cursor.rowcount} interrupted background jobs")
+
+    def _claim(self):
+        """Marks the oldest due job as running, plus more due jobs of its kind and user if it is batched, and returns them."""
+        now = time.time()
+        with DatabaseContextManager(self.db_path) as cursor:
+            cursor.execute('''
+                UPDATE background_jobs SET status = 'running', attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM background_jobs
+                    WHERE status = 'pending' AND not_before <= ?
+                    ORDER BY id LIMIT 1
+                )
+                RETURNING id, kind, user, conversation_id, payload, enqueued_at, attempts;
+            ''', (now,))
+            job = cursor.fetchone()
+            if job is None:
+                return []
+            jobs = [job]
+            max_batch = self.batch_sizes.get(job[1], 1)
+            if max_batch > 1:
+                cursor.execute('''
+                    UPDATE background_jobs SET status = 'running', attempts = attempts + 1
+                    WHERE id IN (
+                        SELECT id FROM background_jobs
+                        WHERE status = 'pending' AND kind = ? AND user = ? AND not_before <= ?
+                        ORDER BY id LIMIT ?
+                    )
+                    RETURNING id, kind, user, conversation_id, payload, enqueued_at, attempts;
+                ''', (job[1], job[2], now, max_batch - 1))
+                jobs.extend(sorted(cursor.fetchall()))
+            return jobs
+
+    def _finish(self, job_ids):
+        with DatabaseContextManager(self.db_path) as cursor:
+            cursor.executemany('DELETE FROM background_jobs WHERE id = ?;', [(job_id,) for job_id in job_ids])
+
+    def _fail(self, jobs, error):
+        """
+        Schedules a retry of failed (job_id, attempts) pairs, or marks them failed for good.
+
+        Returns:
+        - The number of jobs that will be retried.
+        """
+        retried = 0
+        with DatabaseContextManager(self.db_path) as cursor:
+            for job_id, attempts in jobs:
+                if attempts >= MAX_ATTEMPTS:
+                    cursor.execute("UPDATE background_jobs SET status = 'failed', error = ? WHERE id = ?;", (error, job_id))
+                    continue
+                retried += 1
+                cursor.execute('''
+                    UPDATE OR IGNORE background_jobs SET status = 'pending', not_before = ?, error = ?
+                    WHERE id = ?;
+                ''', (time.time() + RETRY_DELAY * 2 ** (attempts - 1), error, job_id))
+                if cursor.rowcount == 0:
+                    # The job was enqueued again while it ran; the newer one replaces the retry.
+                    cursor.execute('DELETE FROM background_jobs WHERE id = ?;', (job_id,))
+        return retried
+
+    async def _work(self, index):
+        executor = get_database_executor(self.db_path)
+        while True:
+            try:
+                await foreground.wait_idle()
+                jobs = await executor.write(self._claim)
+                if not jobs:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(executor, jobs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keeps the worker alive when the database itself fails; the job stays queued.
+                logger.error(f"Background job worker {index} error: {e}", exc_info=True)
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _run(self, executor, jobs):
+        kind = jobs[0][1]
+        codec = get_codec(self.db_path)
+        for job in jobs:
+            self.stats.record(f"wait {kind}", time.time() - job[5])
+        handler = self.handlers.get(kind)
+        start = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"No handler registered for background job kind {kind}")
+            if kind in self.batch_sizes:
+                await handler([(user, conversation_id, json.loads(codec.decode(payload)))
+                               for _, _, user, conversation_id, payload, _, _ in jobs])
+            else:
+                _, _, user, conversation_id, payload, _, _ = jobs[0]
+                await handler(user, conversation_id, json.loads(codec.decode(payload)))
+        except Exception as e:
+            retried = await executor.write(self._fail, [(job[0], job[6]) for job in jobs], f"{type(e).__name__}: {e}")
+            self.counts["retried"] += retried
+            self.counts["failed"] += len(jobs) - retried
+            logger.error(f"Background job {kind} {[job[0] for job in jobs]} failed: {e}", exc_info=True)
+            return
+        self.stats.record(f"run {kind}", time.perf_counter() - start)
+        await executor.write(self._finish, [job[0] for job in jobs])
+        self.counts["completed"] += len(jobs)
+        if len(jobs) > 1:
+            self.counts["batched"] += len(jobs)
+
+    def metrics(self):
+        """
+        Returns the queue depth per status, the completed / failed / retried / coalesced / batched counts and
+        the p50/p99 wait (enqueued to started) and run time per job kind, in milliseconds.
+        """
+        with DatabaseContextManager(self.db_path) as cursor:
+            cursor.execute('SELECT status, COUNT(*) FROM background_jobs GROUP BY status;')
+            depth = dict(cursor.fetchall())
+        return {"queue": depth, "counts": dict(self.counts), "latency": self.stats.summary()}
+
+    def report(self):
+        metrics = self.metrics()
+        logger.info(f"Background jobs: queue {metrics['queue']}, {metrics['counts']}")
+        for key, row in sorted(metrics["latency"].items()):
+            logger.info(f"[{row['count']} jobs] p50={row['p50_ms']:.0f}ms p99={row['p99_ms']:.0f}ms max={row['max_ms']:.0f}ms :: {key}")
+
+    def close(self):
+        """Stops the workers. Jobs still queued or interrupted run after the next start."""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        self.report()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_job_scheduler(db_path):
+    """Returns the scheduler shared by every component working on db_path."""
+    scheduler = _schedulers.get(db_path)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(db_path)
+            if scheduler is None:
+                scheduler = _schedulers[db_path] = JobScheduler(db_path)
+    return scheduler
+
+
+def close_job_scheduler(db_path):
+    with _schedulers_lock:
+        scheduler = _schedulers.pop(db_path, None)
+    if scheduler is not None:
+        scheduler.close()
@@ -3,6 +3,7 @@
 from modules.Tools.Base_Tools.time import get_current_info
 from modules.Tools.Base_Tools.Google_search import GoogleSearch
 from modules.Tools.Planning.calendar import Calendar
+from modules.Tools.Base_Tools.memory_recall import MemoryRecall
 
 # Create an instance of GoogleSearch
 google_search_instance = GoogleSearch()
@@ -10,9 +11,13 @@ google_search_instance = GoogleSearch()
 # Create an instance of Calendar
 calendar_instance = Calendar()
 
+# Create an instance of MemoryRecall over SCOUT's chat history
+memory_recall_instance = MemoryRecall("SCOUT")
+
 # A dictionary to map function names to actual function objects
 function_map = {
     "get_current_info": get_current_info,
     "google_search": google_search_instance._search,
-    "Calendar": calendar_instance.handle_action
+    "Calendar": calendar_instance.handle_action,
+    "recall_memory": memory_recall_instance._recall
 }
\ No newline at end of file
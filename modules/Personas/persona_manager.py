@@ -3,6 +3,7 @@
 import os
 import json
 from modules.user_accounts.user_data_manager import UserDataManager
+from modules.user_accounts.profile_store import get_profile_store
 from modules.logging.logger import setup_logger
 
 logger = setup_logger('persona_manager.py')
@@ -29,8 +30,20 @@ class PersonaManager:
             self.load_personas(self.PERSONAS_FILE_NAME, self.user)
             self.default_persona = next((persona for persona in self.personas if persona["name"] == self.default_persona_name), None)
             self.current_persona = self.personalize_persona(self.default_persona, self.user) if self.default_persona else None
+            get_profile_store(self.user).subscribe(self.on_profile_changed)
         except Exception as e:
             logger.error(f"Error initializing PersonaManager: {e}")
+
+    def on_profile_changed(self, profile):
+        """Re-personalizes the current persona when the background services update the user's profile."""
+        if not self.current_persona:
+            return
+        persona = next((persona for persona in self.personas if persona["name"] == self.current_persona["name"]), None)
+        if persona is None:
+            return
+        self.user_profile = self.user_data_manager.format_profile_as_text(profile)
+        self.current_persona = self.fill_placeholders(persona)
+        logger.info("Persona updated with the changed user profile.")
                             
     def updater(self, selected_persona_name, user):
         logger.info(f"Attempting to update persona to {selected_persona_name}.")
@@ -48,11 +61,14 @@ class PersonaManager:
     def personalize_persona(self, persona, user):
         logger.info("Attempting to personalize persona with user content.")
         self.user_name = user
-        user_data_manager = UserDataManager(user)
-        self.user_profile = user_data_manager.get_profile_text()
-        self.user_emr = user_data_manager.get_emr()
-        self.system_info = user_data_manager.get_system_info()  
+        self.user_data_manager = UserDataManager(user)
+        self.user_profile = self.user_data_manager.get_profile_text()
+        self.user_emr = self.user_data_manager.get_emr()
+        self.system_info = self.user_data_manager.get_system_info()  
+
+        return self.fill_placeholders(persona)
 
+    def fill_placeholders(self, persona):
         user_data = {
             "<<name>>": self.user_name,
             "<<Profile>>": self.user_profile,
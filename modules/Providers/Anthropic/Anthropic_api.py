@@ -1,9 +1,12 @@
 # gui/Anthropic/Anthropic_api.py
 
 import anthropic
+import logging
 import os
 from dotenv import load_dotenv
+from modules.Analytics.tracing import traced
 from modules.logging.logger import setup_logger
+from modules.logging.structured import log_payload
 
 logger = setup_logger('Anthropic_api.py')
 
@@ -19,6 +22,7 @@ else:
                 api_key=Anthropic_API_KEY,
             )
 
+        @traced("llm.request", root=False)
         async def generate_conversation(self, data):
             try:
                 response = self.client.messages.create(**data)
@@ -50,7 +54,7 @@ else:
 
                 response = self.client.messages.create(**payload)
                 logger.info("CBS response received from Anthropic API.")
-                logger.debug(f"CBS response: {response}")
+                log_payload(logger, logging.DEBUG, "CBS response", data=response)
 
                 return response
             except Exception as e:
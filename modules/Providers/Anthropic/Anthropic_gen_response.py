@@ -1,13 +1,17 @@
 # modules/Providers/Anthropic/Anthropic_gen_response.py
 
 import json
+import logging
 from .Anthropic_api import AnthropicAPI
 #from modules.speech_services.GglCldSvcs.tts import tts, get_tts
 from modules.speech_services.Eleven_Labs.tts import tts, get_tts
 
 from datetime import datetime
-from modules.chat_history.convo_manager import ConversationManager
+from modules.Analytics.token_counter.token_db import get_token_usage_recorder
+from modules.Analytics.token_counter.tokenizer_service import get_tokenizer_service
+from modules.chat_history.context_builder import count_system_tokens
 from modules.logging.logger import setup_logger
+from modules.logging.structured import log_payload
 
 logger = setup_logger('Anthropic_gen_response.py')
 
@@ -43,11 +47,8 @@ def get_Anthropic_model():
     return MODEL
 
 def create_request_body(current_persona, messages, temperature_var, top_p_var, top_k_var, funtions=None):
-    logger.info("Creating request body.")
-    logger.info({MODEL})
-    logger.info({MAX_TOKENS})
-    logger.info({temperature_var})
-    logger.info({top_p_var})
+    log_payload(logger, logging.INFO, "Creating request body", model=MODEL, max_tokens=MAX_TOKENS,
+                temperature=temperature_var, top_p=top_p_var, messages=len(messages))
 
     if isinstance(current_persona["content"], str):
         system_content = current_persona["content"]
@@ -70,7 +71,7 @@ async def generate_response(user, current_persona, message, session_id, conversa
     functions = None
 
     if "name" in current_persona:
-        conversation_history = ConversationManager(user, current_persona["name"], provider_manager)
+        conversation_history = conversation_manager
     else:
         conversation_history = None
     
@@ -79,10 +80,10 @@ async def generate_response(user, current_persona, message, session_id, conversa
 
     if message:
         current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        conversation_history.add_message(user, conversation_id, "user", message, current_time)
+        await conversation_history.add_message(user, conversation_id, "user", message, current_time)
         logger.info("New user message added to conversation history.")
 
-    messages = conversation_history.get_history(user, conversation_id)
+    messages = await conversation_history.get_context(user, conversation_id, model_manager.get_context_budget(), count_system_tokens(current_persona, functions, model_manager.get_model()))
     for msg in messages:
         if 'timestamp' in msg:
             del msg['timestamp']
@@ -96,13 +97,18 @@ async def generate_response(user, current_persona, message, session_id, conversa
       
     logger.info(f"Starting response generation for user: {user}, session_id: {session_id}, conversation_id: {conversation_id}")
     logger.info("Data being sent in HTTP request to AnthropicAPI.")
-    logger.debug("Data: %s", data)
+    log_payload(logger, logging.DEBUG, "Request data", data=data)
+
+    tokenizer = get_tokenizer_service()
+    # The system prompt is sent beside the messages but billed as prompt tokens all the same.
+    estimate = tokenizer.estimate_cost([{"role": "system", "content": data["system"]}] + data["messages"], data["model"], data["max_tokens"])
+    logger.info(f"Request estimate: {estimate['prompt_tokens']} prompt tokens, up to ${estimate['max_total_cost'] or 0:.4f}")
 
     response_data = await api.generate_conversation(data)
 
     if response_data:
         logger.info("response from Anthropic API.")
-        logger.debug(f"response: {response_data}")
+        log_payload(logger, logging.DEBUG, "Response data", data=response_data)
         content_blocks = response_data.content
         text = ''
         if not content_blocks:
@@ -119,13 +125,21 @@ async def generate_response(user, current_persona, message, session_id, conversa
                 else:
                     logger.warning(f"A content block of type '{block.type}' was found, which is not handled by this method.")
             
-        logger.debug(f"Extracted response: {text}")
+        log_payload(logger, logging.DEBUG, "Extracted response", text=text)
+
+        usage = getattr(response_data, "usage", None)
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.input_tokens, usage.output_tokens
+        else:
+            # The API did not report usage; record the local counts instead.
+            prompt_tokens, completion_tokens = estimate["prompt_tokens"], tokenizer.count_text(text, data["model"])
+        get_token_usage_recorder().record(getattr(response_data, "model", None) or data["model"], prompt_tokens, completion_tokens,
+                                          user=user, conversation_id=conversation_id, session_id=session_id)
 
         if text:
             current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            conversation_history.add_message(user, conversation_id, "assistant", text, current_time)
+            await conversation_history.add_message(user, conversation_id, "assistant", text, current_time)
             logger.info("Assistant message added to conversation history.")
-            logger.debug(f"Message: {text}")
 
         try:
             if get_tts():
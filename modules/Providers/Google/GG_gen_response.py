@@ -1,13 +1,17 @@
 # Google/GG_gen_response.py
 
+import logging
 import re
 from datetime import datetime
 # from modules.speech_services.GglCldSvcs.tts import tts, get_tts
 from modules.speech_services.Eleven_Labs.tts import tts, get_tts
-from modules.chat_history.convo_manager import ConversationManager
 from modules.Providers.Google.genai_api import GenAIAPI
 from modules.Tools.GG_Tool_Manager import ToolManager
+from modules.Analytics.token_counter.token_db import get_token_usage_recorder
+from modules.Analytics.token_counter.tokenizer_service import get_tokenizer_service
+from modules.chat_history.context_builder import count_system_tokens
 from modules.logging.logger import setup_logger
+from modules.logging.structured import log_payload
 
 logger = setup_logger('GG_gen_response.py')
 
@@ -45,7 +49,7 @@ async def generate_response(user, current_persona, message, session_id, conversa
     logger.info("Starting response generation")
 
     if "name" in current_persona:
-        conversation_history = ConversationManager(user, current_persona["name"], provider_manager)
+        conversation_history = conversation_manager
     else:
         conversation_history = None
 
@@ -56,10 +60,10 @@ async def generate_response(user, current_persona, message, session_id, conversa
 
     if message:
         current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        conversation_history.add_message(user, conversation_id, "user", message, current_time)
+        await conversation_history.add_message(user, conversation_id, "user", message, current_time)
         logger.info("New user message added to conversation history.")
 
-    messages = conversation_history.get_history(user, conversation_id)
+    messages = await conversation_history.get_context(user, conversation_id, model_manager.get_context_budget(), count_system_tokens(current_persona, model=model_manager.get_model()))
     for msg in messages:
         if 'timestamp' in msg:
             del msg['timestamp']
@@ -71,13 +75,18 @@ async def generate_response(user, current_persona, message, session_id, conversa
     data = create_request_body(current_persona, messages, temperature_var, top_p_var, top_k_var)
 
     logger.info("Sending request to Google API.")
-    logger.debug(f"Data: {data}")
+    log_payload(logger, logging.DEBUG, "Request data", data=data)
 
     # Get the model from the model manager
     GG_MODEL = model_manager.get_model()
 
     genai_api = GenAIAPI(GG_MODEL)
 
+    tokenizer = get_tokenizer_service()
+    prompt = [{"role": content["role"], "content": " ".join(part["text"] for part in content["parts"])} for content in data["contents"]]
+    estimate = tokenizer.estimate_cost(prompt, GG_MODEL, data["generation_config"]["max_output_tokens"])
+    logger.info(f"Request estimate: {estimate['prompt_tokens']} prompt tokens, up to ${estimate['max_total_cost'] or 0:.4f}")
+
     # Call the generate_content method asynchronously
     response_data = await genai_api.generate_content(data)
 
@@ -88,11 +97,11 @@ async def generate_response(user, current_persona, message, session_id, conversa
             function_response, error_occurred = await ToolManager.handle_function_call(user, conversation_id, response_data, conversation_history, function_map)
 
             if not error_occurred:
-                ToolManager.logger.info(f"Function call successful with response: {function_response}")
+                log_payload(logger, logging.INFO, "Function call successful", response=function_response)
             else:
-                ToolManager.logger.error(f"Error occurred in function call: {function_response}")
+                log_payload(logger, logging.ERROR, "Error occurred in function call", response=function_response)
         except Exception as e:
-            ToolManager.logger.error(f"Exception handling function call: {e}", exc_info=True)
+            logger.error(f"Exception handling function call: {e}", exc_info=True)
 
     try:
         if hasattr(response_data, 'candidates') and len(response_data.candidates) > 0:
@@ -100,14 +109,14 @@ async def generate_response(user, current_persona, message, session_id, conversa
             ChatResponse = ""
             for part in detailed_content:
                 ChatResponse += part.text + "\n"
-            logger.debug(f"Raw detailed_content: {detailed_content}")
+            log_payload(logger, logging.DEBUG, "Raw detailed_content", parts=lambda: [str(part) for part in detailed_content])
 
             separator = ": "
             persona_prefix = f"{current_persona.get('name', '')}{separator}"
             if ChatResponse.startswith(persona_prefix):
                 ChatResponse = ChatResponse[len(persona_prefix):]
 
-            logger.debug(f"ChatResponse: {ChatResponse}")
+            log_payload(logger, logging.DEBUG, "ChatResponse", text=ChatResponse)
 
         else:
             logger.warning("Unexpected structure in response_data or candidates list is empty.")
@@ -115,10 +124,18 @@ async def generate_response(user, current_persona, message, session_id, conversa
     except Exception as e:
         logger.error(f"Error processing response_data: {e}")
         ChatResponse = "An error occurred while processing the response."
-        logger.debug(f"Error response: {ChatResponse}")
         raise
 
-    conversation_history.add_message(user, conversation_id, "assistant", ChatResponse, current_time)
+    usage = getattr(response_data, "usage_metadata", None)
+    if usage is not None:
+        prompt_tokens, completion_tokens, total_tokens = usage.prompt_token_count, usage.candidates_token_count, usage.total_token_count
+    else:
+        # The API did not report usage; record the local counts instead.
+        prompt_tokens, completion_tokens, total_tokens = estimate["prompt_tokens"], tokenizer.count_text(ChatResponse, GG_MODEL), None
+    get_token_usage_recorder().record(GG_MODEL, prompt_tokens, completion_tokens, total_tokens,
+                                      user=user, conversation_id=conversation_id, session_id=session_id)
+
+    await conversation_history.add_message(user, conversation_id, "assistant", ChatResponse, current_time)
 
     try:
         if get_tts():
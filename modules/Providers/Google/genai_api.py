@@ -3,6 +3,7 @@
 import google.generativeai as genai
 import os
 from dotenv import load_dotenv
+from modules.Analytics.tracing import traced
 from modules.logging.logger import setup_logger
 
 logger = setup_logger('genai_api.py')
@@ -19,6 +20,7 @@ else:
         def __init__(self, model='gemini-pro'):
             self.model = genai.GenerativeModel(model)
 
+        @traced("llm.request", root=False)
         async def generate_content(self, data):
             try:
                 response_data = self.model.generate_content(**data)
@@ -1,6 +1,7 @@
 # gui/Mistral/Mistral_gen_response.py
 
 import json
+import logging
 import re
 import inspect
 import importlib.util
@@ -9,8 +10,12 @@ from modules.Providers.Mistral.Mistral_api import MistralAPI
 #from modules.speech_services.GglCldSvcs.tts import tts, get_tts
 from modules.speech_services.Eleven_Labs.tts import tts, get_tts
 from datetime import datetime
-from modules.chat_history.convo_manager import ConversationManager
+from modules.Analytics.token_counter.token_db import get_token_usage_recorder
+from modules.Analytics.token_counter.tokenizer_service import get_tokenizer_service
+from modules.chat_history.context_builder import count_system_tokens
 from modules.logging.logger import setup_logger
+from modules.logging.structured import log_payload
+from modules.Tools.tool_context import with_turn_context
 
 logger = setup_logger('Mistral_gen_response.py')
 
@@ -101,25 +106,44 @@ def create_request_body(current_persona, messages, temperature_var, top_p_var, f
 
     return data
 
+async def generate_conversation(data, user=None, conversation_id=None, session_id=None):
+    """Sends data to the Mistral API, logging its estimated cost first and recording its token usage after."""
+    tokenizer = get_tokenizer_service()
+    estimate = tokenizer.estimate_cost(data["messages"], data.get("model"), data.get("max_tokens") or 0, data.get("tools"))
+    logger.info(f"Request estimate: {estimate['prompt_tokens']} prompt tokens, up to ${estimate['max_total_cost'] or 0:.4f}")
+
+    response_data = await api.generate_conversation(data)
+
+    if response_data and response_data.get("choices"):
+        usage = response_data.get("usage") or {
+            # The API did not report usage; record the local counts instead.
+            "prompt_tokens": estimate["prompt_tokens"],
+            "completion_tokens": tokenizer.count_message(response_data["choices"][0]["message"], data.get("model")),
+        }
+        get_token_usage_recorder().record(response_data.get("model") or data.get("model"), usage.get("prompt_tokens"),
+                                          usage.get("completion_tokens"), usage.get("total_tokens"),
+                                          user=user, conversation_id=conversation_id, session_id=session_id)
+    return response_data
+
 async def handle_function_call(user, conversation_id, message, conversation_history, function_map):
     entry_time = datetime.now()
     logger.debug(f"Entering handle_function_call at {entry_time.isoformat()}")
     
-    logger.info(f"Raw function call: {message}")    
+    log_payload(logger, logging.DEBUG, "Raw function call", message=message)
     function_name = message["function_call"]["name"]
     function_args_json = message["function_call"].get("arguments", "{}")
 
     try:
         function_args = json.loads(function_args_json)
-        logger.info(f"Decoded args: {function_args}")  
     except json.JSONDecodeError as e:
         logger.error(f"Error decoding JSON: {e}")
         function_args = {}  
 
-    logger.info(f"Function name: {function_name}")
-    logger.info(f"Function args: {function_args}")
+    log_payload(logger, logging.INFO, "Function call", function=function_name, arguments=function_args)
 
     if function_name in function_map:
+        function_args = with_turn_context(function_map[function_name], function_args, user=user,
+                                          conversation_id=conversation_id, conversation_manager=conversation_history)
         required_args = get_required_args(function_map[function_name])  
         logger.info(f"Required args for {function_name}: {required_args}")  
         missing_args = set(required_args) - set(function_args.keys())
@@ -129,9 +153,8 @@ async def handle_function_call(user, conversation_id, message, conversation_hist
             return f"Error: Not all required arguments provided for {function_name}. Missing: {', '.join(missing_args)}", True
 
         try:
-            logger.info(f"Calling function {function_name} with arguments {function_args}")
             function_response = await function_map[function_name](**function_args)
-            logger.info(f"Function response: {function_response}")
+            log_payload(logger, logging.INFO, "Function response", function=function_name, response=function_response)
         except Exception as e:
             logger.error(f"Exception during function call {function_name}: {e}", exc_info=True)
             return f"Error: Exception during function call {function_name}: {e}", True
@@ -154,7 +177,7 @@ async def generate_response(user, current_persona, message, session_id, conversa
     function_map = load_function_map_from_current_persona(current_persona)
 
     if "name" in current_persona: 
-        conversation_history = ConversationManager(user, current_persona["name"], provider_manager)
+        conversation_history = conversation_manager
     else:
         conversation_history = None
     
@@ -163,10 +186,10 @@ async def generate_response(user, current_persona, message, session_id, conversa
 
     if message:  
         current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        conversation_history.add_message(user, conversation_id, "user", message, current_time)
+        await conversation_history.add_message(user, conversation_id, "user", message, current_time)
         logger.info("New user message added to conversation history.")
 
-    messages = conversation_history.get_history(user, conversation_id)
+    messages = await conversation_history.get_context(user, conversation_id, model_manager.get_context_budget(), count_system_tokens(current_persona, functions, model_manager.get_model()))
     for msg in messages:
         if 'timestamp' in msg:
             del msg['timestamp']
@@ -183,9 +206,9 @@ async def generate_response(user, current_persona, message, session_id, conversa
       
     logger.info(f"Starting response generation for user: {user}, session_id: {session_id}, conversation_id: {conversation_id}")
 
-    logger.info("Data being sent in HTTP request to Mistral API: %s", data) 
+    log_payload(logger, logging.INFO, "Data being sent in HTTP request to Mistral API", data=data)
 
-    response_data = await api.generate_conversation(data)
+    response_data = await generate_conversation(data, user, conversation_id, session_id)
 
     
     if response_data:
@@ -202,20 +225,20 @@ async def generate_response(user, current_persona, message, session_id, conversa
         
         if text:  
             current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')  
-            conversation_history.add_message(user, conversation_id, "assistant", text, current_time)
+            await conversation_history.add_message(user, conversation_id, "assistant", text, current_time)
             logger.info("Assistant message added to conversation history.")
 
         if message.get("function_call"):
             function_response, error_occurred = await handle_function_call(user, conversation_id, message, conversation_history, function_map)
 
             current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            conversation_history.add_response(user, conversation_id, function_response, current_time)
+            await conversation_history.add_response(user, conversation_id, function_response, current_time)
             logger.info("Function call response added to responses table.")
 
             formatted_function_response = f"System Message: The function call was executed successfully with the following results: {message['function_call']['name']}: {function_response} Provide the answer ['user'] question, a summary or ask for further details?"
 
             data["messages"].append({"role": "user", "content": formatted_function_response})
-            response_data = await api.generate_conversation(data)
+            response_data = await generate_conversation(data, user, conversation_id, session_id)
 
             if response_data:
                 new_message = response_data["choices"][0]["message"]
@@ -231,7 +254,7 @@ async def generate_response(user, current_persona, message, session_id, conversa
                 
                 if new_text:
                     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    conversation_history.add_message(user, conversation_id, "assistant", new_text, current_time)                    
+                    await conversation_history.add_message(user, conversation_id, "assistant", new_text, current_time)                    
                     logger.info("Assistant message added to conversation history.")
 
                 try:
@@ -263,7 +286,7 @@ async def call_model_with_new_prompt(prompt, current_persona, temperature_var, t
     
     data = create_request_body(current_persona, [{"role": "user", "content": prompt}], temperature_var, top_p_var)
     
-    response_data = await api.generate_conversation(data)
+    response_data = await generate_conversation(data)
     
     if response_data and response_data.get("choices"):
         return response_data["choices"][0]["message"]["content"]
@@ -2,14 +2,15 @@
 
 import logging
 
-logger = logging.getLogger('create_request_body.py')
+from modules.logging.logger import setup_logger
+from modules.logging.structured import log_payload
+
+logger = setup_logger('create_request_body.py')
 
 def create_request_body(model, current_persona, messages, temperature_var, top_p_var, max_tokens, functions=None):
-    logger.info("Creating request body.")
-    logger.info(f"Model: {model}")
-    logger.info(f"Max Tokens: {max_tokens}")
-    logger.info(f"Temperature: {temperature_var}")
-    logger.info(f"Messages: {messages}")
+    log_payload(logger, logging.INFO, "Creating request body", model=model, max_tokens=max_tokens,
+                temperature=temperature_var, messages=len(messages))
+    log_payload(logger, logging.DEBUG, "Request messages", messages=messages)
 
     data = {
         "model": model,
@@ -1,8 +1,14 @@
 # modules/Providers/OpenAI/OA_gen_response.py
 
+import logging
+
 from .openai_api import OpenAIAPI
 from datetime import datetime
+from modules.Analytics.token_counter.token_db import get_token_usage_recorder
+from modules.Analytics.token_counter.tokenizer_service import get_tokenizer_service
+from modules.chat_history.context_builder import count_system_tokens
 from modules.logging.logger import setup_logger
+from modules.logging.structured import log_payload
 from modules.Providers.OpenAI.CreateRequest import create_request_body
 from modules.Tools.ToolManager import load_function_map_from_current_persona, load_functions_from_json, use_tool
 
@@ -27,10 +33,10 @@ async def generate_response(user, current_persona, message, session_id, conversa
 
     if message:
         current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        conversation_history.add_message(user, conversation_id, "user", message, current_time)
+        await conversation_history.add_message(user, conversation_id, "user", message, current_time)
         logger.info("New user message added to conversation history.")
 
-    messages = conversation_history.get_history(user, conversation_id)
+    messages = await conversation_history.get_context(user, conversation_id, model_manager.get_context_budget(), count_system_tokens(current_persona, functions, model_manager.get_model()))
     for msg in messages:
         if 'timestamp' in msg:
             del msg['timestamp']
@@ -42,12 +48,26 @@ async def generate_response(user, current_persona, message, session_id, conversa
 
     logger.info(f"Starting response generation for user: {user}, session_id: {session_id}, conversation_id: {conversation_id}")
 
-    logger.info("Data being sent in HTTP request to OpenAI: %s", data)
+    log_payload(logger, logging.INFO, "Data being sent in HTTP request to OpenAI", data=data)
+
+    tokenizer = get_tokenizer_service()
+    estimate = tokenizer.estimate_cost(data["messages"], data.get("model"), data.get("max_tokens") or 0, data.get("functions"))
+    logger.info(f"Request estimate: {estimate['prompt_tokens']} prompt tokens, up to ${estimate['max_total_cost'] or 0:.4f}")
 
     response_data = await api.generate_conversation(data)
 
     if response_data:
         message = response_data["choices"][0]["message"]
+
+        usage = response_data.get("usage") or {
+            # The API did not report usage; record the local counts instead.
+            "prompt_tokens": estimate["prompt_tokens"],
+            "completion_tokens": tokenizer.count_message(message, data.get("model")),
+        }
+        get_token_usage_recorder().record(response_data.get("model") or data.get("model"), usage.get("prompt_tokens"),
+                                          usage.get("completion_tokens"), usage.get("total_tokens"),
+                                          user=user, conversation_id=conversation_id, session_id=session_id)
+
         text = message["content"]
 
         if text is None:
@@ -64,7 +84,7 @@ async def generate_response(user, current_persona, message, session_id, conversa
                 from modules.speech_services.GglCldSvcs.tts import tts, get_tts
 
             if get_tts():
-                logger.info(f"Attempting to invoke TTS for the text: {text}")
+                log_payload(logger, logging.INFO, "Attempting to invoke TTS", text=text)
                 if contains_code(text):
                     logger.info("Skipping TTS as the text contains code.")
                 else:
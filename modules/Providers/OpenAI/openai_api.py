@@ -1,9 +1,10 @@
 #gui\OpenAI\openai_api.py
 
-import aiohttp
 from dotenv import load_dotenv
 import os
+from modules.Analytics.tracing import traced
 from modules.logging.logger import setup_logger
+from modules.Providers.transport import get_transport
 
 logger = setup_logger('openai_api.py')
 
@@ -17,37 +18,37 @@ else:
 
     class OpenAIAPI:
         def __init__(self):
+            self.transport = get_transport("OpenAI")
             self.headers = {
                 "Content-Type": "application/json",
                 "Authorization": f"Bearer {api_key}",
             }
 
+        @traced("llm.request", root=False)
         async def generate_conversation(self, data):
             """
             Used by OA_gen_response.py for communication of user interactions with the OpenAI API.
             """
-            async with aiohttp.ClientSession() as session:
-                async with session.post(API_ENDPOINT, headers=self.headers, json=data) as response:
-                    if response.status == 200:
-                        response_data = await response.json()
-                        logger.info("Conversation response received from API.")
-                        return response_data
-                    else:
-                        error_message = await response.text()
-                        logger.error("Error generating conversation from API: %s: %s", response.status, error_message)
-                        return None
+            async with self.transport.request("POST", API_ENDPOINT, headers=self.headers, json=data) as response:
+                if response.status == 200:
+                    response_data = await response.json()
+                    logger.info("Conversation response received from API.")
+                    return response_data
+                else:
+                    error_message = await response.text()
+                    logger.error("Error generating conversation from API: %s: %s", response.status, error_message)
+                    return None
 
         async def generate_cognitive_background_service(self, data):
             """
             Used by ConitiveBackgroundServices.py for communication of system background interactions with the OpenAI API.
             """
-            async with aiohttp.ClientSession() as session:
-                async with session.post(API_ENDPOINT, headers=self.headers, json=data) as response:
-                    if response.status == 200:
-                        response_data = await response.json()
-                        logger.info("CBS response received from API.")
-                        return response_data
-                    else:
-                        error_message = await response.text()
-                        logger.error("Error generating CBS response from API: %s: %s", response.status, error_message)
-                        return None
\ No newline at end of file
+            async with self.transport.request("POST", API_ENDPOINT, headers=self.headers, json=data) as response:
+                if response.status == 200:
+                    response_data = await response.json()
+                    logger.info("CBS response received from API.")
+                    return response_data
+                else:
+                    error_message = await response.text()
+                    logger.error("Error generating CBS response from API: %s: %s", response.status, error_message)
+                    return None
\ No newline at end of file
@@ -0,0 +1,150 @@
+# modules/Providers/benchmarks/transport.py
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from modules.chat_history.connection_pool import StatementStats
+from modules.logging.logger import setup_logger
+from modules.Providers.transport import ProviderTransport
+
+logger = setup_logger('transport_benchmark.py')
+
+RESULT_FORMAT = "scout-provider-transport-benchmark"
+RESULT_VERSION = 1
+
+
+class MockProviderServer:
+    """
+    Local stand-in for a chat completions endpoint.
+
+    The first request on every new connection waits connect_delay seconds, standing in for the
+    DNS, TCP and TLS round trips a real provider costs per connection; every request then waits
+    latency seconds for the "generation". connections counts the connections clients opened.
+    """
+
+    def __init__(self, connect_delay=0.05, latency=0.01):
+        self.connect_delay = connect_delay
+        self.latency = latency
+        self.connections = set()
+        self.requests = 0
+        self.url = None
+        self._runner = None
+
+    async def _completions(self, request):
+        self.requests += 1
+        if request.transport not in self.connections:
+            self.connections.add(request.transport)
+            await asyncio.sleep(self.connect_delay)
+        data = await request.json()
+        await asyncio.sleep(self.latency)
+        return web.json_response({
+            "model": data.get("model"),
+            "choices": [{"message": {"role": "assistant", "content": "Hello from the mock provider."}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 7, "total_tokens": 17},
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._completions)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/v1/chat/completions"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+async def _per_request_session(url, payload):
+    # How the provider wrappers sent requests before: a new session, and connection, per call.
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, json=payload) as response:
+            return await response.json()
+
+
+async def _shared_transport(transport, url, payload):
+    async with transport.request("POST", url, json=payload) as response:
+        return await response.json()
+
+
+async def _run(mode, requests, concurrency, connect_delay, latency):
+    server = MockProviderServer(connect_delay, latency)
+    await server.start()
+    transport = ProviderTransport("Benchmark")
+    stats = StatementStats()
+    payload = {"model": "gpt-4o", "messages": [{"role": "user", "content": "Hello"}]}
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            if mode == "shared":
+                await _shared_transport(transport, server.url, payload)
+            else:
+                await _per_request_session(server.url, payload)
+            stats.record(mode, time.perf_counter() - start)
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        await transport.close()
+        await server.stop()
+
+    result = {"seconds": elapsed, "connections": len(server.connections), "requests": server.requests}
+    result.update(stats.summary()[mode])
+    if mode == "shared":
+        result["transport"] = transport.metrics()["counts"]
+    return result
+
+
+def run_transport_benchmark(requests=200, concurrency=4, connect_delay=0.05, latency=0.01):
+    """
+    Sends requests to MockProviderServer once with a new session per request and once through a
+    shared ProviderTransport.
+
+    Args:
+    - requests: Requests sent in each run.
+    - concurrency: Requests in flight at once.
+    - connect_delay: Seconds the server adds to the first request of each connection.
+    - latency: Seconds the server takes per request.
+
+    Returns:
+    - Dictionary with the config and, per run, the seconds, connections opened, and the count
+      and p50/p99/max request latency in milliseconds.
+    """
+    config = {"requests": requests, "concurrency": concurrency, "connect_delay": connect_delay, "latency": latency}
+    result = {"format": RESULT_FORMAT, "version": RESULT_VERSION, "config": config}
+    for mode in ("per_request", "shared"):
+        result[mode] = asyncio.run(_run(mode, requests, concurrency, connect_delay, latency))
+    before, after = result["per_request"]["seconds"], result["shared"]["seconds"]
+    result["speedup"] = before / after if after else 0.0
+    return result
+
+
+if __name__ == "__main__":
+    # python -m modules.Providers.benchmarks.transport --requests 200 --concurrency 4
+    parser = argparse.ArgumentParser(description="Compare a session per request with the shared provider transport against a local mock server.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--connect-delay", type=float, default=0.05, help="seconds of connection setup the mock server simulates")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per mock request")
+    parser.add_argument("--output", help="JSON file to write the results to (default: stdout)")
+    args = parser.parse_args()
+
+    result = run_transport_benchmark(args.requests, args.concurrency, args.connect_delay, args.latency)
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
@@ -1,5 +1,22 @@
 # modules/Providers/model_manager.py
 
+# Context window sizes in tokens, matched against the start of the model name in this order.
+CONTEXT_WINDOWS = [
+    ("gpt-4o", 128000),
+    ("chatgpt-4o", 128000),
+    ("gpt-4-turbo", 128000),
+    ("gpt-4-1106", 128000),
+    ("gpt-4-0125", 128000),
+    ("gpt-4", 8192),
+    ("o1", 128000),
+    ("gemini-1.5", 1048576),
+    ("models/gemini-exp", 32768),
+    ("claude-3", 200000),
+    ("mistral-large", 128000),
+    ("open-mistral-nemo", 128000),
+]
+DEFAULT_CONTEXT_WINDOW = 8192
+
 class ModelManager:
     def __init__(self):
         self.MODEL = "gpt-4o"
@@ -55,4 +72,14 @@ class ModelManager:
         return self.MODEL in self.ALLOWED_MODELS
 
     def get_max_tokens(self):
-        return self.MAX_TOKENS
\ No newline at end of file
+        return self.MAX_TOKENS
+
+    def get_context_window(self):
+        for prefix, window in CONTEXT_WINDOWS:
+            if self.MODEL.startswith(prefix):
+                return window
+        return DEFAULT_CONTEXT_WINDOW
+
+    def get_context_budget(self):
+        """Tokens left for the prompt once get_max_tokens is reserved for the completion."""
+        return self.get_context_window() - self.get_max_tokens()
\ No newline at end of file
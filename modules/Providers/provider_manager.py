@@ -1,6 +1,7 @@
 # modules/Providers/provider_manager.py
 
 import logging
+from modules.logging.structured import log_payload
 from modules.speech_services.Eleven_Labs.tts import get_voices as eleven_labs_get_voices, set_voice as eleven_labs_set_voice
 from modules.speech_services.GglCldSvcs.tts import get_voices as google_get_voices, set_voice as google_set_voice
 
@@ -94,7 +95,7 @@ class ProviderManager:
         else:
             logger.error(f"Unsupported speech provider: {self.current_speech_provider}")
             self.voices = []
-        logger.info(f"Loaded voices: {self.voices}")
+        log_payload(logger, logging.INFO, "Loaded voices", count=len(self.voices), voices=self.voices)
 
     def get_voices(self):
         return self.voices
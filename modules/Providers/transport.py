@@ -0,0 +1,167 @@
+# modules/Providers/transport.py
+
+import asyncio
+import contextlib
+import threading
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from modules.chat_history.connection_pool import StatementStats
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('transport.py')
+
+# Connections a provider keeps open in total and to any one host; further requests wait for one.
+CONNECTION_LIMIT = 32
+CONNECTIONS_PER_HOST = 8
+
+# Seconds an idle connection is kept for the next request.
+KEEPALIVE_TIMEOUT = 60
+
+# Seconds a resolved host name is reused.
+DNS_CACHE_TTL = 300
+
+# Seconds a whole request may take, response included; long generations are slow.
+REQUEST_TIMEOUT = 300
+
+# Options that differ from the defaults above, by provider name, e.g. {"OpenAI": {"limit_per_host": 16}}.
+TRANSPORT_OPTIONS = {}
+
+
+class ProviderTransport:
+    """
+    The HTTP client of one provider: a single long-lived aiohttp session and its connection pool.
+
+    Opening a ClientSession per request meant a DNS lookup, a TCP connect and a TLS handshake
+    before every call. Here connections are kept alive for KEEPALIVE_TIMEOUT seconds and reused,
+    host names are cached and the number of connections per host is bounded. aiohttp speaks
+    HTTP/1.1 only, so concurrent requests use parallel pooled connections rather than HTTP/2
+    streams.
+
+    A session belongs to the event loop it was created on; if requests come from another loop,
+    e.g. a second asyncio.run(), a new session is opened there. metrics() reports how many
+    connections were opened and reused, and the latency per host.
+    """
+
+    def __init__(self, name, limit=CONNECTION_LIMIT, limit_per_host=CONNECTIONS_PER_HOST,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, request_timeout=REQUEST_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.stats = StatementStats()
+        self.counts = {"requests": 0, "errors": 0, "connections_created": 0, "connections_reused": 0,
+                       "dns_lookups": 0, "dns_cache_hits": 0}
+        self._session = None
+        self._loop = None
+
+    def _counter(self, key):
+        async def count(session, context, params):
+            self.counts[key] += 1
+        return count
+
+    def _trace_config(self):
+        config = aiohttp.TraceConfig()
+        config.on_connection_create_end.append(self._counter("connections_created"))
+        config.on_connection_reuseconn.append(self._counter("connections_reused"))
+        config.on_dns_resolvehost_end.append(self._counter("dns_lookups"))
+        config.on_dns_cache_hit.append(self._counter("dns_cache_hits"))
+        return config
+
+    def _get_session(self):
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._loop is loop:
+            return self._session
+        if self._session is not None and not self._session.closed and self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop)
+        # The session of a loop that has ended can no longer be closed; it is dropped.
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                         keepalive_timeout=self.keepalive_timeout, ttl_dns_cache=DNS_CACHE_TTL)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                                              trace_configs=[self._trace_config()])
+        self._loop = loop
+        return self._session
+
+    @contextlib.asynccontextmanager
+    async def request(self, method, url, **kwargs):
+        """
+        Sends a request on a pooled connection; used like aiohttp's session.request.
+
+        async with transport.request("POST", url, headers=headers, json=data) as response: ...
+        """
+        session = self._get_session()
+        self.counts["requests"] += 1
+        start = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as response:
+                yield response
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.counts["errors"] += 1
+            raise
+        finally:
+            self.stats.record(f"{method} {urlsplit(url).netloc}", time.perf_counter() - start)
+
+    def metrics(self):
+        """
+        Returns the request / error / connection / DNS counts, the share of requests that reused a
+        kept-alive connection, and the p50/p99/max latency per method and host in milliseconds.
+        """
+        counts = dict(self.counts)
+        connections = counts["connections_created"] + counts["connections_reused"]
+        return {
+            "counts": counts,
+            "reuse_ratio": counts["connections_reused"] / connections if connections else 0.0,
+            "latency": self.stats.summary(),
+        }
+
+    def report(self):
+        metrics = self.metrics()
+        if not metrics["counts"]["requests"]:
+            return
+        logger.info(f"{self.name} transport: {metrics['counts']}, {metrics['reuse_ratio']:.0%} of connections reused")
+        for key, row in sorted(metrics["latency"].items()):
+            logger.info(f"[{row['count']} requests] p50={row['p50_ms']:.0f}ms p99={row['p99_ms']:.0f}ms max={row['max_ms']:.0f}ms :: {key}")
+
+    async def close(self):
+        """Closes the pooled connections. Must run on the loop the session was used on."""
+        session, self._session = self._session, None
+        if session is not None and not session.closed:
+            await session.close()
+        self.report()
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(name):
+    """Returns the transport shared by every API wrapper of the provider name."""
+    transport = _transports.get(name)
+    if transport is None:
+        with _transports_lock:
+            transport = _transports.get(name)
+            if transport is None:
+                transport = _transports[name] = ProviderTransport(name, **TRANSPORT_OPTIONS.get(name, {}))
+    return transport
+
+
+async def close_transport(name):
+    with _transports_lock:
+        transport = _transports.pop(name, None)
+    if transport is not None:
+        await transport.close()
+
+
+async def close_all_transports():
+    """Closes every provider's connections; called from the application's shutdown."""
+    with _transports_lock:
+        transports = list(_transports.values())
+        _transports.clear()
+    for transport in transports:
+        try:
+            await transport.close()
+        except Exception as e:
+            logger.error(f"Error closing {transport.name} transport: {e}")
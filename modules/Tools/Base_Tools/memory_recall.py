@@ -0,0 +1,51 @@
+# modules/Tools/Base_Tools/memory_recall.py
+
+import inspect
+
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('memory_recall.py')
+
+class MemoryRecall:
+    def __init__(self, persona_name):
+        self.persona_name = persona_name
+
+    async def _recall(self, query: str, k: int = 5, user=None, conversation_id=None, conversation_manager=None):
+        """
+        Find messages from past conversations that are related to the query.
+
+        Only the calling user's messages are searched, and the current conversation is left out.
+        user, conversation_id and conversation_manager are filled in by the tool manager from the
+        turn, never by the model; see tool_context.with_turn_context.
+
+        Parameters:
+        - query: What to remember, in natural language.
+        - k: Maximum number of messages to return. Default is 5.
+
+        Returns:
+        - A list of matching messages with their conversation, role, timestamp and similarity score.
+        """
+        logger.info("Recalling memories for: %s", query)
+        if user is None or conversation_manager is None:
+            logger.error("Memory recall called without the calling user's conversation")
+            return "Error: memory recall is only available inside a conversation."
+        try:
+            # ConversationManager.recall flushes queued writes and only returns this user's messages;
+            # the async manager runs it, and the vector scan, off the event loop.
+            results = conversation_manager.recall(user, query, k, conversation_id)
+            if inspect.isawaitable(results):
+                results = await results
+            logger.info("Recalled %d memories", len(results))
+            return [
+                {
+                    "conversation_id": result["conversation_id"],
+                    "role": result["role"],
+                    "content": result["content"],
+                    "timestamp": result["timestamp"],
+                    "score": round(result["score"], 3),
+                }
+                for result in results
+            ]
+        except Exception as e:
+            logger.error("An error occurred while recalling memories: %s", e)
+            return str(e)
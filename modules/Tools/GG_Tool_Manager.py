@@ -3,30 +3,14 @@
 import json
 import logging
 import inspect
-from logging.handlers import RotatingFileHandler
 from datetime import datetime
 import importlib.util
 import sys
+from modules.logging.logger import setup_logger
+from modules.logging.structured import log_payload
+from modules.Tools.tool_context import with_turn_context
 
-logger = logging.getLogger('Tool_Manager')
-
-log_filename = 'SCOUT.log'
-log_max_size = 10 * 1024 * 1024  # 10 MB
-log_backup_count = 5
-
-# Create rotating file handler for file logging
-rotating_handler = RotatingFileHandler(log_filename, maxBytes=log_max_size, backupCount=log_backup_count, encoding='utf-8')
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-rotating_handler.setFormatter(formatter)
-
-# Create stream handler for console logging
-stream_handler = logging.StreamHandler()
-stream_handler.setFormatter(formatter)
-
-# Attach handlers to the logger
-logger.addHandler(rotating_handler)
-logger.addHandler(stream_handler)
-logger.setLevel(logging.INFO)
+logger = setup_logger('Tool_Manager')
 
 def adjust_logging_level(level):
     """Adjust the logging level.
@@ -118,9 +102,11 @@ class ToolManager:
             logger.error(f"Error decoding JSON: {e}")
             function_args = {}
 
-        conversation_history.add_function_call(user, conversation_id, function_name, function_args_json, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        await conversation_history.add_function_call(user, conversation_id, function_name, function_args_json, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
         if function_name in function_map:
+            function_args = with_turn_context(function_map[function_name], function_args, user=user,
+                                              conversation_id=conversation_id, conversation_manager=conversation_history)
             required_args = ToolManager.get_required_args(function_map[function_name])
             missing_args = set(required_args) - set(function_args.keys())
 
@@ -129,6 +115,7 @@ class ToolManager:
                 return f"Error: Not all required arguments provided for {function_name}. Missing: {', '.join(missing_args)}", True
 
             try:
+                log_payload(logger, logging.INFO, "Calling function", function=function_name, arguments=function_args)
                 function_response = await function_map[function_name](**function_args)
             except Exception as e:
                 logger.error(f"Exception during function call {function_name}: {e}", exc_info=True)
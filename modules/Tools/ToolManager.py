@@ -2,17 +2,22 @@
 
 import asyncio
 import json
+import logging
 import inspect
 import importlib.util
 import sys
 
 from datetime import datetime
+from modules.Analytics.tracing import traced
 from modules.Providers.OpenAI.CreateRequest import create_request_body
 from modules.Providers.OpenAI.openai_api import OpenAIAPI
 #from modules.speech_services.GglCldSvcs import tts
 from modules.speech_services.Eleven_Labs.tts import tts, get_tts
+from modules.chat_history.context_builder import count_system_tokens
 from modules.logging.logger import setup_logger
+from modules.logging.structured import log_payload
 from modules.event_system import event_system
+from modules.Tools.tool_context import with_turn_context
 
 logger = setup_logger('ToolManager.py')
 
@@ -57,49 +62,49 @@ def load_functions_from_json(current_persona):
 
     return {}
 
+@traced("tool.use_tool")
 async def use_tool(user, conversation_id, message, conversation_history, function_map, functions, current_persona, temperature_var, top_p_var, conversation_manager, model_manager):
     logger.info(f"use_tool called for user: {user}, conversation_id: {conversation_id}")
-    logger.debug(f"Full message: {message}")
+    log_payload(logger, logging.DEBUG, "Full message", message=message)
     
     if message.get("function_call"):
         logger.info(f"Function call detected: {message['function_call']['name']}")
         function_response, error_occurred = await handle_function_call(user, conversation_id, message, conversation_history, function_map)
 
-        logger.info(f"Function call response: {function_response}")
+        log_payload(logger, logging.INFO, "Function call response", response=function_response)
         logger.info(f"Error occurred: {error_occurred}")
 
         current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        conversation_history.add_response(user, conversation_id, function_response, current_time)
+        await conversation_history.add_response(user, conversation_id, function_response, current_time)
         logger.info("Function call response added to responses table.")
 
         formatted_function_response = f"System Message: The function call was executed successfully with the following results: {message['function_call']['name']}: {function_response} If needed, you can make another tool call for further processing or multi-step requests. Provide the answer to the user's question, a summary or ask for further details."
 
-        logger.debug(f"Formatted function response: {formatted_function_response}")
+        log_payload(logger, logging.DEBUG, "Formatted function response", prompt=formatted_function_response)
 
-        messages = conversation_history.get_history(user, conversation_id)
-        logger.debug(f"Conversation history: {messages}")
+        messages = await conversation_history.get_context(user, conversation_id, model_manager.get_context_budget(), count_system_tokens(current_persona, functions, model_manager.get_model()))
+        log_payload(logger, logging.DEBUG, "Conversation history", count=len(messages), messages=messages)
 
         new_text = await call_model_with_new_prompt(formatted_function_response, current_persona, messages, temperature_var, top_p_var, functions, model_manager)
         
-        logger.info(f"Model response: {new_text}")
+        log_payload(logger, logging.INFO, "Model response", text=new_text)
 
         if new_text is None:
             logger.warning("Model returned None response")
             new_text = "Tool Manager says: Sorry, I couldn't generate a meaningful response. Please try again or provide more context."
 
-        logger.info("Assistant: %s", new_text)
-
         if new_text:
             current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            conversation_history.add_message(user, conversation_id, "assistant", new_text, current_time)
+            await conversation_history.add_message(user, conversation_id, "assistant", new_text, current_time)
             logger.info("Assistant message added to conversation history.")
 
         return new_text
     return None
 
+@traced("tool.handle_function_call")
 async def handle_function_call(user, conversation_id, message, conversation_history, function_map):
     logger.info(f"handle_function_call for user: {user}, conversation_id: {conversation_id}")
-    logger.debug(f"Full message: {message}")
+    log_payload(logger, logging.DEBUG, "Full message", message=message)
     
     function_name = message["function_call"]["name"]
     function_args_json = message["function_call"].get("arguments", "{}")
@@ -107,12 +112,14 @@ async def handle_function_call(user, conversation_id, message, conversation_hist
     try:
         function_args = json.loads(function_args_json)
         logger.info(f"Function name: {function_name}")
-        logger.debug(f"Function args: {function_args}")
+        log_payload(logger, logging.DEBUG, "Function args", arguments=function_args)
     except json.JSONDecodeError as e:
         logger.error(f"Error decoding JSON: {e}")
         return f"Error: Invalid JSON in function arguments: {e}", True
 
     if function_name in function_map:
+        function_args = with_turn_context(function_map[function_name], function_args, user=user,
+                                          conversation_id=conversation_id, conversation_manager=conversation_history)
         required_args = get_required_args(function_map[function_name])
         logger.info(f"Required args for {function_name}: {required_args}")
         logger.info(f"Provided args: {list(function_args.keys())}")
@@ -123,12 +130,12 @@ async def handle_function_call(user, conversation_id, message, conversation_hist
             return f"Error: Not all required arguments provided for {function_name}. Missing: {', '.join(missing_args)}", True
 
         try:
-            logger.info(f"Calling function {function_name} with arguments {function_args}")
+            log_payload(logger, logging.INFO, "Calling function", function=function_name, arguments=function_args)
             if asyncio.iscoroutinefunction(function_map[function_name]):
                 function_response = await function_map[function_name](**function_args)
             else:
                 function_response = function_map[function_name](**function_args)
-            logger.info(f"Function response: {function_response}")
+            log_payload(logger, logging.INFO, "Function response", function=function_name, response=function_response)
             
             # Publish event for code execution
             if function_name == "execute_python":
@@ -144,10 +151,11 @@ async def handle_function_call(user, conversation_id, message, conversation_hist
     return None, True
 
 
+@traced("tool.call_model")
 async def call_model_with_new_prompt(prompt, current_persona, messages, temperature_var, top_p_var, functions, model_manager):
     logger.info("call_model_with_new_prompt called")
-    logger.info(f"Prompt: {prompt}")
-    logger.debug(f"Messages: {messages}")
+    log_payload(logger, logging.INFO, "Prompt", prompt=prompt)
+    log_payload(logger, logging.DEBUG, "Messages", count=len(messages), messages=messages)
     
     data = create_request_body(model_manager.get_model(), current_persona, 
                            messages + [{"role": "user", "content": prompt}], 
@@ -155,14 +163,14 @@ async def call_model_with_new_prompt(prompt, current_persona, messages, temperat
                            top_p_var, model_manager.get_max_tokens(), functions 
                            if model_manager.is_model_allowed() else None)
     
-    logger.debug(f"Request data: {data}")
+    log_payload(logger, logging.DEBUG, "Request data", data=data)
     
     response_data = await api.generate_conversation(data)
     
-    logger.debug(f"Response data: {response_data}")
+    log_payload(logger, logging.DEBUG, "Response data", data=response_data)
 
     if response_data and response_data.get("choices"):
         return response_data["choices"][0]["message"]["content"]
     else:
-        logger.error(f"Failed to get valid response from model. Response data: {response_data}")
+        log_payload(logger, logging.ERROR, "Failed to get valid response from model", data=response_data)
         return None
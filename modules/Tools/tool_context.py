@@ -0,0 +1,21 @@
+# modules/Tools/tool_context.py
+
+import inspect
+
+# Parameters a tool function can declare to be given the turn it runs in. They are always filled
+# in by the tool manager and never taken from the arguments the model sent, so a tool that scopes
+# what it returns to the user cannot be pointed at another user's data.
+TURN_CONTEXT_ARGS = ("user", "conversation_id", "conversation_manager")
+
+
+def with_turn_context(function, function_args, **context):
+    """
+    Returns the arguments to call function with: function_args without any turn context
+    parameter, plus the ones function declares, taken from context.
+    """
+    parameters = inspect.signature(function).parameters
+    args = {name: value for name, value in function_args.items() if name not in TURN_CONTEXT_ARGS}
+    for name in TURN_CONTEXT_ARGS:
+        if name in parameters and name in context:
+            args[name] = context[name]
+    return args
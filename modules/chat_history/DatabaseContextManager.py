@@ -1,22 +1,52 @@
 #gui/chat_history/convo_manager.py
 
-import sqlite3
+import time
+
+from modules.chat_history.connection_pool import get_pool
 from modules.logging.logger import setup_logger
 
 logger = setup_logger('database_manager.py')
 
 class DatabaseContextManager:
+    """
+    Hands out a cursor on the calling thread's pooled connection for db_path.
+
+    The connection stays open after the block; only the transaction is finished, committed on
+    success and rolled back if the block raised. A block opened inside another on the same
+    thread shares its connection, so it runs in a SAVEPOINT instead: released on success, rolled
+    back to on error, leaving the outer block's transaction for the outer block to finish.
+    """
     def __init__(self, db_path):
         self.db_path = db_path
+        self.pool = None
+        self.state = None
         self.conn = None
         self.cursor = None
+        self.savepoint = None
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.execute("PRAGMA journal_mode=WAL")
-        self.cursor = self.conn.cursor()
+        self.pool = get_pool(self.db_path)
+        self.state = self.pool.thread_connection()
+        self.conn = self.state.conn
+        self.cursor = self.pool.cursor()
+        if self.state.depth:
+            self.savepoint = f"nested_{self.state.depth}"
+            self.cursor.execute(f"SAVEPOINT {self.savepoint}")
+        self.state.depth += 1
         return self.cursor
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.conn.commit()
-        self.conn.close()
\ No newline at end of file
+        self.state.depth -= 1
+        try:
+            if self.savepoint is not None:
+                if exc_type is not None:
+                    self.conn.execute(f"ROLLBACK TO SAVEPOINT {self.savepoint}")
+                self.conn.execute(f"RELEASE SAVEPOINT {self.savepoint}")
+            elif exc_type is None:
+                start = time.perf_counter()
+                self.conn.commit()
+                self.pool.stats.record("COMMIT", time.perf_counter() - start)
+            else:
+                self.conn.rollback()
+        finally:
+            self.cursor.close()
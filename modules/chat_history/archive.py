@@ -0,0 +1,360 @@
+# modules/chat_history/archive.py
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+
+from modules.chat_history.DatabaseContextManager import DatabaseContextManager
+from modules.chat_history.codec import get_codec, close_codec
+from modules.chat_history.connection_pool import get_pool, close_pool
+from modules.chat_history.history_cache import invalidate_history
+from modules.chat_history.migrations import PERSONA_DB_GLOB, migrate_database
+from modules.chat_history.semantic_memory import get_semantic_memory, close_semantic_memory
+from modules.chat_history.write_behind import flush_write_behind_queue
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('archive.py')
+
+# Every record in a segment file starts with RECORD_MAGIC, the payload length and its CRC32.
+RECORD_MAGIC = b"SCAR"
+RECORD = struct.Struct(">4sII")
+
+# Conversations not modified for this many days are moved out of the hot database.
+ARCHIVE_AFTER_DAYS = 90
+
+# Conversations archived per transaction.
+ARCHIVE_BATCH_SIZE = 50
+
+# Tables holding the rows of a conversation besides conversations itself, in insert order.
+CONVERSATION_TABLES = ("messages", "function_calls", "responses")
+
+
+def _table_columns(cursor, table):
+    return [row[1] for row in cursor.execute(f"PRAGMA table_info({table});").fetchall()]
+
+
+def _rows_as_dicts(cursor):
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+class ConversationArchive:
+    """
+    Cold storage for the conversations of one persona database.
+
+    archive() moves conversations that have not been touched for a while, together with their
+    messages, function calls and responses, into append-only segment files next to the
+    database, one per month of last modification. Each conversation becomes a single compressed
+    record; the archived_conversations table keeps its listing metadata and the record's
+    location, and archived_conversations_fts indexes its text, so the hot database only holds a
+    small row per archived conversation. restore() moves a conversation back when it is opened.
+
+    Records replaced by a restore or a delete stay in their segment until compact() rewrites it.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.directory = os.path.splitext(db_path)[0] + ".archive"
+        self.codec = get_codec(db_path)
+        # Serialises appends to the segment files.
+        self._lock = threading.Lock()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def _encode_record(self, record):
+        # Records are compressed without the database's shared dictionaries so a segment file
+        # can be read on its own.
+        payload = self.codec.encode(json.dumps(record, ensure_ascii=False), use_dictionary=False)
+        return payload.encode("utf-8") if isinstance(payload, str) else payload
+
+    def _append(self, segment, payloads):
+        """Appends payloads to a segment file and returns the (offset, length) of each record."""
+        os.makedirs(self.directory, exist_ok=True)
+        locations = []
+        with open(self._segment_path(segment), "ab") as segment_file:
+            offset = segment_file.seek(0, os.SEEK_END)
+            for payload in payloads:
+                data = RECORD.pack(RECORD_MAGIC, len(payload), zlib.crc32(payload)) + payload
+                segment_file.write(data)
+                locations.append((offset, len(data)))
+                offset += len(data)
+            segment_file.flush()
+            # The index rows pointing at these records are committed only after they are on disk.
+            os.fsync(segment_file.fileno())
+        return locations
+
+    def read_record(self, segment, offset, length):
+        """Returns the archived conversation stored at offset in segment."""
+        with open(self._segment_path(segment), "rb") as segment_file:
+            segment_file.seek(offset)
+            data = segment_file.read(length)
+        if len(data) < RECORD.size:
+            raise ValueError(f"Truncated archive record at {segment}:{offset}")
+        magic, payload_length, checksum = RECORD.unpack_from(data)
+        payload = data[RECORD.size:RECORD.size + payload_length]
+        if magic != RECORD_MAGIC or len(payload) != payload_length or zlib.crc32(payload) != checksum:
+            raise ValueError(f"Corrupt archive record at {segment}:{offset}")
+        return json.loads(self.codec.decode(payload))
+
+    def _build_record(self, cursor, row_id):
+        cursor.execute('SELECT * FROM conversations WHERE id = ?;', (row_id,))
+        conversation = _rows_as_dicts(cursor)[0]
+        cursor.execute('SELECT content FROM conversation_segments WHERE conversation_ref = ? ORDER BY id;', (row_id,))
+        # Appended segments are folded into the archived transcript.
+        conversation["chat_log"] = self.codec.decode(conversation["chat_log"]) + "".join(
+            self.codec.decode(segment) for segment, in cursor.fetchall()
+        )
+        record = {"conversation": conversation}
+        for table in CONVERSATION_TABLES:
+            cursor.execute(f'SELECT * FROM {table} WHERE user = ? AND conversation_id = ? ORDER BY id;',
+                           (conversation["user"], conversation["conversation_id"]))
+            record[table] = _rows_as_dicts(cursor)
+        for response in record["responses"]:
+            response["response_data"] = self.codec.decode(response["response_data"])
+        return record
+
+    def archive(self, older_than_days=ARCHIVE_AFTER_DAYS, now=None):
+        """
+        Moves every conversation last modified more than older_than_days ago into the segment files.
+
+        A conversation that received messages after the cutoff is left alone even if its chat
+        log was saved before it, since it is still being continued.
+
+        Returns:
+        - The number of conversations archived.
+        """
+        migrate_database(self.db_path)
+        flush_write_behind_queue(self.db_path)
+        now = time.time() if now is None else now
+        cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now - older_than_days * 86400))
+        archived_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+
+        count = 0
+        while True:
+            with DatabaseContextManager(self.db_path) as cursor:
+                try:
+                    cursor.execute('''
+                        SELECT c.id FROM conversations c
+                        WHERE COALESCE(c.date_modified, c.timestamp) < ?
+                          AND NOT EXISTS (
+                              SELECT 1 FROM messages m
+                              WHERE m.user = c.user AND m.conversation_id = c.conversation_id AND m.timestamp >= ?
+                          )
+                        ORDER BY c.id LIMIT ?;
+                    ''', (cutoff, cutoff, ARCHIVE_BATCH_SIZE))
+                    records = [self._build_record(cursor, row_id) for row_id, in cursor.fetchall()]
+                    if not records:
+                        break
+
+                    by_segment = {}
+                    for record in records:
+                        conversation = record["conversation"]
+                        month = (conversation["date_modified"] or conversation["timestamp"])[:7]
+                        by_segment.setdefault(f"{month}.seg", []).append(record)
+
+                    with self._lock:
+                        for segment, segment_records in by_segment.items():
+                            locations = self._append(segment, [self._encode_record(record) for record in segment_records])
+                            for record, (offset, length) in zip(segment_records, locations):
+                                self._index(cursor, record["conversation"], segment, offset, length, archived_at)
+                except sqlite3.Error as e:
+                    logger.error(f"Error archiving conversations: {e}")
+                    raise
+
+            for record in records:
+                invalidate_history(self.db_path, record["conversation"]["user"], record["conversation"]["conversation_id"])
+            # Archived messages are no longer recalled; restore() indexes them again.
+            get_semantic_memory(self.db_path).remove([message["id"] for record in records for message in record["messages"]])
+            count += len(records)
+
+        if count:
+            logger.info(f"Archived {count} conversations last modified before {cutoff}")
+        return count
+
+    def _index(self, cursor, conversation, segment, offset, length, archived_at):
+        cursor.execute('''
+            INSERT INTO archived_conversations (id, user, conversation_id, name, persona, timestamp, date_modified,
+                                                message_count, chat_log_size, segment, offset, length, archived)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+        ''', (conversation["id"], conversation["user"], conversation["conversation_id"], conversation["name"],
+              conversation["persona"], conversation["timestamp"], conversation["date_modified"],
+              conversation["message_count"], conversation["chat_log_size"], segment, offset, length, archived_at))
+        cursor.execute('INSERT INTO archived_conversations_fts (rowid, name, chat_log) VALUES (?, ?, ?);',
+                       (conversation["id"], conversation["name"], conversation["chat_log"]))
+        user, conversation_id = conversation["user"], conversation["conversation_id"]
+        cursor.execute('DELETE FROM conversations WHERE id = ?;', (conversation["id"],))
+        cursor.execute('DELETE FROM messages WHERE user = ? AND conversation_id = ?;', (user, conversation_id))
+        cursor.execute('DELETE FROM function_calls WHERE user = ? AND conversation_id = ?;', (user, conversation_id))
+        cursor.execute('DELETE FROM responses WHERE user = ? AND conversation_id = ?;', (user, conversation_id))
+
+    def _unindex(self, cursor, user, conversation_id):
+        """Drops a conversation from the archive index and returns its record, or None if it is not archived."""
+        cursor.execute('''
+            SELECT id, name, segment, offset, length FROM archived_conversations
+            WHERE user = ? AND conversation_id = ?;
+        ''', (user, conversation_id))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        row_id, name, segment, offset, length = row
+        record = self.read_record(segment, offset, length)
+        # A contentless FTS5 entry is removed by repeating exactly the values it was indexed with.
+        cursor.execute('''
+            INSERT INTO archived_conversations_fts (archived_conversations_fts, rowid, name, chat_log)
+            VALUES ('delete', ?, ?, ?);
+        ''', (row_id, name, record["conversation"]["chat_log"]))
+        cursor.execute('DELETE FROM archived_conversations WHERE id = ?;', (row_id,))
+        return record
+
+    def restore(self, user, conversation_id):
+        """
+        Moves an archived conversation back into the hot database, under its original row ids.
+
+        Returns:
+        - True if the conversation was archived and has been restored, False otherwise.
+        """
+        with DatabaseContextManager(self.db_path) as cursor:
+            try:
+                record = self._unindex(cursor, user, conversation_id)
+                if record is None:
+                    return False
+                conversation = dict(record["conversation"])
+                conversation["chat_log"] = self.codec.encode(conversation["chat_log"])
+                for response in record["responses"]:
+                    response["response_data"] = self.codec.encode(response["response_data"])
+                for table, rows in (("conversations", [conversation]),) + tuple((table, record[table]) for table in CONVERSATION_TABLES):
+                    if not rows:
+                        continue
+                    # Only columns the current schema still has; columns added since default to NULL.
+                    columns = [column for column in _table_columns(cursor, table) if column in rows[0]]
+                    cursor.executemany(
+                        f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)});',
+                        [[row[column] for column in columns] for row in rows]
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Error restoring archived conversation: {e}")
+                raise
+        invalidate_history(self.db_path, user, conversation_id)
+        get_semantic_memory(self.db_path).add_missing([(message["id"], message["content"]) for message in record["messages"]])
+        logger.info("Archived conversation restored")
+        logger.debug(f": {conversation_id}")
+        return True
+
+    def remove(self, user, conversation_id):
+        """Deletes an archived conversation. Its record is dropped from the segment file by the next compact()."""
+        with DatabaseContextManager(self.db_path) as cursor:
+            try:
+                return self._unindex(cursor, user, conversation_id) is not None
+            except sqlite3.Error as e:
+                logger.error(f"Error deleting archived conversation: {e}")
+                raise
+
+    def read_chat_logs(self, locations):
+        """Returns the transcript of each (segment, offset, length) location, in the same order."""
+        return [self.read_record(segment, offset, length)["conversation"]["chat_log"] for segment, offset, length in locations]
+
+    def compact(self):
+        """
+        Rewrites segment files that contain records no longer referenced by the index.
+
+        Live records are copied to a new segment file and the index is pointed at it before the
+        old file is removed. Meant to run while the application is closed.
+
+        Returns:
+        - The number of bytes reclaimed.
+        """
+        reclaimed = 0
+        with DatabaseContextManager(self.db_path) as cursor:
+            cursor.execute('SELECT id, segment, offset, length FROM archived_conversations ORDER BY segment, offset;')
+            live = {}
+            for row_id, segment, offset, length in cursor.fetchall():
+                live.setdefault(segment, []).append((row_id, offset, length))
+
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.seg"))):
+            segment = os.path.basename(path)
+            records = live.get(segment, [])
+            size = os.path.getsize(path)
+            if sum(length for _, _, length in records) == size:
+                continue
+            if records:
+                compacted = f"{segment[:7]}.{time.strftime('%Y%m%d%H%M%S')}.seg"
+                with open(path, "rb") as source:
+                    payloads = []
+                    for _, offset, length in records:
+                        source.seek(offset)
+                        payloads.append(source.read(length)[RECORD.size:])
+                with self._lock:
+                    locations = self._append(compacted, payloads)
+                with DatabaseContextManager(self.db_path) as cursor:
+                    cursor.executemany('UPDATE archived_conversations SET segment = ?, offset = ?, length = ? WHERE id = ?;', [
+                        (compacted, offset, length, row_id) for (row_id, _, _), (offset, length) in zip(records, locations)
+                    ])
+                reclaimed += size - os.path.getsize(self._segment_path(compacted))
+            else:
+                reclaimed += size
+            os.remove(path)
+        logger.info(f"Compacted the archive of {self.db_path}, {reclaimed} bytes reclaimed")
+        return reclaimed
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def get_archive(db_path):
+    """Returns the archive shared by every component working on db_path."""
+    archive = _archives.get(db_path)
+    if archive is None:
+        with _archives_lock:
+            archive = _archives.get(db_path)
+            if archive is None:
+                archive = _archives[db_path] = ConversationArchive(db_path)
+    return archive
+
+
+def close_archive(db_path):
+    with _archives_lock:
+        _archives.pop(db_path, None)
+
+
+def _vacuum(db_path):
+    conn = get_pool(db_path).connection()
+    for fts in ("messages_fts", "conversations_fts", "conversation_segments_fts", "archived_conversations_fts"):
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize');")
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    conn.execute("VACUUM;")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+
+
+if __name__ == "__main__":
+    # python -m modules.chat_history.archive [glob] [--days N] [--compact] [--vacuum]
+    parser = argparse.ArgumentParser(description="Move cold conversations out of the persona chat history databases.")
+    parser.add_argument("pattern", nargs="?", default=PERSONA_DB_GLOB)
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--compact", action="store_true", help="rewrite segment files holding deleted or restored records")
+    parser.add_argument("--vacuum", action="store_true", help="return the freed pages of the hot database to the file system")
+    args = parser.parse_args()
+
+    for path in sorted(glob.glob(args.pattern)):
+        try:
+            archive = get_archive(path)
+            count = archive.archive(args.days)
+            reclaimed = archive.compact() if args.compact else 0
+            if args.vacuum:
+                _vacuum(path)
+            print(f"{path}: {count} conversations archived, {reclaimed} archive bytes reclaimed")
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"{path}: FAILED ({e})")
+        finally:
+            close_archive(path)
+            close_semantic_memory(path)
+            close_pool(path)
+            close_codec(path)
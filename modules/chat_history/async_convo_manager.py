@@ -0,0 +1,79 @@
+# modules/chat_history/async_convo_manager.py
+
+from modules.chat_history.convo_manager import ConversationManager
+from modules.chat_history.db_executor import get_database_executor, close_database_executor
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('async_convo_manager.py')
+
+
+class AsyncConversationManager:
+    """
+    Awaitable facade over ConversationManager for code running on the GUI event loop.
+
+    Every method that touches the database returns a coroutine and runs the ConversationManager
+    method of the same name on the database's DatabaseExecutor: inserts, deletes, context
+    building (which stores token counts) and opening a chat log (which may restore it from the
+    archive) on the writer thread, everything else on a reader thread.
+    Attributes and methods without database work, such as conversation_id or
+    init_conversation_id, are passed through to the wrapped manager unchanged.
+    """
+
+    def __init__(self, user, persona_name, provider_manager, write_behind=False, db_file=None):
+        self.manager = ConversationManager(user, persona_name, provider_manager, write_behind, db_file)
+        self.executor = get_database_executor(self.manager.db_file)
+
+    def __getattr__(self, name):
+        if name == "manager":
+            raise AttributeError(name)
+        return getattr(self.manager, name)
+
+    async def conversation_exists(self, user, conversation_id):
+        return await self.executor.read(self.manager.conversation_exists, user, conversation_id)
+
+    async def insert_conversation(self, user, conversation_id, chat_log, timestamp, persona):
+        if await self.executor.write(self.manager.save_conversation, user, conversation_id, chat_log, timestamp, persona):
+            await self.executor.write(self.manager.process_conversation, user, conversation_id, chat_log)
+        self.manager.job_scheduler.start()
+
+    async def get_conversations(self, user, persona=None, conversation_id=None):
+        return await self.executor.read(self.manager.get_conversations, user, persona, conversation_id)
+
+    async def list_conversations(self, user, persona=None, limit=50, after=None):
+        return await self.executor.read(self.manager.list_conversations, user, persona, limit, after)
+
+    async def search(self, user, query, persona=None, limit=20, offset=0):
+        return await self.executor.read(self.manager.search, user, query, persona, limit, offset)
+
+    async def recall(self, user, query, k=5, exclude_conversation_id=None):
+        return await self.executor.read(self.manager.recall, user, query, k, exclude_conversation_id)
+
+    async def delete_conversation(self, user, conversation_id):
+        return await self.executor.write(self.manager.delete_conversation, user, conversation_id)
+
+    async def get_chat_log(self, user, conversation_id):
+        # Opening an archived conversation restores it, which writes.
+        return await self.executor.write(self.manager.get_chat_log, user, conversation_id)
+
+    async def add_response(self, user, conversation_id, response_data, timestamp):
+        return await self.executor.write(self.manager.add_response, user, conversation_id, response_data, timestamp)
+
+    async def add_function_call(self, user, conversation_id, function_name, arguments, timestamp):
+        return await self.executor.write(self.manager.add_function_call, user, conversation_id, function_name, arguments, timestamp)
+
+    async def add_message(self, user, conversation_id, role, message, timestamp):
+        return await self.executor.write(self.manager.add_message, user, conversation_id, role, message, timestamp)
+
+    async def get_history(self, user, conversation_id):
+        return await self.executor.read(self.manager.get_history, user, conversation_id)
+
+    async def get_history_rows(self, user, conversation_id):
+        return await self.executor.read(self.manager.get_history_rows, user, conversation_id)
+
+    async def get_context(self, user, conversation_id, token_budget, reserved_tokens=0):
+        return await self.executor.write(self.manager.get_context, user, conversation_id, token_budget, reserved_tokens)
+
+    def close_connection(self):
+        """Finishes the queued database work, then closes the wrapped manager's connections."""
+        close_database_executor(self.manager.db_file)
+        self.manager.close_connection()
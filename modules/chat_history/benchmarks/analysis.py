@@ -0,0 +1,179 @@
+# modules/chat_history/benchmarks/analysis.py
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+from modules.chat_history.benchmarks.workload import SyntheticWorkload, timestamp
+from modules.chat_history.convo_manager import ConversationManager, PROCESS_CONVERSATION
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('analysis.py')
+
+RESULT_FORMAT = "scout-background-analysis-benchmark"
+RESULT_VERSION = 1
+
+PERSONA_NAME = "Benchmark"
+
+SECTION_HEADER = re.compile(r'^### Conversation (\d+)[^\n]*\n', re.MULTILINE)
+
+
+def expected_name(content):
+    """The name MockAnalysisProvider gives a conversation, derived from the text it was sent."""
+    return f"Conversation {zlib.crc32(content.encode('utf-8')):08x}"
+
+
+class MockAnalysisProvider:
+    """
+    Stands in for the provider manager's background model, locally and deterministically.
+
+    Each conversation is named after a checksum of its text, so a result attached to the wrong
+    conversation is detected. Batch results come back in shuffled order, and with
+    fail_batches every batch response is malformed, which exercises the fallback to single
+    requests. round_trips counts the requests made.
+    """
+
+    def __init__(self, fail_batches=False, latency=0.0, seed=0):
+        self.fail_batches = fail_batches
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.round_trips = 0
+        self.batch_requests = 0
+
+    async def generate_cognitive_background_service(self, payload):
+        self.round_trips += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = payload["messages"][-1]["content"]
+        headers = list(SECTION_HEADER.finditer(content))
+        if not headers:
+            text = f'"{expected_name(content)}"\n[{{"operation": "None"}}]\nSummary: {len(content)} characters.'
+            return {"choices": [{"message": {"content": text}}]}
+
+        self.batch_requests += 1
+        if self.fail_batches:
+            return {"choices": [{"message": {"content": "Sorry, I can only look at one conversation at a time."}}]}
+        entries = []
+        for index, header in enumerate(headers):
+            end = headers[index + 1].start() - 2 if index + 1 < len(headers) else len(content)
+            section = content[header.end():end]
+            entries.append({
+                "conversation": int(header.group(1)), "name": expected_name(section),
+                "profile_updates": [{"operation": "None"}], "summary": f"{len(section)} characters.",
+            })
+        self.random.shuffle(entries)
+        return {"choices": [{"message": {"content": json.dumps({"conversations": entries})}}]}
+
+
+def _conversations(workload, count, turns_per_conversation):
+    for _ in range(count):
+        user, conversation_id = workload.new_conversation()
+        lines = []
+        for _ in range(turns_per_conversation):
+            turn = workload.turn()
+            lines.append(f"User: {turn['user_message']}")
+            lines.append(f"{PERSONA_NAME}: {turn['assistant_message']}")
+        yield user, conversation_id, "\n".join(lines)
+
+
+async def _drain(scheduler, timeout):
+    scheduler.start()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        queue = scheduler.metrics()["queue"]
+        if not queue.get("pending") and not queue.get("running"):
+            return
+        await asyncio.sleep(0.05)
+    raise TimeoutError("background jobs did not finish in time")
+
+
+def run_analysis_benchmark(conversations=40, turns_per_conversation=4, users=2, max_batch=8, fail_batches=False,
+                           latency=0.0, seed=0, timeout=120):
+    """
+    Queues conversations saved conversations for analysis and runs them through the job scheduler
+    against MockAnalysisProvider, once one at a time and once batched.
+
+    Args:
+    - conversations: Number of conversations to analyze.
+    - turns_per_conversation: Turns in each conversation.
+    - users: Number of users the conversations belong to; batches never mix users.
+    - max_batch: Jobs the scheduler hands to one batch.
+    - fail_batches: Make every batch response malformed, so all conversations fall back to single requests.
+    - latency: Seconds the mock provider takes per request.
+    - seed: Random seed of the workload.
+    - timeout: Seconds to wait for each run to finish.
+
+    Returns:
+    - Dictionary with the config and, for the single and batched runs, the round trips, batch
+      requests, seconds, and the number of conversations whose stored name is wrong or missing.
+    """
+    config = {
+        "conversations": conversations, "turns_per_conversation": turns_per_conversation, "users": users,
+        "max_batch": max_batch, "fail_batches": fail_batches, "latency": latency, "seed": seed,
+    }
+    result = {"format": RESULT_FORMAT, "version": RESULT_VERSION, "config": config}
+
+    for label, batch_size in (("single", 1), ("batched", max_batch)):
+        directory = tempfile.mkdtemp(prefix="scout-analysis-")
+        db_path = os.path.join(directory, f"{PERSONA_NAME}.db")
+        workload = SyntheticWorkload(users, 0.0, seed)
+        provider = MockAnalysisProvider(fail_batches, latency, seed)
+        manager = ConversationManager(workload.users[0], PERSONA_NAME, provider, db_file=db_path)
+        try:
+            manager.job_scheduler.register_batch(PROCESS_CONVERSATION, manager.run_conversation_jobs, batch_size)
+            saved = list(_conversations(workload, conversations, turns_per_conversation))
+            for user, conversation_id, chat_log in saved:
+                manager.save_conversation(user, conversation_id, chat_log, timestamp(time.time()), PERSONA_NAME)
+                manager.process_conversation(user, conversation_id, chat_log)
+
+            start = time.perf_counter()
+            asyncio.run(_drain(manager.job_scheduler, timeout))
+            elapsed = time.perf_counter() - start
+
+            wrong = 0
+            for user, conversation_id, chat_log in saved:
+                rows = manager.get_conversations(user, conversation_id=conversation_id)
+                if not rows or rows[0][-1] != expected_name(chat_log):
+                    wrong += 1
+            result[label] = {
+                "round_trips": provider.round_trips, "batch_requests": provider.batch_requests,
+                "seconds": elapsed, "wrong_names": wrong, "jobs": manager.job_scheduler.metrics()["counts"],
+            }
+        finally:
+            manager.close_connection()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    single, batched = result["single"]["round_trips"], result["batched"]["round_trips"]
+    result["round_trip_reduction"] = 1 - batched / single if single else 0.0
+    return result
+
+
+if __name__ == "__main__":
+    # python -m modules.chat_history.benchmarks.analysis --conversations 100 --max-batch 8
+    parser = argparse.ArgumentParser(description="Compare single and batched background analysis against a mock provider.")
+    parser.add_argument("--conversations", type=int, default=40)
+    parser.add_argument("--turns-per-conversation", type=int, default=4)
+    parser.add_argument("--users", type=int, default=2)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--fail-batches", action="store_true", help="return malformed batch responses to test the fallback")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per mock request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file to write the results to (default: stdout)")
+    args = parser.parse_args()
+
+    result = run_analysis_benchmark(args.conversations, args.turns_per_conversation, args.users, args.max_batch,
+                                    args.fail_batches, args.latency, args.seed)
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
@@ -0,0 +1,289 @@
+# modules/chat_history/benchmarks/runner.py
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from modules.chat_history.DatabaseContextManager import DatabaseContextManager
+from modules.chat_history.benchmarks.workload import SyntheticWorkload, timestamp
+from modules.chat_history.connection_pool import StatementStats, get_pool
+from modules.chat_history.context_builder import count_tokens
+from modules.chat_history.convo_manager import ConversationManager
+from modules.chat_history.search import build_match_query, search_database
+from modules.chat_history.transcript import transcript_delta
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('runner.py')
+
+RESULT_FORMAT = "scout-chat-history-benchmark"
+RESULT_VERSION = 1
+
+PERSONA_NAME = "Benchmark"
+
+# Rows written per transaction while prefilling.
+PREFILL_BATCH_SIZE = 20000
+
+# Token budget of the get_context calls, roughly a 8k context model after the system prompt.
+CONTEXT_BUDGET = 6000
+
+# Timings kept per operation; large enough that percentiles cover the whole replay.
+LATENCY_WINDOW = 1_000_000
+
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _storage(db_path):
+    return {"db_bytes": _file_size(db_path), "wal_bytes": _file_size(db_path + "-wal")}
+
+
+def _transcript(turns):
+    lines = []
+    for turn in turns:
+        lines.append(f"User: {turn['user_message']}")
+        lines.append(f"{PERSONA_NAME}: {turn['assistant_message']}")
+    return "\n".join(lines) + "\n"
+
+
+def prefill(manager, workload, messages, turns_per_conversation):
+    """
+    Fills the database with about messages messages of synthetic history.
+
+    Rows are written directly with executemany, the way a long-used database would look, rather
+    than through ConversationManager, which would take hours at the larger scales. Every
+    conversation is saved with its transcript, so listing and search have data to work on.
+
+    Returns:
+    - The number of messages written.
+    """
+    db_path = manager.db_file
+    codec = manager.codec
+    base_time = time.time() - 365 * 86400
+    pending = {"conversations": [], "messages": [], "function_calls": [], "responses": []}
+    next_id = {table: 1 for table in pending}
+    written = 0
+
+    def flush():
+        with DatabaseContextManager(db_path) as cursor:
+            cursor.executemany('''
+                INSERT INTO messages (id, user, conversation_id, role, content, timestamp, function_call_id, token_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+            ''', pending["messages"])
+            cursor.executemany('''
+                INSERT INTO function_calls (id, user, conversation_id, message_id, function_name, arguments, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?);
+            ''', pending["function_calls"])
+            cursor.executemany('''
+                INSERT INTO responses (id, user, conversation_id, function_call_id, response_data, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?);
+            ''', pending["responses"])
+            cursor.executemany('''
+                INSERT INTO conversations (user, conversation_id, chat_log, timestamp, persona, date_modified, message_count, chat_log_size, chat_log_digest)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+            ''', pending["conversations"])
+        for rows in pending.values():
+            rows.clear()
+
+    while written < messages:
+        user, conversation_id = workload.new_conversation()
+        started = base_time + 365 * 86400 * written / messages
+        turns = [workload.turn() for _ in range(workload.random.randint(1, 2 * turns_per_conversation - 1))]
+        for index, turn in enumerate(turns):
+            when = timestamp(started + index * 60)
+            user_message_id = next_id["messages"]
+            pending["messages"].append((user_message_id, user, conversation_id, "user", turn["user_message"], when, None, count_tokens(turn["user_message"])))
+            next_id["messages"] += 1
+            function_call_id = None
+            if turn["tool_call"] is not None:
+                function_name, arguments, response = turn["tool_call"]
+                function_call_id = next_id["function_calls"]
+                pending["function_calls"].append((function_call_id, user, conversation_id, user_message_id, function_name, arguments, when))
+                pending["responses"].append((next_id["responses"], user, conversation_id, function_call_id, codec.encode(json.dumps(response)), when))
+                next_id["function_calls"] += 1
+                next_id["responses"] += 1
+            pending["messages"].append((next_id["messages"], user, conversation_id, "assistant", turn["assistant_message"], when, function_call_id, count_tokens(turn["assistant_message"])))
+            next_id["messages"] += 1
+            written += 2
+
+        chat_log = _transcript(turns)
+        _, _, size, digest = transcript_delta(0, None, chat_log)
+        ended = timestamp(started + len(turns) * 60)
+        pending["conversations"].append((user, conversation_id, codec.encode(chat_log), timestamp(started), PERSONA_NAME, ended, 2 * len(turns), size, digest))
+        if len(pending["messages"]) >= PREFILL_BATCH_SIZE:
+            flush()
+    flush()
+    return written
+
+
+class _Timer:
+    """Records the wall time of each benchmarked call under the operation's name."""
+
+    def __init__(self):
+        self.stats = StatementStats(window=LATENCY_WINDOW)
+        self.totals = {}
+
+    def __call__(self, name, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.stats.record(name, elapsed)
+        self.totals[name] = self.totals.get(name, 0.0) + elapsed
+        return result
+
+    def summary(self):
+        report = self.stats.summary()
+        for name, row in report.items():
+            row["ops_per_s"] = row["count"] / self.totals[name] if self.totals[name] else 0.0
+        return report
+
+
+def replay(manager, memory_manager, workload, turns, turns_per_conversation, timer):
+    """
+    Runs turns conversation turns through ConversationManager the way the providers do.
+
+    Each turn adds the user message, for tool turns adds the function call and its response,
+    adds the assistant reply and reads the history and the model context back. When a
+    conversation ends it is saved, the conversation list is loaded and the history searched.
+
+    Returns:
+    - The peak WAL size in bytes seen during the replay.
+    """
+    db_path = manager.db_file
+    wal_peak = 0
+    done = 0
+    while done < turns:
+        user, conversation_id = workload.new_conversation()
+        manager.update_conversation_id(conversation_id)
+        conversation_turns = []
+        for _ in range(min(turns - done, workload.random.randint(1, 2 * turns_per_conversation - 1))):
+            turn = workload.turn()
+            now = timestamp(time.time())
+            manager.function_call_id = None
+            manager.message_id = timer("add_message", manager.add_message, user, conversation_id, "user", turn["user_message"], now)
+            if turn["tool_call"] is not None:
+                function_name, arguments, response = turn["tool_call"]
+                manager.function_call_id = timer("add_function_call", manager.add_function_call, user, conversation_id, function_name, arguments, now)
+                timer("add_response", manager.add_response, user, conversation_id, response, now)
+            timer("add_message", manager.add_message, user, conversation_id, "assistant", turn["assistant_message"], now)
+            timer("get_history", manager.get_history, user, conversation_id)
+            timer("get_context", manager.get_context, user, conversation_id, CONTEXT_BUDGET)
+            if memory_manager is not None:
+                timer("memory_manager.get_history", memory_manager.get_history, user, conversation_id)
+                if manager.function_call_id is not None:
+                    timer("memory_manager.get_cached_tool_response", memory_manager.get_cached_tool_response, user, conversation_id, manager.function_call_id)
+            conversation_turns.append(turn)
+            done += 1
+            wal_peak = max(wal_peak, _file_size(db_path + "-wal"))
+
+        timer("save_conversation", manager.save_conversation, user, conversation_id, _transcript(conversation_turns), now, PERSONA_NAME)
+        timer("list_conversations", manager.list_conversations, user, PERSONA_NAME)
+        match = build_match_query(workload.search_query())
+        timer("search", search_database, db_path, user, match, PERSONA_NAME)
+    return wal_peak
+
+
+def run_benchmark(messages=10000, turns=500, users=5, turns_per_conversation=10, tool_ratio=0.2,
+                  write_behind=False, seed=0, directory=None, keep=False):
+    """
+    Builds a synthetic persona database of about messages messages and replays turns turns on it.
+
+    Args:
+    - messages: Number of messages of history to prefill, e.g. 10_000 to 10_000_000.
+    - turns: Number of conversation turns to replay and time.
+    - users: Number of synthetic users the history is spread over.
+    - turns_per_conversation: Average number of turns per conversation.
+    - tool_ratio: Fraction of turns that include a function call and response.
+    - write_behind: Replay with the write-behind queue enabled.
+    - seed: Random seed of the workload; the same seed gives the same data.
+    - directory: Where to create the database. A temporary directory by default.
+    - keep: Leave the database in place after the run.
+
+    Returns:
+    - Dictionary with the config, environment, prefill and semantic_catch_up timings, replay throughput,
+      operations (latency per ConversationManager / MemoryManager call), statements (latency per SQL
+      statement) and the database and WAL sizes before and after the replay.
+    """
+    config = {
+        "messages": messages, "turns": turns, "users": users, "turns_per_conversation": turns_per_conversation,
+        "tool_ratio": tool_ratio, "write_behind": write_behind, "seed": seed,
+    }
+    directory = directory or tempfile.mkdtemp(prefix="scout-benchmark-")
+    os.makedirs(directory, exist_ok=True)
+    db_path = os.path.join(directory, f"{PERSONA_NAME}.db")
+    workload = SyntheticWorkload(users, tool_ratio, seed)
+    result = {
+        "format": RESULT_FORMAT, "version": RESULT_VERSION, "config": config,
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "platform": platform.platform()},
+    }
+
+    manager = ConversationManager(workload.users[0], PERSONA_NAME, None, write_behind, db_file=db_path)
+    try:
+        memory_manager = None
+        try:
+            from modules.chat_history.memory_manager import MemoryManager
+            memory_manager = MemoryManager(db_path)
+        except ImportError as e:
+            logger.warning(f"MemoryManager is not benchmarked: {e}")
+
+        start = time.perf_counter()
+        written = prefill(manager, workload, messages, turns_per_conversation)
+        elapsed = time.perf_counter() - start
+        result["prefill"] = {"messages": written, "seconds": elapsed, "messages_per_s": written / elapsed if elapsed else 0.0}
+
+        start = time.perf_counter()
+        indexed = manager.semantic_memory.catch_up()
+        elapsed = time.perf_counter() - start
+        result["semantic_catch_up"] = {"messages": indexed, "seconds": elapsed}
+
+        get_pool(db_path).connection().execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        get_pool(db_path).stats.reset()
+        result["storage_before"] = _storage(db_path)
+
+        timer = _Timer()
+        start = time.perf_counter()
+        wal_peak = replay(manager, memory_manager, workload, turns, turns_per_conversation, timer)
+        if manager.write_queue is not None:
+            manager.write_queue.flush()
+        elapsed = time.perf_counter() - start
+        result["replay"] = {"turns": turns, "seconds": elapsed, "turns_per_s": turns / elapsed if elapsed else 0.0}
+        result["operations"] = timer.summary()
+        result["statements"] = manager.get_db_latency_stats()
+        result["storage_after"] = dict(_storage(db_path), wal_peak_bytes=wal_peak)
+    finally:
+        manager.close_connection()
+        if not keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    return result
+
+
+if __name__ == "__main__":
+    # python -m modules.chat_history.benchmarks.runner --messages 100000 --turns 1000 --output bench.json
+    parser = argparse.ArgumentParser(description="Benchmark the chat history layer on synthetic data.")
+    parser.add_argument("--messages", type=int, default=10000, help="messages of history to prefill")
+    parser.add_argument("--turns", type=int, default=500, help="conversation turns to replay and time")
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--turns-per-conversation", type=int, default=10)
+    parser.add_argument("--tool-ratio", type=float, default=0.2)
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--directory", help="where to build the database (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the database after the run")
+    parser.add_argument("--output", help="JSON file to write the results to (default: stdout)")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.messages, args.turns, args.users, args.turns_per_conversation, args.tool_ratio,
+                           args.write_behind, args.seed, args.directory, args.keep)
+    # Sorted keys and one value per line, so two result files diff cleanly.
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
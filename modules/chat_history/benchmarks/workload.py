@@ -0,0 +1,85 @@
+# modules/chat_history/benchmarks/workload.py
+
+import json
+import random
+import time
+
+# Syllables the synthetic vocabulary is built from. Words are made up, but they are real
+# tokens to the FTS5 tokenizer and the token counter, and follow a skewed frequency like text.
+SYLLABLES = ("ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "de", "pa", "gu", "re", "zo", "fi", "ba", "en", "or", "ul")
+VOCABULARY_SIZE = 4000
+
+TOOL_NAMES = ("get_weather", "search_web", "get_current_time", "calculate", "read_feed", "recall_memory")
+
+
+class SyntheticWorkload:
+    """
+    Deterministic generator of chat history shaped like real use.
+
+    The same seed always produces the same users, conversations, messages and tool calls, so two
+    benchmark runs differ only in the code under test. A conversation is a series of turns: a
+    user message, then, for tool_ratio of the turns, a function call with its response, then the
+    assistant's reply.
+
+    Args:
+    - users: Number of distinct users.
+    - tool_ratio: Fraction of turns in which the assistant calls a tool.
+    - seed: Random seed.
+    """
+
+    def __init__(self, users=5, tool_ratio=0.2, seed=0):
+        self.users = [f"bench_user_{index}" for index in range(users)]
+        self.tool_ratio = tool_ratio
+        self.random = random.Random(seed)
+        self.vocabulary = self._build_vocabulary()
+        self._conversations = 0
+
+    def _build_vocabulary(self):
+        words = set()
+        while len(words) < VOCABULARY_SIZE:
+            words.add("".join(self.random.choice(SYLLABLES) for _ in range(self.random.randint(2, 4))))
+        return sorted(words)
+
+    def words(self, count):
+        # Cubing the uniform draw gives a few very common words and a long tail of rare ones.
+        return " ".join(self.vocabulary[int(len(self.vocabulary) * self.random.random() ** 3)] for _ in range(count))
+
+    def message(self, role):
+        """Text of one message; assistant replies run longer than user messages."""
+        if role == "user":
+            return self.words(self.random.randint(4, 40))
+        return self.words(self.random.randint(20, 160))
+
+    def tool_call(self):
+        """A (function_name, arguments, response_data) triple for one tool call."""
+        name = self.random.choice(TOOL_NAMES)
+        arguments = json.dumps({"query": self.words(self.random.randint(1, 6))})
+        response = {"tool": name, "results": [self.words(self.random.randint(5, 30)) for _ in range(self.random.randint(1, 8))]}
+        return name, arguments, response
+
+    def new_conversation(self):
+        """Returns (user, conversation_id) for a new conversation of a random user."""
+        user = self.random.choice(self.users)
+        self._conversations += 1
+        return user, f"{user}_bench_{self._conversations}"
+
+    def turn(self):
+        """
+        One exchange of a conversation.
+
+        Returns:
+        - Dictionary with user_message, assistant_message and tool_call, which is None or a
+          (function_name, arguments, response_data) triple.
+        """
+        return {
+            "user_message": self.message("user"),
+            "tool_call": self.tool_call() if self.random.random() < self.tool_ratio else None,
+            "assistant_message": self.message("assistant"),
+        }
+
+    def search_query(self):
+        return self.words(self.random.randint(1, 2))
+
+
+def timestamp(seconds):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(seconds))
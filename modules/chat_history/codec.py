@@ -0,0 +1,208 @@
+# modules/chat_history/codec.py
+
+import sqlite3
+import struct
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('codec.py')
+
+# Encoded values start with MAGIC, the codec id and the id of the compression_dictionaries row
+# they were compressed with (0 for none).
+MAGIC = b"CZ"
+HEADER = struct.Struct(">2sBI")
+
+ZLIB = 1
+ZSTD = 2
+CODEC_IDS = {"zlib": ZLIB, "zstd": ZSTD}
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+# Values shorter than this many bytes are stored as plain TEXT; the header and codec framing
+# would eat most of the saving.
+MIN_COMPRESS_SIZE = 256
+
+# zlib only uses the last 32 KB of a preset dictionary.
+ZLIB_DICTIONARY_SIZE = 32768
+ZSTD_DICTIONARY_SIZE = 112640
+
+DEFAULT_CODEC = "zstd" if zstandard is not None else "zlib"
+
+# Name of the SQL function registered on every pooled connection; the FTS views and triggers
+# use it to index the decoded text.
+SQL_DECODE_FUNCTION = "transcript_decode"
+
+
+class TranscriptCodec:
+    """
+    Compresses the large text columns of one persona database: conversations.chat_log,
+    conversation_segments.content and responses.response_data.
+
+    encode() returns plain text for short values and otherwise a BLOB made of HEADER and the
+    compressed UTF-8 bytes, so a column can hold a mix of both and rows written before
+    compression existed stay readable. Values are compressed with the newest shared dictionary
+    in the compression_dictionaries table for the codec in use, which pays off for the many
+    short transcripts and tool responses of a persona that share the same phrasing.
+    """
+
+    def __init__(self, db_path, codec_name=DEFAULT_CODEC):
+        if codec_name not in CODEC_IDS:
+            raise ValueError(f"Unknown codec: {codec_name}")
+        if codec_name == "zstd" and zstandard is None:
+            raise ValueError("The zstd codec needs the zstandard package")
+        self.db_path = db_path
+        self.codec_name = codec_name
+        self._dictionaries = {}
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Re-reads the shared dictionaries, e.g. after recompress trained a new one."""
+        dictionaries = {}
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            try:
+                for dictionary_id, codec_name, data in conn.execute("SELECT id, codec, data FROM compression_dictionaries ORDER BY id;"):
+                    dictionaries[dictionary_id] = (codec_name, bytes(data))
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            # Not migrated yet, so there are no dictionaries.
+            pass
+        with self._lock:
+            self._dictionaries = dictionaries
+
+    def _dictionary(self, dictionary_id):
+        dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None:
+            self.reload()
+            dictionary = self._dictionaries.get(dictionary_id)
+            if dictionary is None:
+                raise ValueError(f"Compression dictionary {dictionary_id} not found in {self.db_path}")
+        return dictionary[1]
+
+    def _active_dictionary(self):
+        dictionaries = self._dictionaries
+        ids = [dictionary_id for dictionary_id, (codec_name, _) in dictionaries.items() if codec_name == self.codec_name]
+        return (ids[-1], dictionaries[ids[-1]][1]) if ids else (0, None)
+
+    def encode(self, text, use_dictionary=True):
+        """
+        Returns the value to store for text: text itself, or a compressed BLOB when that is smaller.
+
+        With use_dictionary=False the BLOB can be decoded without this database's dictionaries,
+        which is what values stored outside of it, like archive segments, need.
+        """
+        if text is None:
+            return None
+        data = text.encode("utf-8")
+        if len(data) < MIN_COMPRESS_SIZE:
+            return text
+        dictionary_id, dictionary = self._active_dictionary() if use_dictionary else (0, None)
+        if self.codec_name == "zstd":
+            dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            payload = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data).compress(data)
+        else:
+            compressor = zlib.compressobj(ZLIB_LEVEL, zdict=dictionary) if dictionary else zlib.compressobj(ZLIB_LEVEL)
+            payload = compressor.compress(data) + compressor.flush()
+        if HEADER.size + len(payload) >= len(data):
+            return text
+        return HEADER.pack(MAGIC, CODEC_IDS[self.codec_name], dictionary_id) + payload
+
+    def decode(self, value):
+        """Returns the text of a stored value, whether it was compressed or not."""
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        if len(value) < HEADER.size or value[:len(MAGIC)] != MAGIC:
+            return value.decode("utf-8")
+        _, codec_id, dictionary_id = HEADER.unpack_from(value)
+        payload = value[HEADER.size:]
+        dictionary = self._dictionary(dictionary_id) if dictionary_id else None
+        if codec_id == ZSTD:
+            if zstandard is None:
+                raise ValueError("Value was compressed with zstd but the zstandard package is not installed")
+            dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            data = zstandard.ZstdDecompressor(dict_data=dict_data).decompress(payload)
+        elif codec_id == ZLIB:
+            decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+            data = decompressor.decompress(payload) + decompressor.flush()
+        else:
+            raise ValueError(f"Unknown codec id {codec_id}")
+        return data.decode("utf-8")
+
+    def train_dictionary(self, samples):
+        """
+        Builds a shared dictionary for the codec in use from sample texts.
+
+        Returns the dictionary bytes, or None when there are too few samples to train one.
+        """
+        samples = [sample.encode("utf-8") for sample in samples if sample]
+        if not samples:
+            return None
+        if self.codec_name == "zstd":
+            try:
+                return zstandard.train_dictionary(ZSTD_DICTIONARY_SIZE, samples, level=ZSTD_LEVEL).as_bytes()
+            except zstandard.ZstdError as e:
+                logger.info(f"Not enough samples to train a zstd dictionary: {e}")
+                return None
+        # zlib has no trainer: a preset dictionary is simply text likely to reappear. The openings
+        # of transcripts and tool responses (speaker labels, JSON keys) are the most repetitive
+        # part, and zlib favours the end of the dictionary, so the most common openings go last.
+        openings = {}
+        for sample in samples:
+            opening = sample[:512]
+            openings[opening] = openings.get(opening, 0) + 1
+        dictionary = b"".join(sorted(openings, key=openings.get))
+        return dictionary[-ZLIB_DICTIONARY_SIZE:]
+
+
+_codecs = {}
+_codecs_lock = threading.Lock()
+
+
+def get_codec(db_path):
+    """Returns the codec shared by every component working on db_path."""
+    codec = _codecs.get(db_path)
+    if codec is None:
+        with _codecs_lock:
+            codec = _codecs.get(db_path)
+            if codec is None:
+                codec = _codecs[db_path] = TranscriptCodec(db_path)
+    return codec
+
+
+def close_codec(db_path):
+    with _codecs_lock:
+        _codecs.pop(db_path, None)
+
+
+def register_sql_functions(conn, db_path):
+    """
+    Makes transcript_decode() available to the views and triggers of conn's database.
+
+    The full-text index triggers on conversations and conversation_segments call it, so a
+    connection without it, such as the sqlite3 shell or a plain sqlite3.connect(), fails with
+    "no such function: transcript_decode" on every insert, update or delete of those rows.
+    Such tools should use connection_pool.open_connection() instead.
+    """
+    conn.create_function(SQL_DECODE_FUNCTION, 1, lambda value: get_codec(db_path).decode(value), deterministic=True)
+
+
+def require_sql_functions(conn):
+    """Raises sqlite3.OperationalError, saying how to open the database, if conn lacks transcript_decode()."""
+    try:
+        conn.execute(f"SELECT {SQL_DECODE_FUNCTION}(NULL);")
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(
+            f"{e}: the full-text triggers of chat history databases decode transcripts with "
+            f"{SQL_DECODE_FUNCTION}(), so open them with connection_pool.open_connection() or get_pool()"
+        ) from e
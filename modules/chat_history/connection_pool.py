@@ -0,0 +1,265 @@
+# modules/chat_history/connection_pool.py
+
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+
+from modules.chat_history.codec import register_sql_functions
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('connection_pool.py')
+
+# PRAGMAs applied once when a pooled connection is opened. journal_mode is persistent in the
+# database file, the others are per-connection and would otherwise reset on every connect.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,       # negative value = KiB, so roughly 16 MB of page cache
+    "mmap_size": 268435456,     # 256 MB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+    "foreign_keys": "ON",
+}
+
+# Number of prepared statements kept by each connection. sqlite3 reuses a compiled statement
+# whenever the exact same SQL text is executed again on the same connection.
+STATEMENT_CACHE_SIZE = 256
+
+# Number of timings kept per statement when computing percentiles.
+STATS_WINDOW = 2048
+
+
+class StatementStats:
+    """
+    Collects execution timings per SQL statement so per-turn DB latency can be reported.
+
+    Timings are kept in a bounded window per statement, so memory stays constant no matter how
+    long the application runs.
+    """
+
+    def __init__(self, window=STATS_WINDOW):
+        self.window = window
+        self._timings = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(sql):
+        """Collapse whitespace so the same statement written on several lines is counted once."""
+        return " ".join(sql.split())
+
+    def record(self, sql, elapsed):
+        key = self.normalize(sql)
+        with self._lock:
+            timings = self._timings.get(key)
+            if timings is None:
+                timings = self._timings[key] = deque(maxlen=self.window)
+                self._counts[key] = 0
+            timings.append(elapsed)
+            self._counts[key] += 1
+
+    @staticmethod
+    def _percentile(sorted_values, percentile):
+        if not sorted_values:
+            return 0.0
+        index = min(len(sorted_values) - 1, int(round(percentile / 100.0 * (len(sorted_values) - 1))))
+        return sorted_values[index]
+
+    def summary(self):
+        """
+        Returns a dictionary keyed by normalized SQL with the call count and the p50/p99/max
+        execution time in milliseconds over the most recent window of calls.
+        """
+        with self._lock:
+            snapshot = {key: (list(timings), self._counts[key]) for key, timings in self._timings.items()}
+
+        report = {}
+        for key, (timings, count) in snapshot.items():
+            timings.sort()
+            report[key] = {
+                "count": count,
+                "p50_ms": self._percentile(timings, 50) * 1000,
+                "p99_ms": self._percentile(timings, 99) * 1000,
+                "max_ms": timings[-1] * 1000 if timings else 0.0,
+            }
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._counts.clear()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records how long each execute/executemany call takes."""
+
+    stats = None
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            if self.stats is not None:
+                self.stats.record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            if self.stats is not None:
+                self.stats.record(sql, time.perf_counter() - start)
+
+
+def open_connection(db_path, pragmas=None, statement_cache_size=STATEMENT_CACHE_SIZE):
+    """
+    Opens a connection to a chat history database configured like the pooled ones.
+
+    Besides the PRAGMAs, this registers the SQL functions the schema's triggers call (see
+    codec.register_sql_functions), so scripts, backup and maintenance tools that write to the
+    database outside the application must open it here rather than with sqlite3.connect().
+    """
+    # check_same_thread is disabled only so a pool can close its connections from the shutdown
+    # thread; each pooled connection is still handed out to a single thread.
+    conn = sqlite3.connect(db_path, cached_statements=statement_cache_size, check_same_thread=False)
+    for name, value in (pragmas or DEFAULT_PRAGMAS).items():
+        conn.execute(f"PRAGMA {name}={value}")
+    register_sql_functions(conn, db_path)
+    return conn
+
+
+class ThreadConnection:
+    """
+    A pooled connection and the state of its owning thread.
+
+    depth counts the DatabaseContextManager blocks open on the connection, so nested blocks use
+    savepoints instead of finishing the outer block's transaction.
+    """
+
+    __slots__ = ('conn', 'generation', 'depth', '__weakref__')
+
+    def __init__(self, conn, generation):
+        self.conn = conn
+        self.generation = generation
+        self.depth = 0
+
+
+class ConnectionPool:
+    """
+    Keeps one long-lived SQLite connection per thread for a single database file.
+
+    Connections are opened lazily the first time a thread asks for one, configured once with the
+    pool PRAGMAs and then reused for every later call from that same thread. This removes the
+    connect / PRAGMA / close cycle that used to run on every DatabaseContextManager call.
+
+    Each thread's connection is held in a threading.local and closed when the thread exits, so
+    short-lived threads leave no connections behind and a new thread never inherits the
+    connection of an earlier one with the same ident.
+    """
+
+    def __init__(self, db_path, pragmas=None, statement_cache_size=STATEMENT_CACHE_SIZE):
+        self.db_path = db_path
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self.statement_cache_size = statement_cache_size
+        self.stats = StatementStats()
+        self._local = threading.local()
+        self._connections = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = open_connection(self.db_path, self.pragmas, self.statement_cache_size)
+        logger.info("Pooled database connection opened")
+        logger.debug(f"for {self.db_path} on thread {threading.get_ident()}")
+        return conn
+
+    def _release(self, conn):
+        # Runs when the owning thread exits, or when close() made its connection stale.
+        with self._lock:
+            self._connections.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Error closing pooled connection: {e}")
+
+    def thread_connection(self):
+        """Returns the ThreadConnection of the calling thread, opening its connection on first use."""
+        state = getattr(self._local, 'state', None)
+        if state is None or state.generation != self._generation:
+            conn = self._open()
+            with self._lock:
+                self._connections.add(conn)
+                state = ThreadConnection(conn, self._generation)
+            weakref.finalize(state, self._release, conn)
+            self._local.state = state
+        return state
+
+    def connection(self):
+        """Returns the connection owned by the calling thread, opening it on first use."""
+        return self.thread_connection().conn
+
+    def cursor(self):
+        """Returns a timed cursor on the calling thread's connection."""
+        cursor = self.connection().cursor(TimedCursor)
+        cursor.stats = self.stats
+        return cursor
+
+    def report(self):
+        """Logs the p50/p99 latency of every statement executed through this pool."""
+        for sql, row in sorted(self.stats.summary().items(), key=lambda item: -item[1]["p99_ms"]):
+            logger.info(f"[{row['count']} calls] p50={row['p50_ms']:.3f}ms p99={row['p99_ms']:.3f}ms max={row['max_ms']:.3f}ms :: {sql[:120]}")
+
+    def close(self):
+        """Closes every connection in the pool. Threads reconnect lazily if they are used again."""
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+            self._generation += 1
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error closing pooled connection: {e}")
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path, pragmas=None):
+    """
+    Returns the shared pool for db_path, creating it on first use.
+
+    ConversationManager, MemoryManager and CognitiveBackgroundServices all go through this, so
+    every component working on the same persona database shares the same connections.
+    """
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = _pools[db_path] = ConnectionPool(db_path, pragmas)
+    return pool
+
+
+def close_pool(db_path):
+    """Closes and forgets the pool for db_path, if there is one."""
+    with _pools_lock:
+        pool = _pools.pop(db_path, None)
+    if pool is not None:
+        pool.report()
+        pool.close()
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.report()
+        pool.close()
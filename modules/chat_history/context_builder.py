@@ -0,0 +1,141 @@
+# modules/chat_history/context_builder.py
+
+import json
+import sqlite3
+
+from modules.Analytics.token_counter.tokenizer_service import MESSAGE_OVERHEAD_TOKENS, get_tokenizer_service
+from modules.chat_history.DatabaseContextManager import DatabaseContextManager
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('context_builder.py')
+
+# Messages with these roles are always sent, however old they are.
+PINNED_ROLES = ("system",)
+
+# Tool results. Those of the latest exchange, after the last user message, are always sent; older
+# ones compete for the budget like other messages and are dropped, not ending the context, when
+# they fit in neither form.
+TOOL_ROLES = ("tool", "function")
+
+
+def count_tokens(text, model=None):
+    """
+    Number of tokens text occupies in a request to model; see tokenizer_service.TokenizerService.
+
+    Without a model this is the model-independent estimate the chat history stores in
+    messages.token_count.
+    """
+    return get_tokenizer_service().count_text(text, model)
+
+
+def _message_tokens(count):
+    return count + MESSAGE_OVERHEAD_TOKENS
+
+
+def count_system_tokens(current_persona, functions=None, model=None):
+    """Counts the tokens the persona prompt and function definitions take in every request to model."""
+    content = current_persona.get("content") or ""
+    tokens = _message_tokens(count_tokens(content if isinstance(content, str) else json.dumps(content), model))
+    if functions:
+        tokens += count_tokens(json.dumps(functions), model)
+    return tokens
+
+
+def build_context(conversation_manager, user, conversation_id, token_budget, reserved_tokens=0):
+    """
+    Picks the messages of a conversation that are sent to the model for the next turn.
+
+    System messages and the tool results of the latest exchange are always included. The
+    remaining budget is filled with the most recent messages, newest first; once the next older
+    message no longer fits, older messages are sent as their compressed_content summary where
+    MemoryManager stored one, and the first message that fits in neither form ends the context.
+    Older tool results that fit in neither form are left out instead, as a long tool output would
+    otherwise hide every message before it.
+
+    Token counts are computed once per message and stored in messages.token_count /
+    compressed_token_count, so a turn only counts the messages added since the last one.
+
+    Args:
+    - conversation_manager: The ConversationManager of the conversation.
+    - user: User ID
+    - conversation_id: Conversation ID
+    - token_budget: Tokens available for the request, see ModelManager.get_context_budget.
+    - reserved_tokens: Tokens of the budget already taken, e.g. by the persona system prompt.
+
+    Returns:
+    - List of message dictionaries with role, content, and timestamp, oldest first, like get_history.
+    """
+    rows = conversation_manager.get_history_rows(user, conversation_id)
+    rows = _with_token_counts(conversation_manager, user, conversation_id, rows)
+
+    last_user = max((index for index, row in enumerate(rows) if row[1] == "user"), default=-1)
+    pinned = {
+        row[0] for index, row in enumerate(rows)
+        if row[1] in PINNED_ROLES or (row[1] in TOOL_ROLES and index > last_user)
+    }
+
+    remaining = token_budget - reserved_tokens
+    selected = {}
+    for row in rows:
+        if row[0] in pinned:
+            selected[row[0]] = row[2]
+            remaining -= _message_tokens(row[4])
+    if remaining < 0:
+        logger.warning(f"Pinned messages exceed the context budget by {-remaining} tokens")
+
+    summarizing = False
+    summarized = 0
+    dropped = 0
+    for message_id, role, content, _, token_count, compressed_content, compressed_token_count in reversed(rows):
+        if message_id in pinned:
+            continue
+        if not summarizing and _message_tokens(token_count) <= remaining:
+            selected[message_id] = content
+            remaining -= _message_tokens(token_count)
+            continue
+        if role not in TOOL_ROLES:
+            summarizing = True
+        if compressed_content is not None and _message_tokens(compressed_token_count) <= remaining:
+            selected[message_id] = compressed_content
+            remaining -= _message_tokens(compressed_token_count)
+            summarized += 1
+            continue
+        if role in TOOL_ROLES:
+            dropped += 1
+            continue
+        break
+
+    context = [
+        {"role": row[1], "content": selected[row[0]], "timestamp": row[3]}
+        for row in rows if row[0] in selected
+    ]
+    logger.info(f"Context built with {len(context)} of {len(rows)} messages ({summarized} summarized, {dropped} tool results dropped), {remaining} tokens left")
+    return context
+
+
+def _with_token_counts(conversation_manager, user, conversation_id, rows):
+    """Fills in missing token counts, stores them, and returns rows with every count set."""
+    counted = {}
+    for row in rows:
+        message_id, _, content, _, token_count, compressed_content, compressed_token_count = row
+        if token_count is None or (compressed_content is not None and compressed_token_count is None):
+            counted[message_id] = row[:4] + (
+                count_tokens(content) if token_count is None else token_count,
+                compressed_content,
+                count_tokens(compressed_content) if compressed_content is not None else None,
+            )
+    if not counted:
+        return rows
+
+    with DatabaseContextManager(conversation_manager.db_file) as cursor:
+        try:
+            cursor.executemany('''
+                UPDATE messages SET token_count = ?, compressed_token_count = ?
+                WHERE id = ?;
+            ''', [(row[4], row[6], message_id) for message_id, row in counted.items()])
+        except sqlite3.Error as e:
+            logger.error(f"Error storing token counts: {e}")
+            raise
+    conversation_manager.history_cache.update_rows(user, conversation_id, counted)
+    logger.debug(f"Counted tokens for {len(counted)} messages")
+    return [counted.get(row[0], row) for row in rows]
@@ -1,20 +1,43 @@
 #gui/chat_history/convo_manager.py
 
+import asyncio
 import json
+import logging
 import sqlite3
 import uuid
 import time
-import asyncio
 
 from modules.chat_history.db_schema import DatabaseSchema
+from modules.chat_history.migrations import migrate_database
 from .DatabaseContextManager import DatabaseContextManager
+from .connection_pool import get_pool, close_pool
+from .write_behind import get_write_behind_queue, close_write_behind_queue
+from .history_cache import get_history_cache, close_history_cache
+from . import search as history_search
+from . import transfer
+from .transcript import transcript_delta, UNCHANGED, APPEND
+from .context_builder import build_context, count_tokens
+from .semantic_memory import get_semantic_memory, close_semantic_memory
+from .codec import get_codec, close_codec
+from .archive import get_archive, close_archive
 from modules.Background_Services.CognitiveBackgroundServices import CognitiveBackgroundServices
+from modules.Background_Services.job_scheduler import get_job_scheduler, close_job_scheduler
 from modules.logging.logger import setup_logger
+from modules.logging.structured import log_payload
 
 logger = setup_logger('convo_manager.py')
 
+# Background job kind for handing a saved conversation to the cognitive background services.
+PROCESS_CONVERSATION = "process_conversation"
+# Background job kind for indexing stored messages the semantic memory has not seen; see SemanticMemory.catch_up.
+SEMANTIC_CATCH_UP = "semantic_catch_up"
+# Saved conversations analyzed together in one request; see CognitiveBackgroundServices.process_conversations.
+ANALYSIS_BATCH_SIZE = 8
+# Messages and function calls are stored on every turn; one in this many is logged.
+WRITE_LOG_SAMPLE = 20
+
 class ConversationManager:   
-    def __init__(self, user, persona_name, provider_manager):
+    def __init__(self, user, persona_name, provider_manager, write_behind=False, db_file=None):
         if not isinstance(persona_name, str):
             raise ValueError("persona_name must be a string")
         self.persona_name = persona_name
@@ -22,14 +45,33 @@ class ConversationManager:
         self.conversation_id = None
         self.message_id = None
         self.function_call_id = None
-        self.loaded_conversations = set()
-        self.db_file = f"modules/Personas/{persona_name}/Memory/{persona_name}.db"
+        # db_file overrides the persona's own database, e.g. for a benchmark run on scratch data.
+        self.db_file = db_file or f"modules/Personas/{persona_name}/Memory/{persona_name}.db"
         self.cognitive_services = CognitiveBackgroundServices(self.db_file, user, provider_manager)        
         self.schema = DatabaseSchema()
-        self.background_tasks = []
+        self.pool = None
         self.conn = None  
         self.establish_connection() 
         self.create_all_tables()
+        # Opt-in group commit: inserts are queued and written in batches by a background thread.
+        # A queue opened by another manager on the same database is always picked up.
+        self.write_queue = get_write_behind_queue(self.db_file, create=write_behind)
+        self.history_cache = get_history_cache(self.db_file)
+        self.semantic_memory = get_semantic_memory(self.db_file)
+        # Transcripts and tool responses are stored compressed; see codec.TranscriptCodec.
+        self.codec = get_codec(self.db_file)
+        # Cold conversations live in segment files and are moved back when opened; see archive.ConversationArchive.
+        self.archive = get_archive(self.db_file)
+        # Saved conversations are processed by the cognitive background services through a
+        # persistent, bounded job queue; see job_scheduler.JobScheduler.
+        self.job_scheduler = get_job_scheduler(self.db_file)
+        # The scheduler is shared by every manager on the database; the first one registers the
+        # handlers, which look up the services of each job's user themselves, and queues the
+        # semantic index catch-up so it runs in the background instead of during a turn.
+        if PROCESS_CONVERSATION not in self.job_scheduler.handlers:
+            self.job_scheduler.register_batch(PROCESS_CONVERSATION, self.run_conversation_jobs, ANALYSIS_BATCH_SIZE)
+            self.job_scheduler.register(SEMANTIC_CATCH_UP, self.run_semantic_catch_up)
+            self.job_scheduler.enqueue(SEMANTIC_CATCH_UP, "", "", {})
 
     def init_conversation_id(self):
         """Initialize the conversation ID for the session."""
@@ -40,20 +82,16 @@ class ConversationManager:
 
     def create_all_tables(self):
         """
-        Create all necessary tables if they don't exist.
+        Create all necessary tables if they don't exist and upgrade older databases in place
+        to the current schema version (stored in PRAGMA user_version).
         """
-        with DatabaseContextManager(self.db_file) as cursor:
-            logger.info("Creating all necessary tables if not exists")
-            try:
-                cursor.execute(self.schema.CREATE_USERS_TABLE_SQL)
-                cursor.execute(self.schema.CREATE_CONVERSATIONS_TABLE_SQL)
-                cursor.execute(self.schema.CREATE_MESSAGES_TABLE_SQL)
-                cursor.execute(self.schema.CREATE_FUNCTION_CALLS_TABLE_SQL)
-                cursor.execute(self.schema.CREATE_RESPONSES_TABLE_SQL)
-                logger.info("All tables created or verified")
-            except sqlite3.Error as e:
-                logger.error(f"Error creating tables: {e}")
-                raise     
+        logger.info("Creating all necessary tables if not exists")
+        try:
+            migrate_database(self.db_file)
+            logger.info("All tables created or verified")
+        except sqlite3.Error as e:
+            logger.error(f"Error creating tables: {e}")
+            raise     
 
     def generate_new_conversation_id(self):
         """Generate a new conversation ID for the current session."""
@@ -69,9 +107,10 @@ class ConversationManager:
 
 
     def establish_connection(self):
-        """Establish a connection to the Chat History SQLite database."""
+        """Attach to the shared connection pool of the Chat History SQLite database."""
         try:
-            self.conn = sqlite3.connect(self.db_file)
+            self.pool = get_pool(self.db_file)
+            self.conn = self.pool.connection()
             logger.info("Connection to Chat History database established")
             logger.debug(f": {self.db_file}")
 
@@ -80,19 +119,61 @@ class ConversationManager:
             raise
 
     def close_connection(self):
-        """Close the connection to the SQLite database."""
+        """Close the pooled connections to the SQLite database and report per-statement latency."""
         logger.info("Closing Chat History database connection.")
         try:
-            self.conn.close()
-            for task in self.background_tasks:
-                task.cancel()
+            close_job_scheduler(self.db_file)
+            close_write_behind_queue(self.db_file)
+            self.write_queue = None
+            close_history_cache(self.db_file)
+            close_semantic_memory(self.db_file)
+            close_archive(self.db_file)
+            close_pool(self.db_file)
+            close_codec(self.db_file)
+            self.conn = None
         except sqlite3.Error as e:
             logger.info(f"Error closing connection: {e}")
             raise 
 
+    def export_history(self, path, user=None, resume=True):
+        """
+        Writes this persona's chat history to a JSONL file, one line per row; see transfer.export_history.
+
+        Args:
+        - path: File to write.
+        - user: Optional. Only export this user's conversations.
+        - resume: Continue an interrupted export of the same file instead of starting over.
+
+        Returns:
+        - The number of rows written.
+        """
+        return transfer.export_history(self.db_file, path, user, resume)
+
+    def import_history(self, path, resume=True):
+        """
+        Merges a JSONL file written by export_history into this persona's database; see transfer.import_history.
+
+        Args:
+        - path: File to read.
+        - resume: Continue an interrupted import of the same file instead of starting over.
+
+        Returns:
+        - The number of rows imported.
+        """
+        return transfer.import_history(self.db_file, path, resume)
+
+    def get_db_latency_stats(self):
+        """
+        Returns the p50/p99 execution time of every statement run against this persona database.
+
+        Returns:
+        - Dictionary keyed by SQL statement with count, p50_ms, p99_ms and max_ms.
+        """
+        return get_pool(self.db_file).stats.summary()
+
     def conversation_exists(self, user, conversation_id):
         """
-        Check if a conversation with the given conversation_id already exists for the user.
+        Check if a conversation with the given conversation_id already exists for the user, archived or not.
 
         Args:
         - user: User ID
@@ -104,8 +185,10 @@ class ConversationManager:
         with DatabaseContextManager(self.db_file) as cursor:
             try:
                 cursor.execute('''
-                    SELECT 1 FROM conversations WHERE user = ? AND conversation_id = ?;
-                ''', (user, conversation_id))
+                    SELECT 1 FROM conversations WHERE user = ? AND conversation_id = ?
+                    UNION ALL
+                    SELECT 1 FROM archived_conversations WHERE user = ? AND conversation_id = ?;
+                ''', (user, conversation_id, user, conversation_id))
                 return cursor.fetchone() is not None
             except sqlite3.Error as e:
                 logger.error(f"Error checking if conversation exists: {e}")
@@ -113,7 +196,46 @@ class ConversationManager:
     
     async def insert_conversation(self, user, conversation_id, chat_log, timestamp, persona):
         """
-        Inserts a conversation into the 'conversations' table and manages background tasks.
+        Saves a conversation's chat log and manages background tasks.
+
+        See save_conversation. When anything was saved, the conversation is queued for the
+        cognitive background services, which name it and update the user profile.
+        """
+        if self.save_conversation(user, conversation_id, chat_log, timestamp, persona):
+            self.process_conversation(user, conversation_id, chat_log)
+        self.job_scheduler.start()
+
+    def process_conversation(self, user, conversation_id, chat_log):
+        """
+        Queues a saved conversation for the cognitive background services.
+
+        While an earlier save of the same conversation is still waiting, only its chat log is
+        replaced, so the services run once on the latest version. The job survives restarts.
+        """
+        self.job_scheduler.enqueue(PROCESS_CONVERSATION, user, conversation_id, {"chat_log": chat_log})
+
+    async def run_conversation_jobs(self, jobs):
+        """Job handler for PROCESS_CONVERSATION: analyzes a batch of saved conversations, grouped by user."""
+        conversations = {}
+        for user, conversation_id, payload in jobs:
+            conversations.setdefault(user, []).append((conversation_id, payload["chat_log"]))
+        for user, items in conversations.items():
+            services = self.cognitive_services
+            if services.user != user:
+                services = CognitiveBackgroundServices(self.db_file, user, services.provider_manager)
+            await services.process_conversations(user, items)
+
+    async def run_semantic_catch_up(self, user, conversation_id, payload):
+        """Job handler for SEMANTIC_CATCH_UP: indexes the messages the semantic memory is missing, off the event loop."""
+        await asyncio.get_running_loop().run_in_executor(None, self.semantic_memory.catch_up)
+
+    def save_conversation(self, user, conversation_id, chat_log, timestamp, persona):
+        """
+        Writes a conversation's chat log to the database.
+
+        The first save inserts the conversation into the 'conversations' table. Saving the same conversation again
+        appends only the text added since the last save to 'conversation_segments' and updates date_modified in place;
+        the messages of the conversation are never touched. An archived conversation is restored first.
 
         Args:
         - user: User ID
@@ -121,34 +243,57 @@ class ConversationManager:
         - chat_log: The content of the chat_log
         - timestamp: Timestamp of the conversation
         - persona: Persona involved in the conversation
-        """
-        logger.info(f"insert_conversation called with user: {user}, conversation_id: {conversation_id}, persona: {persona}")
-        if conversation_id in self.loaded_conversations:
-            logger.info("Continuing conversation_id and Deleting old conversation.")
-            logger.debug(f"{conversation_id} for user {user}.")
-            self.delete_conversation(user, conversation_id)
-            self.loaded_conversations.remove(conversation_id)
-        elif self.conversation_exists(user, conversation_id):
-            logger.info(f"Conversation with ID {conversation_id} already exists for user {user}. Skipping insertion.")
-            return
 
-        logger.info("Inserting Conversation")
-        logger.debug(f"for user: {user}, conversation_id: {conversation_id}")
+        Returns:
+        - False if the chat log is unchanged since the last save, True otherwise
+        """
+        logger.info(f"save_conversation called with user: {user}, conversation_id: {conversation_id}, persona: {persona}")
 
+        if self.write_queue is not None:
+            self.write_queue.flush()
+        self.archive.restore(user, conversation_id)
         with DatabaseContextManager(self.db_file) as cursor:    
             try:
                 current_time = time.strftime("%Y-%m-%d %H:%M:%S")
                 cursor.execute('''
-                    INSERT INTO conversations (user, conversation_id, chat_log, timestamp, persona, date_modified)
-                    VALUES (?, ?, ?, ?, ?, ?);
-                ''', (user, conversation_id, chat_log, timestamp, persona, current_time))
-                logger.info("Message inserted successfully")
+                    SELECT id, chat_log_size, chat_log_digest FROM conversations
+                    WHERE user = ? AND conversation_id = ?;
+                ''', (user, conversation_id))
+                row = cursor.fetchone()
+
+                if row is None:
+                    _, _, size, digest = transcript_delta(0, None, chat_log)
+                    cursor.execute('''
+                        INSERT INTO conversations (user, conversation_id, chat_log, timestamp, persona, date_modified, message_count, chat_log_size, chat_log_digest)
+                        VALUES (?, ?, ?, ?, ?, ?, (SELECT COUNT(*) FROM messages WHERE user = ? AND conversation_id = ?), ?, ?);
+                    ''', (user, conversation_id, self.codec.encode(chat_log), timestamp, persona, current_time, user, conversation_id, size, digest))
+                    logger.info("Conversation inserted successfully")
+                else:
+                    row_id, saved_size, saved_digest = row
+                    mode, text, size, digest = transcript_delta(saved_size, saved_digest, chat_log)
+                    if mode == UNCHANGED:
+                        logger.info("Conversation unchanged since last save")
+                        return False
+                    if mode == APPEND:
+                        cursor.execute('''
+                            INSERT INTO conversation_segments (conversation_ref, content, timestamp)
+                            VALUES (?, ?, ?);
+                        ''', (row_id, self.codec.encode(text), current_time))
+                    else:
+                        # The chat log no longer starts with what was saved, so store it whole again.
+                        cursor.execute('DELETE FROM conversation_segments WHERE conversation_ref = ?;', (row_id,))
+                        cursor.execute('UPDATE conversations SET chat_log = ? WHERE id = ?;', (self.codec.encode(text), row_id))
+                    cursor.execute('''
+                        UPDATE conversations
+                        SET date_modified = ?, chat_log_size = ?, chat_log_digest = ?,
+                            message_count = (SELECT COUNT(*) FROM messages WHERE user = ? AND conversation_id = ?)
+                        WHERE id = ?;
+                    ''', (current_time, size, digest, user, conversation_id, row_id))
+                    logger.info(f"Conversation saved ({mode})")
             except sqlite3.Error as e:
                 logger.error(f"Error inserting conversation: {e}")
                 raise
-
-        task = asyncio.create_task(self.cognitive_services.process_conversation(user, conversation_id, chat_log))
-        self.background_tasks.append(task)
+        return True
          
     def get_conversations(self, user, persona=None, conversation_id=None):
         """
@@ -162,32 +307,139 @@ class ConversationManager:
 
         Returns:
         - Populates Chat History listbox with list of chat logs, timestamps, personas, and names for the specified user. 
+          Archived conversations are included, read from their segment files.
         """
         with DatabaseContextManager(self.db_file) as cursor:
             try:
-                query = 'SELECT chat_log, timestamp, persona, conversation_id, name FROM conversations WHERE user = ?'
+                filters = ' WHERE user = ?'
                 params = [user]
 
                 if persona:
-                    query += ' AND persona = ?'
+                    filters += ' AND persona = ?'
                     params.append(persona)
 
                 if conversation_id:
-                    query += ' AND conversation_id = ?'
+                    filters += ' AND conversation_id = ?'
                     params.append(conversation_id)
 
-                logger.info("Executing query")    
-                logger.debug(f"Executing query: {query} with params: {params}")
+                log_payload(logger, logging.DEBUG, "Fetching conversations", filters=filters, params=params)
+                results = self._read_chat_logs(cursor, ('timestamp', 'persona', 'conversation_id', 'name'), filters, params)
+                cursor.execute('SELECT segment, offset, length, timestamp, persona, conversation_id, name FROM archived_conversations' + filters, params)
+                archived = cursor.fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"Error fetching conversation: {e}")
+                raise
+
+        chat_logs = self.archive.read_chat_logs([row[:3] for row in archived])
+        logger.debug(f"Query returned {len(results)} conversations and {len(archived)} archived conversations")
+        return results + [(chat_log,) + row[3:] for chat_log, row in zip(chat_logs, archived)]
+
+    def _read_chat_logs(self, cursor, columns, filters, params):
+        """
+        Reads the full chat logs of the conversations matching filters in the caller's transaction.
+
+        A conversation's first save is stored in conversations.chat_log and every later save appends a
+        segment, so the segments are read in the same transaction and joined on in ORDER BY id order.
 
+        Args:
+        - cursor: Cursor of the caller's DatabaseContextManager block.
+        - columns: Further conversations columns to return after the chat log.
+        - filters: WHERE clause on conversations, starting with ' WHERE'.
+        - params: Parameters of filters.
+
+        Returns:
+        - List of (chat_log, *columns) tuples.
+        """
+        cursor.execute(f'SELECT id, chat_log{"".join(", " + column for column in columns)} FROM conversations{filters};', params)
+        rows = cursor.fetchall()
+        segments = {}
+        if rows:
+            cursor.execute(f'''
+                SELECT conversation_ref, content FROM conversation_segments
+                WHERE conversation_ref IN (SELECT id FROM conversations{filters}) ORDER BY id;
+            ''', params)
+            for row_id, segment in cursor.fetchall():
+                segments.setdefault(row_id, []).append(self.codec.decode(segment))
+        return [(self.codec.decode(row[1]) + "".join(segments.get(row[0], ())),) + row[2:] for row in rows]
+
+    def list_conversations(self, user, persona=None, limit=50, after=None):
+        """
+        Used in chist_functions to fill the Chat History list one page at a time, most recently modified first.
+        Only metadata is read; the chat log itself is fetched with get_chat_log when a conversation is opened.
+
+        Args:
+        - user: User ID
+        - persona: Optional. Only list conversations with this persona.
+        - limit: Maximum number of conversations to return.
+        - after: Optional. The cursor returned with the previous page.
+
+        Returns:
+        - A (conversations, cursor) tuple. conversations is a list of dictionaries with id, conversation_id, name,
+          persona, timestamp, date_modified, message_count, size (chat log size in bytes) and archived. cursor is
+          passed back as `after` to get the next page and is None once the last page has been returned.
+        """
+        filters = ' WHERE user = ?'
+        params = [user]
+        if persona:
+            filters += ' AND persona = ?'
+            params.append(persona)
+        if after is not None:
+            # Keyset pagination: seek past the last row of the previous page instead of using OFFSET,
+            # so every page costs the same no matter how deep the user scrolls.
+            filters += ' AND (date_modified, id) < (?, ?)'
+            params.extend(after)
+        # Archived conversations keep the id they had in conversations, so (date_modified, id) stays unique
+        # across both tables. Each side is limited on its own listing index before the two are merged.
+        columns = 'id, conversation_id, name, persona, timestamp, date_modified, message_count, chat_log_size'
+        query = f'''
+            SELECT *, 0 FROM (SELECT {columns} FROM conversations{filters} ORDER BY date_modified DESC, id DESC LIMIT ?)
+            UNION ALL
+            SELECT *, 1 FROM (SELECT {columns} FROM archived_conversations{filters} ORDER BY date_modified DESC, id DESC LIMIT ?)
+            ORDER BY date_modified DESC, id DESC LIMIT ?;
+        '''
+        params = params + [limit] + params + [limit, limit]
+
+        with DatabaseContextManager(self.db_file) as cursor:
+            try:
                 cursor.execute(query, params)
-                results = cursor.fetchall()
-                
-                logger.debug(f"Query results: {results}")
-                return results
+                rows = cursor.fetchall()
             except sqlite3.Error as e:
-                logger.error(f"Error fetching conversation: {e}")
+                logger.error(f"Error listing conversations: {e}")
                 raise
 
+        conversations = [
+            {
+                "id": row_id, "conversation_id": conversation_id, "name": name, "persona": row_persona,
+                "timestamp": timestamp, "date_modified": date_modified, "message_count": message_count, "size": size,
+                "archived": bool(archived),
+            }
+            for row_id, conversation_id, name, row_persona, timestamp, date_modified, message_count, size, archived in rows
+        ]
+        next_cursor = (rows[-1][5], rows[-1][0]) if len(rows) == limit else None
+        logger.debug(f"Listed {len(conversations)} conversations")
+        return conversations, next_cursor
+
+    def search(self, user, query, persona=None, limit=20, offset=0):
+        """
+        Used in chist_functions to full-text search messages and saved chat logs.
+        Without a persona every persona database is searched and the results are ranked together; only this
+        manager's own database is written to, the others are opened read-only.
+
+        Args:
+        - user: User ID
+        - query: Free text to search for
+        - persona: Optional. Only search this persona's conversations.
+        - limit: Maximum number of results.
+        - offset: Number of results to skip, for paging.
+
+        Returns:
+        - List of result dictionaries with source, conversation_id, persona, snippet and rank, best match first.
+        """
+        results = history_search.search(user, query, persona=persona, limit=limit, offset=offset,
+                                        db_path=self.db_file, db_persona=self.persona_name)
+        logger.info(f"Search returned {len(results)} results")
+        return results
+
     def delete_conversation(self, user, conversation_id):
         """
         # used in chist_functions.py to delete all entries related to a specific conversation_id from all relevant tables.
@@ -196,17 +448,27 @@ class ConversationManager:
         - user: The user ID
         - conversation_id: The conversation ID to be deleted
         """
+        if self.write_queue is not None:
+            self.write_queue.flush()
+        self.archive.remove(user, conversation_id)
         with DatabaseContextManager(self.db_file) as cursor: 
             try:
+                cursor.execute('SELECT id FROM messages WHERE user = ? AND conversation_id = ?;', (user, conversation_id))
+                message_ids = [row[0] for row in cursor.fetchall()]
                 cursor.execute('DELETE FROM conversations WHERE user = ? AND conversation_id = ?;', (user, conversation_id))
                 cursor.execute('DELETE FROM messages WHERE user = ? AND conversation_id = ?;', (user, conversation_id))
                 cursor.execute('DELETE FROM function_calls WHERE user = ? AND conversation_id = ?;', (user, conversation_id))
+                cursor.execute('DELETE FROM responses WHERE user = ? AND conversation_id = ?;', (user, conversation_id))
+                cursor.execute('DELETE FROM conversation_analysis WHERE user = ? AND conversation_id = ?;', (user, conversation_id))
                 logger.info("All related data deleted successfully")
                 logger.debug(f"for conversation_id: {conversation_id}")
 
             except sqlite3.Error as e:
                 logger.error(f"Error deleting conversation and related data: {e}")
                 raise          
+        # Only once the delete has committed; before that a concurrent reader could cache the old rows again.
+        self.history_cache.invalidate(user, conversation_id)
+        self.semantic_memory.remove(message_ids)
 
     def get_chat_log(self, user, conversation_id):
         """
@@ -218,23 +480,22 @@ class ConversationManager:
         - conversation_id: The ID of the conversation
 
         Returns:
-        The chat log as a string, or None if not found.
+        The chat log as a string, including every segment appended by later saves, or None if not found.
+        An archived conversation is moved back into the database first, since opening it usually means continuing it.
         """
+        self.archive.restore(user, conversation_id)
         with DatabaseContextManager(self.db_file) as cursor:
             try:
-                cursor.execute('''
-                    SELECT chat_log FROM conversations
-                    WHERE user = ? AND conversation_id = ?;
-                ''', (user, conversation_id))
-                row = cursor.fetchone()
-                return row[0] if row is not None else None
+                # Only the opened conversation is decompressed; the listing never reads chat_log.
+                rows = self._read_chat_logs(cursor, (), ' WHERE user = ? AND conversation_id = ?', (user, conversation_id))
+                return rows[0][0] if rows else None
             except sqlite3.Error as e:
                 logger.error(f"Error fetching conversation: {e}")
                 raise
             
     def add_response(self, user, conversation_id, response_data, timestamp):
         """
-        Used in OA_gen_response to insert a response into the 'responses' table with a placeholder for function_call_id.
+        Used in OA_gen_response to insert a response into the 'responses' table, linked to the active function call if there is one.
 
         Args:
         - user: User ID
@@ -245,23 +506,23 @@ class ConversationManager:
         Returns:
         - The ID of the inserted response
         """
-        function_call_id_placeholder = "[function_call_id]"
+        if self.write_queue is not None:
+            response_id = self.write_queue.enqueue("responses", (user, conversation_id, self.function_call_id, self.codec.encode(json.dumps(response_data)), timestamp))
+            logger.info("Response queued for write-behind")
+            return response_id
+
         with DatabaseContextManager(self.db_file) as cursor:
             try:
-                serialized_response_data = json.dumps(response_data)
+                serialized_response_data = self.codec.encode(json.dumps(response_data))
                 
                 cursor.execute('''
                     INSERT INTO responses (user, conversation_id, function_call_id, response_data, timestamp)
-                    VALUES (?, ?, ?, ?, ?);
-                ''', (user, conversation_id, function_call_id_placeholder, serialized_response_data, timestamp))
-                response_id = cursor.lastrowid
+                    VALUES (?, ?, ?, ?, ?)
+                    RETURNING id;
+                ''', (user, conversation_id, self.function_call_id, serialized_response_data, timestamp))
+                response_id = cursor.fetchone()[0]
 
-                if self.function_call_id is not None:
-                    cursor.execute('''
-                        UPDATE responses SET function_call_id = ? WHERE id = ?;
-                    ''', (self.function_call_id, response_id))
-
-                logger.info("Response inserted and updated successfully")
+                logger.info("Response inserted successfully")
                 return response_id
             except sqlite3.Error as e:
                 logger.error(f"Error inserting response: {e}")
@@ -269,8 +530,7 @@ class ConversationManager:
         
     def add_function_call(self, user, conversation_id, function_name, arguments, timestamp):
         """
-        Used in Tool_Manager to insert a function call into the 'function_calls' table, then update the function call
-        to include its own ID and update the function_call_id attribute of the class.
+        Used in Tool_Manager to insert a function call into the 'function_calls' table, linked to the active message.
 
         Args:
         - user: User ID
@@ -286,21 +546,22 @@ class ConversationManager:
             logger.error("No message_id available to associate with the function call.")
             return None
 
-        placeholder = "[function_call_id]"
-        full_arguments = f"{arguments}\nFunction_call_id: {placeholder}"
+        if self.write_queue is not None:
+            function_call_id = self.write_queue.enqueue("function_calls", (user, conversation_id, self.message_id, function_name, arguments, timestamp))
+            log_payload(logger, logging.INFO, "Function call queued for write-behind", sample_every=WRITE_LOG_SAMPLE,
+                        id=function_call_id, function=function_name)
+            return function_call_id
+
         with DatabaseContextManager(self.db_file) as cursor:
             try:
                 cursor.execute('''
                     INSERT INTO function_calls (user, conversation_id, message_id, function_name, arguments, timestamp)
-                    VALUES (?, ?, ?, ?, ?, ?);
-                ''', (user, conversation_id, self.message_id, function_name, full_arguments, timestamp))
-                function_call_id = cursor.lastrowid
-                updated_arguments = full_arguments.replace(placeholder, str(function_call_id))
-                cursor.execute('''
-                    UPDATE function_calls SET arguments = ? WHERE id = ?;
-                ''', (updated_arguments, function_call_id))
-                logger.info("Function call inserted ")
-                logger.debug(f"with ID: {function_call_id}")
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    RETURNING id;
+                ''', (user, conversation_id, self.message_id, function_name, arguments, timestamp))
+                function_call_id = cursor.fetchone()[0]
+                log_payload(logger, logging.INFO, "Function call inserted", sample_every=WRITE_LOG_SAMPLE,
+                            id=function_call_id, function=function_name)
                 return function_call_id
             except sqlite3.Error as e:
                 logger.error(f"Error inserting function call: {e}")
@@ -309,6 +570,9 @@ class ConversationManager:
     def add_message(self, user, conversation_id, role, message, timestamp):
         """
         Used in OA_gen_response to insert a message into the 'messages' table and return the message ID.
+        The message is stored as given; the active function call ID, if any, goes into its own column.
+        Its token count is computed here once and stored for the context builder, and it is added
+        to the semantic memory index used by recall().
 
         Args:
         - user: User ID
@@ -320,60 +584,121 @@ class ConversationManager:
         Returns:
         - message_id: The ID of the inserted message
         """
-        message_id_placeholder = "Message ID: 1005"
-        function_call_id_placeholder = "<[function_call_id]>"
-
-        full_message = f"{message}\n{message_id_placeholder}"
-        if self.function_call_id is not None:
-            function_call_id_content = f"Function Call ID: {self.function_call_id}"
-            full_message += f"\n{function_call_id_content}"
+        token_count = count_tokens(message)
+        if self.write_queue is not None:
+            message_id = self.write_queue.enqueue("messages", (user, conversation_id, role, message, timestamp, self.function_call_id, token_count))
+            log_payload(logger, logging.INFO, "Message queued for write-behind", sample_every=WRITE_LOG_SAMPLE,
+                        id=message_id, role=role, tokens=token_count)
+            self.index_message(message_id, message)
+            return message_id
 
         with DatabaseContextManager(self.db_file) as cursor:
             try:
                 cursor.execute('''
-                    INSERT INTO messages (user, conversation_id, role, content, timestamp)
-                    VALUES (?, ?, ?, ?, ?);
-                ''', (user, conversation_id, role, full_message, timestamp))
-                message_id = cursor.lastrowid
-
-                updated_message = full_message.replace("Message ID: 1005", f"Message ID: {message_id}")
-                if self.function_call_id is not None:
-                    updated_message = updated_message.replace("<[function_call_id]>", f"Function Call ID: {self.function_call_id}")
-
-                cursor.execute('''
-                    UPDATE messages SET content = ? WHERE id = ?;
-                ''', (updated_message, message_id))
-                logger.info("Message inserted ")
-                logger.debug(f"with ID: {message_id}")
-
-                return message_id
+                    INSERT INTO messages (user, conversation_id, role, content, timestamp, function_call_id, token_count)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    RETURNING id;
+                ''', (user, conversation_id, role, message, timestamp, self.function_call_id, token_count))
+                message_id = cursor.fetchone()[0]
+                log_payload(logger, logging.INFO, "Message inserted", sample_every=WRITE_LOG_SAMPLE,
+                            id=message_id, role=role, tokens=token_count)
             except sqlite3.Error as e:
                 logger.error(f"Error inserting message: {e}")
                 raise
+        self.index_message(message_id, message)
+        return message_id
+
+    def index_message(self, message_id, message):
+        """Adds a stored message to the semantic memory index. Indexing errors never fail the insert."""
+        try:
+            self.semantic_memory.add_message(message_id, message)
+        except Exception as e:
+            logger.error(f"Error indexing message {message_id} for semantic recall: {e}", exc_info=True)
+
+    def recall(self, user, query, k=5, exclude_conversation_id=None):
+        """
+        Semantic search over the user's past messages with this persona.
+
+        Args:
+        - user: User ID
+        - query: Text to find related messages for.
+        - k: Maximum number of messages to return.
+        - exclude_conversation_id: Optional. Conversation to leave out, usually the current one.
+
+        Returns:
+        - List of dictionaries with message_id, conversation_id, role, content, timestamp and score, best match first.
+        """
+        if self.write_queue is not None:
+            self.write_queue.flush()
+        return self.semantic_memory.recall(query, k, user, exclude_conversation_id)
     
     def get_history(self, user, conversation_id):
         """
-        Used in OA_gen_response to fetch the message history for a user in a specific conversation.
-        This method removes the message_id from the message content before returning the history to gen_response.
+        Fetches the complete message history for a user in a specific conversation.
+        Requests to the model use get_context instead, which fits the history into the model's token budget.
+
         Args:
         - user: User ID
         - conversation_id: Conversation ID
 
         Returns:
-        - List of message dictionaries with role, content, and timestamp, with message_id removed from content.
+        - List of message dictionaries with role, content, and timestamp. The dictionaries are copies, callers may modify them.
         """
+        return [{"role": role, "content": content, "timestamp": timestamp}
+                for _, role, content, timestamp, _, _, _ in self.get_history_rows(user, conversation_id)]
+
+    def get_context(self, user, conversation_id, token_budget, reserved_tokens=0):
+        """
+        Used in the gen_response modules and ToolManager to get the messages to send to the model, packed into
+        token_budget. See context_builder.build_context.
+
+        Args:
+        - user: User ID
+        - conversation_id: Conversation ID
+        - token_budget: Tokens available for the request, from ModelManager.get_context_budget.
+        - reserved_tokens: Tokens of the budget already used by the system prompt.
+
+        Returns:
+        - List of message dictionaries with role, content, and timestamp, oldest first.
+        """
+        return build_context(self, user, conversation_id, token_budget, reserved_tokens)
+
+    def get_history_rows(self, user, conversation_id):
+        """
+        Fetches the message rows of a conversation as (id, role, content, timestamp, token_count, compressed_content,
+        compressed_token_count) tuples in id order.
+        Rows already read are served from the history cache and only rows with a greater id are fetched.
+        Messages still waiting in the write-behind queue are merged in, so a message is visible as soon as add_message returns.
+        """
+        # Snapshot the queue before reading: a row leaves the queue only after it has committed,
+        # so every message is found in at least one of the two places.
+        pending = self.write_queue.pending_rows("messages", user, conversation_id) if self.write_queue is not None else []
+        last_seen, cached = self.history_cache.get(user, conversation_id)
+
         with DatabaseContextManager(self.db_file) as cursor:
             try:
-                cursor.execute('SELECT role, content, timestamp FROM messages WHERE user = ? AND conversation_id = ?', (user, conversation_id,))
-                messages = []
-                for role, content, timestamp in cursor.fetchall():
-                    if 'Message ID: ' in content:
-                        # Remove the message ID from the content
-                        content = content.rsplit('Message ID: ', 1)[0].strip()
-                    messages.append({"role": role, "content": content, "timestamp": timestamp})
-                return messages
+                cursor.execute('''
+                    SELECT id, role, content, timestamp, token_count, compressed_content, compressed_token_count FROM messages
+                    WHERE user = ? AND conversation_id = ? AND id > ?
+                    ORDER BY id;
+                ''', (user, conversation_id, last_seen))
+                rows = cursor.fetchall()
             except sqlite3.Error as e:
                 logger.error(f"Error fetching history: {e}")
                 raise
 
+        if pending:
+            # Rows at or after the first still-pending id are not cached yet: that row may commit
+            # after a later one, and last_seen must never move past a message that is not on disk.
+            first_pending = pending[0][0]
+            self.history_cache.extend(user, conversation_id, last_seen, [row for row in rows if row[0] < first_pending])
+            committed_ids = {row[0] for row in rows}
+            rows.extend((row[0], row[3], row[4], row[5], row[7], None, None) for row in pending if row[0] not in committed_ids)
+            rows.sort(key=lambda row: row[0])
+        else:
+            self.history_cache.extend(user, conversation_id, last_seen, rows)
+
+        return cached + rows
+
+
     
\ No newline at end of file
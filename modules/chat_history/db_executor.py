@@ -0,0 +1,73 @@
+# modules/chat_history/db_executor.py
+
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.Analytics.tracing import span
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('db_executor.py')
+
+# Threads serving reads next to the single writer thread.
+READER_THREADS = 2
+
+
+class DatabaseExecutor:
+    """
+    Runs the chat history work of one database off the asyncio event loop.
+
+    Writes go to a single writer thread, so they are applied in the order they were awaited and
+    never contend with each other for SQLite's write lock; reads run on a small pool next to it,
+    which WAL mode lets proceed while a write is in progress. Each thread uses its own pooled
+    connection, and the event loop only waits on the returned future, so a slow commit or fsync
+    no longer stalls the GUI. Functions run in a copy of the caller's context, as with
+    asyncio.to_thread, so a traced turn's database spans and anything they trace nest under it.
+    """
+
+    def __init__(self, db_path, reader_threads=READER_THREADS):
+        self.db_path = db_path
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-history-writer")
+        self.readers = ThreadPoolExecutor(max_workers=reader_threads, thread_name_prefix="chat-history-reader")
+
+    async def write(self, function, *args, **kwargs):
+        """Runs function(*args, **kwargs) on the writer thread and returns its result."""
+        with span("db.write", root=False, call=function.__name__):
+            return await asyncio.get_running_loop().run_in_executor(
+                self.writer, functools.partial(contextvars.copy_context().run, function, *args, **kwargs))
+
+    async def read(self, function, *args, **kwargs):
+        """Runs function(*args, **kwargs) on a reader thread and returns its result."""
+        with span("db.read", root=False, call=function.__name__):
+            return await asyncio.get_running_loop().run_in_executor(
+                self.readers, functools.partial(contextvars.copy_context().run, function, *args, **kwargs))
+
+    def close(self):
+        """Waits for submitted work to finish and stops the threads."""
+        self.writer.shutdown(wait=True)
+        self.readers.shutdown(wait=True)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_database_executor(db_path):
+    """Returns the executor shared by every component working on db_path."""
+    executor = _executors.get(db_path)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(db_path)
+            if executor is None:
+                executor = _executors[db_path] = DatabaseExecutor(db_path)
+    return executor
+
+
+def close_database_executor(db_path):
+    with _executors_lock:
+        executor = _executors.pop(db_path, None)
+    if executor is not None:
+        executor.close()
+        logger.info("Chat history executor closed")
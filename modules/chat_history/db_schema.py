@@ -1,5 +1,8 @@
 # modules/chat_history/db_schema.py
 
+# These are the baseline (version 1) table definitions. Later schema changes are applied on top
+# of them by the versioned steps in modules/chat_history/migrations.py.
+
 class DatabaseSchema:    
     CREATE_USERS_TABLE_SQL = """
         CREATE TABLE IF NOT EXISTS users (
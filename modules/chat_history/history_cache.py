@@ -0,0 +1,107 @@
+# modules/chat_history/history_cache.py
+
+import threading
+from collections import OrderedDict
+
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('history_cache.py')
+
+# Number of conversations kept per database before the least recently used one is dropped.
+HISTORY_CACHE_SIZE = 32
+
+
+class HistoryCache:
+    """
+    In-process cache of the message history of recently used conversations.
+
+    Each entry holds the message rows read so far, tuples starting with the message id, and the
+    id of the last one, so the next get_history only has to fetch rows with a greater id. Entries are evicted least recently
+    used first once more than max_conversations are cached, and must be invalidated whenever
+    an existing message is changed or deleted.
+    """
+
+    def __init__(self, max_conversations=HISTORY_CACHE_SIZE):
+        self.max_conversations = max_conversations
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user, conversation_id):
+        """Returns (last_seen_id, rows) for the conversation, or (0, []) if it is not cached."""
+        key = (user, conversation_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return 0, []
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], list(entry[1])
+
+    def extend(self, user, conversation_id, last_seen, rows):
+        """
+        Appends rows, a list of tuples starting with the message id, in id order, to the conversation's entry.
+
+        last_seen is the id the caller read from. If another thread extended or invalidated the
+        entry in the meantime the rows are dropped; the next call simply reads them again.
+        """
+        key = (user, conversation_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            current = entry[0] if entry is not None else 0
+            if current != last_seen:
+                return
+            if entry is None:
+                entry = self._entries[key] = [0, []]
+            if rows:
+                entry[1].extend(rows)
+                entry[0] = rows[-1][0]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+
+    def update_rows(self, user, conversation_id, rows_by_id):
+        """Replaces cached rows by id, e.g. once their token counts have been stored."""
+        with self._lock:
+            entry = self._entries.get((user, conversation_id))
+            if entry is not None:
+                entry[1] = [rows_by_id.get(row[0], row) for row in entry[1]]
+
+    def invalidate(self, user, conversation_id):
+        with self._lock:
+            self._entries.pop((user, conversation_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_history_cache(db_path):
+    """Returns the history cache shared by every ConversationManager on db_path."""
+    cache = _caches.get(db_path)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(db_path)
+            if cache is None:
+                cache = _caches[db_path] = HistoryCache()
+    return cache
+
+
+def invalidate_history(db_path, user, conversation_id):
+    """Drops the cached history of one conversation after its messages were modified in place."""
+    cache = _caches.get(db_path)
+    if cache is not None:
+        cache.invalidate(user, conversation_id)
+
+
+def close_history_cache(db_path):
+    with _caches_lock:
+        cache = _caches.pop(db_path, None)
+    if cache is not None:
+        logger.info(f"History cache closed after {cache.hits} hits and {cache.misses} misses")
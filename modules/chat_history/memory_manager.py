@@ -2,6 +2,9 @@
 
 import sqlite3
 from .DatabaseContextManager import DatabaseContextManager
+from .write_behind import flush_write_behind_queue
+from .history_cache import invalidate_history
+from .codec import get_codec
 from modules.logging.logger import setup_logger
 import openai
 
@@ -21,16 +24,29 @@ class MemoryManager:
         - conversation_id (str): Conversation ID of the current conversation.
 
         Returns:
-        - List of message dictionaries with role, content, and timestamp.
+        - List of message dictionaries with role, content, and timestamp. The content is annotated with the
+          message ID and, when the message followed a tool call, the function call ID.
         """
+        flush_write_behind_queue(self.db_file)
         with DatabaseContextManager(self.db_file) as cursor:
             try:
-                cursor.execute('SELECT role, content, timestamp FROM messages WHERE user = ? AND conversation_id = ?', (user, conversation_id,))
-                return [{"role": role, "content": content, "timestamp": timestamp} for role, content, timestamp in cursor.fetchall()]
+                cursor.execute('SELECT id, role, content, timestamp, function_call_id FROM messages WHERE user = ? AND conversation_id = ? ORDER BY id', (user, conversation_id,))
+                return [
+                    {"role": role, "content": self.annotate_message(content, message_id, function_call_id), "timestamp": timestamp}
+                    for message_id, role, content, timestamp, function_call_id in cursor.fetchall()
+                ]
             except sqlite3.Error as e:
                 logger.error(f"Error fetching history: {e}")
                 raise   
 
+    @staticmethod
+    def annotate_message(content, message_id, function_call_id=None):
+        """Appends the message ID, and the function call ID if there is one, in the form the summarizer refers to."""
+        annotated = f"{content}\nMessage ID: {message_id}"
+        if function_call_id is not None:
+            annotated += f"\nFunction Call ID: {function_call_id}"
+        return annotated
+
     def get_cached_tool_response(self, user, conversation_id, function_call_id):
         """
         Retrieve a cached function call response based on the user, conversation_id, and function_call_id.
@@ -44,6 +60,7 @@ class MemoryManager:
         Returns:
         - The response data as a string, or None if not found.
         """
+        flush_write_behind_queue(self.db_file)
         with DatabaseContextManager(self.db_file) as cursor:
             try:
                 cursor.execute('''
@@ -51,7 +68,7 @@ class MemoryManager:
                     WHERE user = ? AND conversation_id = ? AND function_call_id = ?;
                 ''', (user, conversation_id, function_call_id))
                 row = cursor.fetchone()
-                return row[0] if row else None
+                return get_codec(self.db_file).decode(row[0]) if row else None
             except sqlite3.Error as e:
                 logger.error(f"Error fetching cached tool response: {e}")
                 raise
@@ -92,17 +109,19 @@ class MemoryManager:
         Returns:
         - None
         """
+        flush_write_behind_queue(self.db_file)
         with DatabaseContextManager(self.db_file) as cursor:
             try:
                 cursor.execute('''
                     UPDATE messages
-                    SET compressed_content = ?
+                    SET compressed_content = ?, compressed_token_count = NULL
                     WHERE user = ? AND conversation_id = ? AND id = ?;
                 ''', (compressed_message, user, conversation_id, message_id))
                 logger.info("Compressed message saved successfully")
             except sqlite3.Error as e:
                 logger.error(f"Error saving compressed message: {e}")
                 raise
+        invalidate_history(self.db_file, user, conversation_id)
 
     def recall_compressed_message(self, user, conversation_id, message_id):
         """
@@ -116,6 +135,8 @@ class MemoryManager:
         Returns:
         - The original message content, or None if not found.
         """
+        flush_write_behind_queue(self.db_file)
+        original_message = None
         with DatabaseContextManager(self.db_file) as cursor:
             try:
                 cursor.execute('''
@@ -127,15 +148,16 @@ class MemoryManager:
                     original_message = row[0]
                     cursor.execute('''
                         UPDATE messages
-                        SET compressed_content = NULL
+                        SET compressed_content = NULL, compressed_token_count = NULL
                         WHERE user = ? AND conversation_id = ? AND id = ?;
                     ''', (user, conversation_id, message_id))
                     logger.info("Original message recalled successfully")
-                    return original_message
-                return None
             except sqlite3.Error as e:
                 logger.error(f"Error recalling original message: {e}")
                 raise
+        if original_message is not None:
+            invalidate_history(self.db_file, user, conversation_id)
+        return original_message
 
     def revert_to_compressed_message(self, user, conversation_id, message_id):
         """
@@ -149,6 +171,8 @@ class MemoryManager:
         Returns:
         - None
         """
+        flush_write_behind_queue(self.db_file)
+        reverted = False
         with DatabaseContextManager(self.db_file) as cursor:
             try:
                 cursor.execute('''
@@ -160,13 +184,16 @@ class MemoryManager:
                     compressed_message = row[0]
                     cursor.execute('''
                         UPDATE messages
-                        SET content = ?, compressed_content = NULL
+                        SET content = ?, compressed_content = NULL, token_count = NULL, compressed_token_count = NULL
                         WHERE user = ? AND conversation_id = ? AND id = ?;
                     ''', (compressed_message, user, conversation_id, message_id))
+                    reverted = True
                     logger.info("Message reverted to compressed form successfully")
             except sqlite3.Error as e:
                 logger.error(f"Error reverting to compressed message: {e}")
                 raise
+        if reverted:
+            invalidate_history(self.db_file, user, conversation_id)
 
 # Example usage
 # db_file = "path/to/database.db"
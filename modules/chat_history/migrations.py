@@ -0,0 +1,620 @@
+# modules/chat_history/migrations.py
+
+import glob
+import re
+import sqlite3
+import sys
+import threading
+
+from modules.chat_history.db_schema import DatabaseSchema
+from modules.chat_history.codec import require_sql_functions
+from modules.chat_history.connection_pool import get_pool
+from modules.chat_history.transcript import TRANSCRIPT_ENCODING, transcript_digest
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('migrations.py')
+
+PERSONA_DB_GLOB = "modules/Personas/*/Memory/*.db"
+
+
+def table_exists(conn, table):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?;", (table,)).fetchone()
+    return row is not None
+
+
+def column_exists(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table});"))
+
+
+def add_column(conn, table, column, declaration):
+    """ALTER TABLE ... ADD COLUMN that is a no-op when the column is already there."""
+    if not column_exists(conn, table, column):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration};")
+
+
+def _baseline(conn):
+    """Version 1: the original tables, as created by DatabaseSchema before migrations existed."""
+    schema = DatabaseSchema()
+    conn.execute(schema.CREATE_USERS_TABLE_SQL)
+    conn.execute(schema.CREATE_CONVERSATIONS_TABLE_SQL)
+    conn.execute(schema.CREATE_MESSAGES_TABLE_SQL)
+    conn.execute(schema.CREATE_FUNCTION_CALLS_TABLE_SQL)
+    conn.execute(schema.CREATE_RESPONSES_TABLE_SQL)
+
+
+def _integer_foreign_keys(conn):
+    """
+    Version 2: rebuild the tables with foreign keys SQLite can actually enforce.
+
+    The baseline declared `user TEXT REFERENCES users(id)` although users holds persona names,
+    and responses.function_call_id was NOT NULL but received the text placeholder
+    "[function_call_id]" whenever no function call was active. Child rows now reference their
+    parent's integer id with ON DELETE CASCADE, responses.function_call_id is nullable, and
+    messages gains the compressed_content column MemoryManager writes to.
+    """
+    add_column(conn, "messages", "compressed_content", "TEXT")
+
+    conn.execute("""
+        CREATE TABLE conversations_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            chat_log TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            persona TEXT NOT NULL,
+            name TEXT,
+            date_modified TEXT
+        );
+    """)
+    conn.execute("""
+        INSERT INTO conversations_new (id, user, conversation_id, chat_log, timestamp, persona, name, date_modified)
+        SELECT id, user, conversation_id, chat_log, timestamp, persona, name, COALESCE(date_modified, timestamp)
+        FROM conversations;
+    """)
+
+    conn.execute("""
+        CREATE TABLE messages_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            compressed_content TEXT
+        );
+    """)
+    conn.execute("""
+        INSERT INTO messages_new (id, user, conversation_id, role, content, timestamp, compressed_content)
+        SELECT id, user, conversation_id, role, content, timestamp, compressed_content
+        FROM messages;
+    """)
+
+    conn.execute("""
+        CREATE TABLE function_calls_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            message_id INTEGER REFERENCES messages(id) ON DELETE CASCADE,
+            function_name TEXT NOT NULL,
+            arguments TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+    """)
+    conn.execute("""
+        INSERT INTO function_calls_new (id, user, conversation_id, message_id, function_name, arguments, timestamp)
+        SELECT id, user, conversation_id,
+               CASE WHEN message_id IN (SELECT id FROM messages) THEN message_id END,
+               function_name, arguments, timestamp
+        FROM function_calls;
+    """)
+
+    conn.execute("""
+        CREATE TABLE responses_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            function_call_id INTEGER REFERENCES function_calls(id) ON DELETE CASCADE,
+            response_data TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+    """)
+    conn.execute("""
+        INSERT INTO responses_new (id, user, conversation_id, function_call_id, response_data, timestamp)
+        SELECT id, user, conversation_id,
+               CASE WHEN typeof(function_call_id) = 'integer' AND function_call_id IN (SELECT id FROM function_calls)
+                    THEN function_call_id END,
+               response_data, timestamp
+        FROM responses;
+    """)
+
+    for table in ("responses", "function_calls", "messages", "conversations"):
+        # Carry the AUTOINCREMENT high-water mark over so ids of deleted rows are never reused.
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?;", (table,)).fetchone()
+        conn.execute(f"DROP TABLE {table};")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table};")
+        if row is not None:
+            conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?;", (row[0], table))
+
+
+def _history_indexes(conn):
+    """
+    Version 3: indexes for the (user, conversation_id) lookups every chat history query makes.
+
+    The conversations index covers the Chat History listing columns so the dialog never has to
+    touch chat_log, and the *_message / *_function_call indexes keep ON DELETE CASCADE from
+    scanning the child tables.
+    """
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_user_conversation
+        ON messages (user, conversation_id, id);
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversations_user_conversation
+        ON conversations (user, conversation_id);
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversations_user_persona
+        ON conversations (user, persona, date_modified, conversation_id, name, timestamp);
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_function_calls_user_conversation
+        ON function_calls (user, conversation_id);
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_function_calls_message
+        ON function_calls (message_id);
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_responses_user_conversation
+        ON responses (user, conversation_id, function_call_id);
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_responses_function_call
+        ON responses (function_call_id);
+    """)
+
+
+_EMBEDDED_MESSAGE_IDS = re.compile(r"^(.*?)\s*Message ID: \d+(?:\s*Function Call ID: (\d+))?\s*$", re.DOTALL)
+_EMBEDDED_FUNCTION_CALL_ID = re.compile(r"^(.*?)\s*Function_call_id: (?:\d+|\[function_call_id\])\s*$", re.DOTALL)
+
+
+def _separate_ids(conn):
+    """
+    Version 4: keep message and function call ids in columns instead of inside the text.
+
+    ConversationManager used to insert "Message ID: 1005" / "Function_call_id: [function_call_id]"
+    placeholders and rewrite them with a second UPDATE once the row id was known. The ids are
+    stripped from existing rows here; the function call a message answered moves to the new
+    messages.function_call_id column and MemoryManager rebuilds the annotated text on read.
+    """
+    add_column(conn, "messages", "function_call_id", "INTEGER")
+
+    updates = []
+    for message_id, content in conn.execute("SELECT id, content FROM messages WHERE content LIKE '%Message ID: %';"):
+        match = _EMBEDDED_MESSAGE_IDS.match(content)
+        if match:
+            function_call_id = int(match.group(2)) if match.group(2) else None
+            updates.append((match.group(1), function_call_id, message_id))
+    conn.executemany("UPDATE messages SET content = ?, function_call_id = ? WHERE id = ?;", updates)
+
+    updates = []
+    for function_call_id, arguments in conn.execute("SELECT id, arguments FROM function_calls WHERE arguments LIKE '%Function_call_id: %';"):
+        match = _EMBEDDED_FUNCTION_CALL_ID.match(arguments)
+        if match:
+            updates.append((match.group(1), function_call_id))
+    conn.executemany("UPDATE function_calls SET arguments = ? WHERE id = ?;", updates)
+
+
+def _conversation_listing(conn):
+    """
+    Version 5: metadata columns and a covering index for the paginated Chat History listing.
+
+    message_count and chat_log_size are filled in when a conversation is saved, so listing a
+    page never has to read chat_log or count messages. The index serves the keyset order of
+    ConversationManager.list_conversations and replaces the version 3 listing index.
+    """
+    add_column(conn, "conversations", "message_count", "INTEGER NOT NULL DEFAULT 0")
+    add_column(conn, "conversations", "chat_log_size", "INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""
+        UPDATE conversations
+        SET chat_log_size = length(CAST(chat_log AS BLOB)),
+            message_count = (
+                SELECT COUNT(*) FROM messages
+                WHERE messages.user = conversations.user AND messages.conversation_id = conversations.conversation_id
+            );
+    """)
+    conn.execute("DROP INDEX IF EXISTS idx_conversations_user_persona;")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversations_listing
+        ON conversations (user, persona, date_modified, id, conversation_id, name, timestamp, message_count, chat_log_size);
+    """)
+
+
+def _full_text_search(conn):
+    """
+    Version 6: FTS5 indexes over messages.content and conversations.name / chat_log.
+
+    Both are external content tables, so the text is stored once in the original table and the
+    triggers below keep the index in step with every insert, update and delete.
+    """
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+        USING fts5(content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2');
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END;
+    """)
+
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts
+        USING fts5(name, chat_log, content='conversations', content_rowid='id', tokenize='unicode61 remove_diacritics 2');
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN
+            INSERT INTO conversations_fts (rowid, name, chat_log) VALUES (new.id, new.name, new.chat_log);
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN
+            INSERT INTO conversations_fts (conversations_fts, rowid, name, chat_log) VALUES ('delete', old.id, old.name, old.chat_log);
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE OF name, chat_log ON conversations BEGIN
+            INSERT INTO conversations_fts (conversations_fts, rowid, name, chat_log) VALUES ('delete', old.id, old.name, old.chat_log);
+            INSERT INTO conversations_fts (rowid, name, chat_log) VALUES (new.id, new.name, new.chat_log);
+        END;
+    """)
+
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild');")
+    conn.execute("INSERT INTO conversations_fts (conversations_fts) VALUES ('rebuild');")
+
+
+def _conversation_segments(conn):
+    """
+    Version 7: append-only transcript storage.
+
+    conversations.chat_log keeps the transcript as it was first saved and every later save of
+    the same conversation adds only its new tail to conversation_segments. chat_log_digest is the
+    digest of the whole transcript saved so far, which lets a save find its delta without reading
+    the stored text back. Segments get their own FTS5 index, maintained like conversations_fts.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_segments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_ref INTEGER NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+            content TEXT NOT NULL,
+            timestamp TEXT NOT NULL
+        );
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_conversation_segments_conversation
+        ON conversation_segments (conversation_ref, id);
+    """)
+    add_column(conn, "conversations", "chat_log_digest", "TEXT")
+
+    updates = []
+    for row_id, chat_log in conn.execute("SELECT id, chat_log FROM conversations;"):
+        data = chat_log.encode(TRANSCRIPT_ENCODING)
+        updates.append((transcript_digest(data), len(data), row_id))
+    conn.executemany("UPDATE conversations SET chat_log_digest = ?, chat_log_size = ? WHERE id = ?;", updates)
+
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS conversation_segments_fts
+        USING fts5(content, content='conversation_segments', content_rowid='id', tokenize='unicode61 remove_diacritics 2');
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS conversation_segments_fts_insert AFTER INSERT ON conversation_segments BEGIN
+            INSERT INTO conversation_segments_fts (rowid, content) VALUES (new.id, new.content);
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS conversation_segments_fts_delete AFTER DELETE ON conversation_segments BEGIN
+            INSERT INTO conversation_segments_fts (conversation_segments_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END;
+    """)
+
+
+def _token_counts(conn):
+    """
+    Version 8: per-message token counts for the context builder.
+
+    Counts are filled in lazily: new messages are counted when they are added and older ones
+    the first time a context is built from them. NULL means not counted yet.
+    """
+    add_column(conn, "messages", "token_count", "INTEGER")
+    add_column(conn, "messages", "compressed_token_count", "INTEGER")
+
+
+def _compressed_transcripts(conn):
+    """
+    Version 9: transcripts and tool responses may be stored compressed.
+
+    chat_log, conversation_segments.content and responses.response_data now hold either plain
+    text or a compressed BLOB written by TranscriptCodec, and compression_dictionaries holds the
+    shared dictionaries those BLOBs refer to. The transcript FTS indexes are rebuilt on views that
+    decode the text with transcript_decode(), which every pooled connection registers, so
+    indexing and snippets keep working on the plain text.
+
+    From this version on, writing conversations or conversation_segments needs that function:
+    a connection that does not register it fails with "no such function: transcript_decode".
+    connection_pool.open_connection() opens one that does, for tools outside the application.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS compression_dictionaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codec TEXT NOT NULL,
+            data BLOB NOT NULL,
+            created TEXT NOT NULL
+        );
+    """)
+
+    for trigger in ("conversations_fts_insert", "conversations_fts_delete", "conversations_fts_update",
+                    "conversation_segments_fts_insert", "conversation_segments_fts_delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger};")
+    conn.execute("DROP TABLE IF EXISTS conversations_fts;")
+    conn.execute("DROP TABLE IF EXISTS conversation_segments_fts;")
+
+    conn.execute("""
+        CREATE VIEW IF NOT EXISTS conversations_text AS
+        SELECT id, name, transcript_decode(chat_log) AS chat_log FROM conversations;
+    """)
+    conn.execute("""
+        CREATE VIEW IF NOT EXISTS conversation_segments_text AS
+        SELECT id, transcript_decode(content) AS content FROM conversation_segments;
+    """)
+
+    conn.execute("""
+        CREATE VIRTUAL TABLE conversations_fts
+        USING fts5(name, chat_log, content='conversations_text', content_rowid='id', tokenize='unicode61 remove_diacritics 2');
+    """)
+    conn.execute("""
+        CREATE TRIGGER conversations_fts_insert AFTER INSERT ON conversations BEGIN
+            INSERT INTO conversations_fts (rowid, name, chat_log) VALUES (new.id, new.name, transcript_decode(new.chat_log));
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER conversations_fts_delete AFTER DELETE ON conversations BEGIN
+            INSERT INTO conversations_fts (conversations_fts, rowid, name, chat_log)
+            VALUES ('delete', old.id, old.name, transcript_decode(old.chat_log));
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER conversations_fts_update AFTER UPDATE OF name, chat_log ON conversations BEGIN
+            INSERT INTO conversations_fts (conversations_fts, rowid, name, chat_log)
+            VALUES ('delete', old.id, old.name, transcript_decode(old.chat_log));
+            INSERT INTO conversations_fts (rowid, name, chat_log) VALUES (new.id, new.name, transcript_decode(new.chat_log));
+        END;
+    """)
+
+    conn.execute("""
+        CREATE VIRTUAL TABLE conversation_segments_fts
+        USING fts5(content, content='conversation_segments_text', content_rowid='id', tokenize='unicode61 remove_diacritics 2');
+    """)
+    conn.execute("""
+        CREATE TRIGGER conversation_segments_fts_insert AFTER INSERT ON conversation_segments BEGIN
+            INSERT INTO conversation_segments_fts (rowid, content) VALUES (new.id, transcript_decode(new.content));
+        END;
+    """)
+    conn.execute("""
+        CREATE TRIGGER conversation_segments_fts_delete AFTER DELETE ON conversation_segments BEGIN
+            INSERT INTO conversation_segments_fts (conversation_segments_fts, rowid, content)
+            VALUES ('delete', old.id, transcript_decode(old.content));
+        END;
+    """)
+
+    conn.execute("INSERT INTO conversations_fts (conversations_fts) VALUES ('rebuild');")
+    conn.execute("INSERT INTO conversation_segments_fts (conversation_segments_fts) VALUES ('rebuild');")
+
+
+def _conversation_archive(conn):
+    """
+    Version 10: index of conversations moved to archive segment files.
+
+    archived_conversations keeps the listing metadata of every archived conversation, under the
+    id it had in conversations, and where its record lives in the segment files. The transcripts
+    themselves are only on disk, so archived_conversations_fts is contentless: it stores the
+    index but not the text, and search reads snippets back from the segment files.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archived_conversations (
+            id INTEGER PRIMARY KEY,
+            user TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            name TEXT,
+            persona TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            date_modified TEXT,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            chat_log_size INTEGER NOT NULL DEFAULT 0,
+            segment TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            archived TEXT NOT NULL
+        );
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_archived_conversations_user_conversation
+        ON archived_conversations (user, conversation_id);
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_archived_conversations_listing
+        ON archived_conversations (user, persona, date_modified, id);
+    """)
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS archived_conversations_fts
+        USING fts5(name, chat_log, content='', tokenize='unicode61 remove_diacritics 2');
+    """)
+
+
+def _background_jobs(conn):
+    """
+    Version 11: persistent queue of background jobs.
+
+    Only one pending job may exist per kind, user and conversation, which is what lets enqueueing
+    the same work again replace the payload of the queued job instead of adding a second one.
+    Jobs are deleted when they complete; failed ones are kept with their error.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS background_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            user TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            enqueued_at REAL NOT NULL,
+            not_before REAL NOT NULL DEFAULT 0,
+            error TEXT
+        );
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_background_jobs_pending
+        ON background_jobs (kind, user, conversation_id) WHERE status = 'pending';
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_background_jobs_status
+        ON background_jobs (status, not_before, id);
+    """)
+
+
+def _conversation_analysis(conn):
+    """
+    Version 12: checkpoints of the cognitive background services per conversation.
+
+    analyzed_length is how much of the chat log has been analyzed and analyzed_hash a digest of
+    that prefix, so a later save only sends the text after it, together with the running summary,
+    as long as the prefix is unchanged.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_analysis (
+            user TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            analyzed_length INTEGER NOT NULL,
+            analyzed_hash TEXT NOT NULL,
+            name TEXT,
+            summary TEXT,
+            updated TEXT NOT NULL,
+            PRIMARY KEY (user, conversation_id)
+        );
+    """)
+
+
+# Ordered list of (version, step). A database at user_version N runs every step above N, each in
+# its own transaction, and user_version is bumped in the same transaction as the step.
+MIGRATIONS = [
+    (1, _baseline),
+    (2, _integer_foreign_keys),
+    (3, _history_indexes),
+    (4, _separate_ids),
+    (5, _conversation_listing),
+    (6, _full_text_search),
+    (7, _conversation_segments),
+    (8, _token_counts),
+    (9, _compressed_transcripts),
+    (10, _conversation_archive),
+    (11, _background_jobs),
+    (12, _conversation_analysis),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# The baseline foreign keys point at columns of the wrong type and are violated by design, so
+# PRAGMA foreign_key_check is only meaningful once version 2 has rebuilt the tables.
+FOREIGN_KEYS_VALID_FROM = 2
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Brings the database behind conn up to SCHEMA_VERSION.
+
+    Foreign key enforcement is switched off while steps run, because rebuilding a parent table
+    would otherwise cascade deletes into its children, and violations are checked before each
+    step commits.
+
+    Returns:
+    - The (old_version, new_version) pair.
+    """
+    start_version = version = get_schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        return start_version, version
+    require_sql_functions(conn)
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("PRAGMA foreign_keys=OFF;")
+    try:
+        for target, step in MIGRATIONS:
+            if version >= target:
+                continue
+            logger.info(f"Applying chat history migration {target}: {step.__name__}")
+            try:
+                conn.execute("BEGIN IMMEDIATE;")
+                step(conn)
+                violations = conn.execute("PRAGMA foreign_key_check;").fetchall() if target >= FOREIGN_KEYS_VALID_FROM else []
+                if violations:
+                    raise sqlite3.IntegrityError(f"Migration {target} left {len(violations)} foreign key violations")
+                conn.execute(f"PRAGMA user_version={int(target)};")
+                conn.commit()
+                version = target
+            except sqlite3.Error as e:
+                conn.rollback()
+                logger.error(f"Chat history migration {target} failed: {e}")
+                raise
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON;")
+
+    logger.info(f"Chat history database migrated from version {start_version} to {version}")
+    return start_version, version
+
+
+def migrate_database(db_path):
+    """Migrates db_path once per process using the calling thread's pooled connection."""
+    if db_path in _migrated:
+        return
+    with _migrate_lock:
+        if db_path in _migrated:
+            return
+        migrate(get_pool(db_path).connection())
+        _migrated.add(db_path)
+
+
+def migrate_all(pattern=PERSONA_DB_GLOB):
+    """Upgrades every persona chat history database matching pattern in place."""
+    results = {}
+    for db_path in sorted(glob.glob(pattern)):
+        try:
+            results[db_path] = migrate(get_pool(db_path).connection())
+        except sqlite3.Error as e:
+            results[db_path] = e
+    return results
+
+
+if __name__ == "__main__":
+    # python -m modules.chat_history.migrations [glob]
+    for path, result in migrate_all(*sys.argv[1:2]).items():
+        if isinstance(result, Exception):
+            print(f"{path}: FAILED ({result})")
+        else:
+            print(f"{path}: version {result[0]} -> {result[1]}")
@@ -0,0 +1,134 @@
+# modules/chat_history/recompress.py
+
+import argparse
+import glob
+import os
+import sqlite3
+import time
+
+from modules.chat_history.DatabaseContextManager import DatabaseContextManager
+from modules.chat_history.codec import TranscriptCodec, get_codec, close_codec
+from modules.chat_history.connection_pool import get_pool, close_pool
+from modules.chat_history.migrations import PERSONA_DB_GLOB, migrate_database
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('recompress.py')
+
+# Rows rewritten per transaction.
+BATCH_SIZE = 200
+
+# Transcripts and responses sampled to build a shared dictionary.
+DICTIONARY_SAMPLES = 2000
+
+
+def _database_size(db_path):
+    return sum(os.path.getsize(db_path + suffix) for suffix in ("", "-wal") if os.path.exists(db_path + suffix))
+
+
+def _train_dictionary(db_path, codec):
+    with DatabaseContextManager(db_path) as cursor:
+        cursor.execute('SELECT chat_log FROM conversations ORDER BY id DESC LIMIT ?;', (DICTIONARY_SAMPLES // 2,))
+        samples = [codec.decode(value) for value, in cursor.fetchall()]
+        cursor.execute('SELECT response_data FROM responses ORDER BY id DESC LIMIT ?;', (DICTIONARY_SAMPLES // 2,))
+        samples += [codec.decode(value) for value, in cursor.fetchall()]
+
+    dictionary = codec.train_dictionary(samples)
+    if dictionary is None:
+        return None
+    with DatabaseContextManager(db_path) as cursor:
+        cursor.execute('''
+            INSERT INTO compression_dictionaries (codec, data, created)
+            VALUES (?, ?, ?)
+            RETURNING id;
+        ''', (codec.codec_name, dictionary, time.strftime("%Y-%m-%d %H:%M:%S")))
+        dictionary_id = cursor.fetchone()[0]
+    codec.reload()
+    logger.info(f"Trained {codec.codec_name} dictionary {dictionary_id} ({len(dictionary)} bytes) from {len(samples)} samples")
+    return dictionary_id
+
+
+def _recompress_conversations(db_path, codec):
+    """Folds every conversation's segments back into chat_log and stores it re-encoded."""
+    last_id = 0
+    count = 0
+    while True:
+        with DatabaseContextManager(db_path) as cursor:
+            cursor.execute('SELECT id, chat_log FROM conversations WHERE id > ? ORDER BY id LIMIT ?;', (last_id, BATCH_SIZE))
+            rows = cursor.fetchall()
+            for row_id, chat_log in rows:
+                cursor.execute('SELECT content FROM conversation_segments WHERE conversation_ref = ? ORDER BY id;', (row_id,))
+                text = codec.decode(chat_log) + "".join(codec.decode(segment) for segment, in cursor.fetchall())
+                cursor.execute('DELETE FROM conversation_segments WHERE conversation_ref = ?;', (row_id,))
+                cursor.execute('UPDATE conversations SET chat_log = ? WHERE id = ?;', (codec.encode(text), row_id))
+        if not rows:
+            return count
+        last_id = rows[-1][0]
+        count += len(rows)
+
+
+def _recompress_responses(db_path, codec):
+    last_id = 0
+    count = 0
+    while True:
+        with DatabaseContextManager(db_path) as cursor:
+            cursor.execute('SELECT id, response_data FROM responses WHERE id > ? ORDER BY id LIMIT ?;', (last_id, BATCH_SIZE))
+            rows = cursor.fetchall()
+            cursor.executemany('UPDATE responses SET response_data = ? WHERE id = ?;', [
+                (codec.encode(codec.decode(response_data)), row_id) for row_id, response_data in rows
+            ])
+        if not rows:
+            return count
+        last_id = rows[-1][0]
+        count += len(rows)
+
+
+def recompress_database(db_path, codec_name=None, train_dictionary=True, vacuum=True):
+    """
+    Rewrites the transcripts and tool responses of one persona database with the current codec.
+
+    Meant to run while the application is closed. Each conversation's appended segments are
+    folded back into a single compressed chat_log, optionally with a freshly trained shared
+    dictionary, and the file is vacuumed afterwards so the space is actually returned.
+
+    Returns:
+    - The (size_before, size_after) pair in bytes.
+    """
+    migrate_database(db_path)
+    size_before = _database_size(db_path)
+    codec = TranscriptCodec(db_path, codec_name) if codec_name else get_codec(db_path)
+    try:
+        if train_dictionary:
+            _train_dictionary(db_path, codec)
+        conversations = _recompress_conversations(db_path, codec)
+        responses = _recompress_responses(db_path, codec)
+        logger.info(f"Recompressed {conversations} conversations and {responses} responses in {db_path}")
+        if vacuum:
+            conn = get_pool(db_path).connection()
+            # Rewriting every transcript leaves the FTS indexes full of deleted entries.
+            for fts in ("conversations_fts", "conversation_segments_fts"):
+                conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize');")
+            conn.commit()
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+            conn.execute("VACUUM;")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    finally:
+        close_pool(db_path)
+        close_codec(db_path)
+    return size_before, _database_size(db_path)
+
+
+if __name__ == "__main__":
+    # python -m modules.chat_history.recompress [glob] [--codec zlib|zstd] [--no-dictionary] [--no-vacuum]
+    parser = argparse.ArgumentParser(description="Recompress chat history transcripts and tool responses.")
+    parser.add_argument("pattern", nargs="?", default=PERSONA_DB_GLOB)
+    parser.add_argument("--codec", choices=("zlib", "zstd"))
+    parser.add_argument("--no-dictionary", action="store_true")
+    parser.add_argument("--no-vacuum", action="store_true")
+    args = parser.parse_args()
+
+    for path in sorted(glob.glob(args.pattern)):
+        try:
+            before, after = recompress_database(path, args.codec, not args.no_dictionary, not args.no_vacuum)
+            print(f"{path}: {before} -> {after} bytes")
+        except (sqlite3.Error, ValueError) as e:
+            print(f"{path}: FAILED ({e})")
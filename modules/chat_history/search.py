@@ -0,0 +1,286 @@
+# modules/chat_history/search.py
+
+import glob
+import os
+import re
+import sqlite3
+from urllib.request import pathname2url
+
+from modules.chat_history.DatabaseContextManager import DatabaseContextManager
+from modules.chat_history.archive import get_archive
+from modules.chat_history.codec import register_sql_functions
+from modules.chat_history.migrations import PERSONA_DB_GLOB, SCHEMA_VERSION, get_schema_version, migrate_database
+from modules.chat_history.write_behind import flush_write_behind_queue
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('search.py')
+
+# Markers placed around matched terms in snippets, and the number of tokens a snippet spans.
+SNIPPET_START = "["
+SNIPPET_END = "]"
+SNIPPET_ELLIPSIS = "…"
+SNIPPET_TOKENS = 12
+
+# Results of the different FTS tables are merged by reciprocal rank fusion: a result's rank is
+# -1 / (RRF_K + its position in its own table's bm25 order). bm25 scores depend on the term
+# statistics of the table they come from, so they only order results within one table.
+RRF_K = 60
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def build_match_query(text):
+    """
+    Turns free text typed by the user into an FTS5 MATCH expression.
+
+    Every word becomes a quoted term, so punctuation and FTS5 operators in the input can never
+    cause a syntax error, and the last word is matched as a prefix to support search-as-you-type.
+    Returns None when the text contains no searchable words.
+    """
+    terms = _TERM.findall(text)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def persona_database_path(persona):
+    return f"modules/Personas/{persona}/Memory/{persona}.db"
+
+
+def persona_database_paths(pattern=PERSONA_DB_GLOB):
+    """Returns the chat history databases of every persona that has one."""
+    return sorted(glob.glob(pattern))
+
+
+def search_database(db_path, user, match, persona=None, limit=20, db_persona=None):
+    """
+    Runs match against the messages and conversation transcripts of one database.
+
+    Each table is ranked by bm25 on its own and the tables are merged by reciprocal rank fusion
+    (see RRF_K). A conversation is returned once, with the best rank of its transcript and the
+    segments appended to it. Returns at most limit result dictionaries, best match first.
+
+    The database is migrated and read through its connection pool, so this is meant for the
+    caller's own database; other personas' databases are searched with search_database_read_only.
+    db_persona names the persona its messages belong to, by default the one in the file's path.
+    """
+    migrate_database(db_path)
+    flush_write_behind_queue(db_path)
+    with DatabaseContextManager(db_path) as cursor:
+        return _search_cursor(cursor, db_path, user, match, persona, limit, db_persona)
+
+
+def search_database_read_only(db_path, user, match, persona=None, limit=20):
+    """
+    Like search_database, but leaves the database as it is: it is opened read-only on a
+    connection of its own that is closed again, and never migrated. A database that is not on
+    SCHEMA_VERSION yet has nothing to search with and returns no results.
+    """
+    conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True)
+    try:
+        register_sql_functions(conn, db_path)
+        version = get_schema_version(conn)
+        if version < SCHEMA_VERSION:
+            logger.info(f"Skipping {db_path} in search: schema version {version}, not migrated yet")
+            return []
+        return _search_cursor(conn.cursor(), db_path, user, match, persona, limit)
+    finally:
+        conn.close()
+
+
+def _search_cursor(cursor, db_path, user, match, persona, limit, db_persona=None):
+    conversation_query = f'''
+        SELECT 'conversation', c.id, c.conversation_id, c.persona, NULL, c.date_modified, c.name,
+               snippet(conversations_fts, -1, ?, ?, ?, {SNIPPET_TOKENS}), bm25(conversations_fts) AS rank
+        FROM conversations_fts JOIN conversations c ON c.id = conversations_fts.rowid
+        WHERE conversations_fts MATCH ? AND c.user = ?
+    '''
+    conversation_params = [SNIPPET_START, SNIPPET_END, SNIPPET_ELLIPSIS, match, user]
+    if persona:
+        conversation_query += ' AND c.persona = ?'
+        conversation_params.append(persona)
+
+    # Each persona has its own database, so its messages belong to the persona the file is named after.
+    database_persona = db_persona or os.path.basename(os.path.dirname(os.path.dirname(db_path)))
+    message_query = f'''
+        SELECT 'message', m.id, m.conversation_id, ?, m.role, m.timestamp, NULL,
+               snippet(messages_fts, 0, ?, ?, ?, {SNIPPET_TOKENS}), bm25(messages_fts) AS rank
+        FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+        WHERE messages_fts MATCH ? AND m.user = ?
+    '''
+    message_params = [database_persona, SNIPPET_START, SNIPPET_END, SNIPPET_ELLIPSIS, match, user]
+
+    # Archived transcripts are only on disk, so their contentless index yields no snippet here;
+    # see _archive_snippets.
+    archive_query = '''
+        SELECT 'conversation', a.id, a.conversation_id, a.persona, NULL, a.date_modified, a.name,
+               NULL, bm25(archived_conversations_fts) AS rank
+        FROM archived_conversations_fts JOIN archived_conversations a ON a.id = archived_conversations_fts.rowid
+        WHERE archived_conversations_fts MATCH ? AND a.user = ?
+    '''
+    archive_params = [match, user]
+    if persona:
+        archive_query += ' AND a.persona = ?'
+        archive_params.append(persona)
+
+    # The tables are ranked in separate statements: sorting a UNION of them would build a snippet
+    # for every matching row, while ORDER BY ... LIMIT lets SQLite build only limit of them.
+    queries = (
+        (conversation_query, conversation_params),
+        (message_query, message_params),
+        (archive_query, archive_params),
+    )
+    best = {}
+    try:
+        ranked_lists = []
+        for query, params in queries:
+            cursor.execute(query + ' ORDER BY rank LIMIT ?;', params + [limit])
+            ranked_lists.append(cursor.fetchall())
+        ranked_lists.append(_segment_rows(cursor, match, user, persona, limit))
+
+        for rows in ranked_lists:
+            for position, row in enumerate(rows):
+                fused = -1.0 / (RRF_K + position + 1)
+                # Transcript, appended segments and archive all describe the same conversation.
+                key = (row[0], row[2]) if row[0] == 'conversation' else (row[0], row[1])
+                if key not in best or fused < best[key][0]:
+                    best[key] = (fused, row)
+        results = sorted(best.values(), key=lambda item: (item[0], item[1][8]))[:limit]
+        snippets = _archive_snippets(cursor, db_path, [row[1] for _, row in results if row[7] is None], match)
+    except sqlite3.Error as e:
+        logger.error(f"Error searching chat history: {e}")
+        raise
+
+    return [
+        {
+            "source": source, "id": row_id, "conversation_id": conversation_id, "persona": row_persona,
+            "role": role, "timestamp": timestamp, "name": name,
+            "snippet": snippets.get(row_id) if snippet is None else snippet,
+            "rank": fused, "bm25": score, "db_file": db_path,
+        }
+        for fused, (source, row_id, conversation_id, row_persona, role, timestamp, name, snippet, score) in results
+    ]
+
+
+def _segment_rows(cursor, match, user, persona, limit):
+    """
+    Ranks the conversations whose appended text (conversation_segments) matches, by their best
+    matching segment, and returns the limit best as result rows with that segment's snippet.
+
+    bm25() cannot be aggregated per conversation in SQL, so the segment ranks are read without
+    snippets first and the snippets are only built for the segments that are kept.
+    """
+    query = '''
+        SELECT s.id, s.conversation_ref, bm25(conversation_segments_fts) AS rank
+        FROM conversation_segments_fts
+        JOIN conversation_segments s ON s.id = conversation_segments_fts.rowid
+        JOIN conversations c ON c.id = s.conversation_ref
+        WHERE conversation_segments_fts MATCH ? AND c.user = ?
+    '''
+    params = [match, user]
+    if persona:
+        query += ' AND c.persona = ?'
+        params.append(persona)
+    cursor.execute(query + ' ORDER BY rank;', params)
+    segment_ids = {}
+    for segment_id, conversation_ref, _ in cursor:
+        segment_ids.setdefault(conversation_ref, segment_id)
+        if len(segment_ids) == limit:
+            break
+    if not segment_ids:
+        return []
+
+    ids = list(segment_ids.values())
+    cursor.execute(f'''
+        SELECT 'conversation', c.id, c.conversation_id, c.persona, NULL, c.date_modified, c.name,
+               snippet(conversation_segments_fts, 0, ?, ?, ?, {SNIPPET_TOKENS}), bm25(conversation_segments_fts) AS rank
+        FROM conversation_segments_fts
+        JOIN conversation_segments s ON s.id = conversation_segments_fts.rowid
+        JOIN conversations c ON c.id = s.conversation_ref
+        WHERE conversation_segments_fts MATCH ? AND conversation_segments_fts.rowid IN ({", ".join("?" for _ in ids)})
+        ORDER BY rank;
+    ''', [SNIPPET_START, SNIPPET_END, SNIPPET_ELLIPSIS, match] + ids)
+    return cursor.fetchall()
+
+
+def _archive_snippets(cursor, db_path, row_ids, match):
+    """
+    Builds the snippets of archived conversations that made it into a page of results.
+
+    The transcripts are read back from the segment files into a temporary FTS5 table, so the
+    snippets come out exactly like the ones SQLite makes for conversations still in the database.
+    Returns a dictionary of snippet by archived conversation id.
+    """
+    if not row_ids:
+        return {}
+    cursor.execute(f'''
+        SELECT id, name, segment, offset, length FROM archived_conversations
+        WHERE id IN ({", ".join("?" for _ in row_ids)});
+    ''', row_ids)
+    rows = cursor.fetchall()
+    chat_logs = get_archive(db_path).read_chat_logs([row[2:] for row in rows])
+
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.archive_snippets USING fts5(name, chat_log, tokenize='unicode61 remove_diacritics 2');")
+    cursor.execute("DELETE FROM temp.archive_snippets;")
+    cursor.executemany("INSERT INTO temp.archive_snippets (rowid, name, chat_log) VALUES (?, ?, ?);", [
+        (row_id, name, chat_log) for (row_id, name, _, _, _), chat_log in zip(rows, chat_logs)
+    ])
+    cursor.execute(f'''
+        SELECT rowid, snippet(archive_snippets, -1, ?, ?, ?, {SNIPPET_TOKENS})
+        FROM temp.archive_snippets WHERE archive_snippets MATCH ?;
+    ''', (SNIPPET_START, SNIPPET_END, SNIPPET_ELLIPSIS, match))
+    snippets = dict(cursor.fetchall())
+    cursor.execute("DELETE FROM temp.archive_snippets;")
+    return snippets
+
+
+def search(user, query, persona=None, limit=20, offset=0, db_path=None, db_persona=None):
+    """
+    Full-text search over chat history, ranked across every persona database.
+
+    Args:
+    - user: User ID
+    - query: Free text to search for.
+    - persona: Optional. Only search this persona's database.
+    - limit: Maximum number of results.
+    - offset: Number of results to skip, for paging.
+    - db_path: Optional. The caller's own database, searched in place of db_persona's default one.
+      It is the only database that is migrated first; the others are only read.
+    - db_persona: Optional. The persona db_path belongs to.
+
+    Returns:
+    - List of result dictionaries with source ('message' or 'conversation'), id, conversation_id, persona,
+      role, timestamp, name, snippet, rank (lower is better) and the bm25 score within its table.
+    """
+    match = build_match_query(query)
+    if match is None:
+        return []
+
+    own = db_path if db_path and (not persona or persona == db_persona) else None
+    if persona and own:
+        other_paths = []
+    elif persona:
+        other_paths = [path for path in [persona_database_path(persona)] if os.path.exists(path)]
+    else:
+        other_paths = persona_database_paths()
+    if own:
+        skip = {os.path.abspath(own)} | ({os.path.abspath(persona_database_path(db_persona))} if db_persona else set())
+        other_paths = [path for path in other_paths if os.path.abspath(path) not in skip]
+
+    # Every database returns its own top limit + offset rows; merging those is enough to get the
+    # global page because no database can contribute more than that many rows to it.
+    results = []
+    for path in ([own] if own else []) + other_paths:
+        try:
+            if path == own:
+                results.extend(search_database(path, user, match, persona, limit + offset, db_persona))
+            else:
+                results.extend(search_database_read_only(path, user, match, persona, limit + offset))
+        except sqlite3.Error as e:
+            logger.error(f"Skipping {path} in search: {e}")
+
+    # Every database's ranks are fused positions as well, so this interleaves the databases.
+    results.sort(key=lambda result: (result["rank"], result["bm25"]))
+    return results[offset:offset + limit]
@@ -0,0 +1,509 @@
+# modules/chat_history/semantic_memory.py
+
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import zlib
+
+import numpy as np
+
+from modules.chat_history.DatabaseContextManager import DatabaseContextManager
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('semantic_memory.py')
+
+# Rows added to the vector file each time it has to grow.
+GROWTH_ROWS = 8192
+
+# Below this many vectors every query scans all of them; above it an IVF index is trained.
+IVF_MIN_VECTORS = 32768
+
+# The IVF index is retrained in the background once the collection has grown by this factor.
+IVF_RETRAIN_FACTOR = 4
+
+# Inverted lists probed per query.
+IVF_NPROBE = 16
+
+# Vectors added since the inverted lists were last sorted are scanned directly, up to this many.
+IVF_MAX_TAIL = 8192
+
+# Vectors converted to float32 at a time during a flat scan.
+SCAN_CHUNK = 65536
+
+# Messages encoded per batch when catching up with messages that were never indexed; also the
+# number of ids per IN (...) list, kept below SQLite's old 999 variable limit.
+CATCH_UP_BATCH = 512
+
+# Seconds appended vectors may stay in memory before they and the metadata are written to disk.
+# Rows lost to a crash in between are indexed again by the next catch_up.
+SYNC_INTERVAL = 5.0
+
+# Ids added since the sorted array of indexed ids was last rebuilt, kept in a set up to this many.
+RECENT_IDS = 4096
+
+# A filtered search first offers k times this many candidates to the filter, then this many times
+# more in every further round, until k of them pass or no candidates are left.
+SEARCH_WIDENING = 4
+
+# Stored in place of the message id of a removed vector; the slot is skipped by every search.
+REMOVED_ID = -1
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEncoder:
+    """
+    Stateless text encoder based on the hashing trick.
+
+    Lower-cased words and word bigrams are hashed into dim signed buckets, weighted by log term
+    frequency and L2-normalized, so cosine similarity reduces to a dot product. It needs no model
+    download and encodes thousands of messages per second on one core. Any object with the same
+    name / dim / encode(texts) interface, for example a sentence-transformers wrapper, can be
+    passed to SemanticMemory instead.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text):
+        words = _WORD.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = {}
+            for feature in self._features(text or ""):
+                # crc32 rather than hash(): str hashes are salted per process and the vectors are persisted.
+                bucket = zlib.crc32(feature.encode("utf-8"))
+                counts[bucket] = counts.get(bucket, 0) + 1
+            for bucket, count in counts.items():
+                sign = 1.0 if bucket & 0x80000000 else -1.0
+                vectors[row, bucket % self.dim] += sign * (1.0 + np.log(count))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class SemanticMemory:
+    """
+    Embedding index over the messages of one persona database.
+
+    Vectors are stored as float16 in <db>.vectors.f16, a memory-mapped file next to the persona
+    database, with the message id of every row in <db>.vectors.ids and the IVF list of every
+    row in <db>.vectors.lists. <db>.vectors.json records the encoder and how many rows are valid;
+    it is written last, so rows appended by a process that died before updating it are ignored.
+    Appended rows and the metadata are written to disk together at most every SYNC_INTERVAL
+    seconds rather than per message.
+
+    New messages are indexed as they are stored. catch_up() indexes the ones that never were; it
+    is run by a background job rather than on the request path, and the meta file records the
+    message id it got through, so later runs only read the messages stored after it.
+
+    Queries scan every vector while the collection is small. Past IVF_MIN_VECTORS a k-means
+    coarse quantizer is trained in a background thread and queries only score the vectors of the
+    IVF_NPROBE closest lists, plus any vectors added since the lists were last sorted.
+    """
+
+    def __init__(self, db_path, encoder=None):
+        self.db_path = db_path
+        self.encoder = encoder or HashingEncoder()
+        self.dim = self.encoder.dim
+        base = os.path.splitext(db_path)[0]
+        self.vectors_path = base + ".vectors.f16"
+        self.ids_path = base + ".vectors.ids"
+        self.lists_path = base + ".vectors.lists"
+        self.centroids_path = base + ".vectors.centroids.npy"
+        self.meta_path = base + ".vectors.json"
+        self._lock = threading.RLock()
+        self._training = False
+        self._sync_timer = None
+        self._open()
+
+    # Storage
+
+    def _open(self):
+        meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+        if meta and (meta.get("encoder") != self.encoder.name or meta.get("dim") != self.dim):
+            logger.info(f"Encoder changed from {meta.get('encoder')} to {self.encoder.name}, rebuilding semantic index")
+            for path in (self.vectors_path, self.ids_path, self.lists_path, self.centroids_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            meta = {}
+
+        self.count = meta.get("count", 0)
+        self.trained_count = meta.get("trained_count", 0)
+        # Every message with an id up to this one was indexed by the last catch_up.
+        self.indexed_through = meta.get("indexed_through", 0)
+        self.capacity = 0
+        self._vectors = self._ids = self._lists = None
+        self._grow(max(self.count, 1))
+        # Sorted ids of every indexed message, plus the ones added since in a set; see _indexed_ids.
+        self._indexed = np.sort(np.asarray(self._ids[:self.count]))
+        self._recent = set()
+
+        self._centroids = np.load(self.centroids_path) if self.trained_count and os.path.exists(self.centroids_path) else None
+        if self._centroids is None:
+            self.trained_count = 0
+        self._order = np.zeros(0, dtype=np.int64)
+        self._starts = None
+        self._sorted_upto = 0
+        if self._centroids is not None:
+            self._sort_lists()
+
+    def _grow(self, rows):
+        if rows <= self.capacity:
+            return
+        capacity = ((rows + GROWTH_ROWS - 1) // GROWTH_ROWS) * GROWTH_ROWS
+        for path, dtype, width in ((self.vectors_path, np.float16, self.dim), (self.ids_path, np.int64, 1), (self.lists_path, np.int32, 1)):
+            size = capacity * width * np.dtype(dtype).itemsize
+            with open(path, "ab") as file:
+                if file.tell() < size:
+                    file.truncate(size)
+        self._flush()
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+        self._ids = np.memmap(self.ids_path, dtype=np.int64, mode="r+", shape=(capacity,))
+        self._lists = np.memmap(self.lists_path, dtype=np.int32, mode="r+", shape=(capacity,))
+        self.capacity = capacity
+
+    def _flush(self):
+        for array in (self._vectors, self._ids, self._lists):
+            if array is not None:
+                array.flush()
+
+    def _schedule_sync(self):
+        if self._sync_timer is None:
+            self._sync_timer = threading.Timer(SYNC_INTERVAL, self.sync)
+            self._sync_timer.daemon = True
+            self._sync_timer.start()
+
+    def sync(self):
+        """Writes the appended vectors and then the metadata to disk."""
+        with self._lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            if self._vectors is None:
+                return
+            self._flush()
+            self._write_meta()
+
+    def _write_meta(self):
+        meta = {"encoder": self.encoder.name, "dim": self.dim, "count": self.count, "trained_count": self.trained_count,
+                "indexed_through": self.indexed_through}
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+        os.replace(tmp_path, self.meta_path)
+
+    # Indexing
+
+    def add(self, message_ids, texts):
+        """Encodes texts and appends them to the index under message_ids."""
+        if not message_ids:
+            return
+        vectors = self.encoder.encode(texts)
+        with self._lock:
+            start, end = self.count, self.count + len(message_ids)
+            self._grow(end)
+            self._vectors[start:end] = vectors.astype(np.float16)
+            self._ids[start:end] = message_ids
+            self._lists[start:end] = self._assign(vectors) if self._centroids is not None else -1
+            self.count = end
+            self._recent.update(message_ids)
+            if len(self._recent) > RECENT_IDS:
+                self._indexed_ids()
+            self._schedule_sync()
+        self._maybe_train()
+
+    def _indexed_ids(self):
+        # Folds the recently added ids into the sorted array and returns it.
+        if self._recent:
+            recent = np.fromiter(self._recent, dtype=np.int64, count=len(self._recent))
+            self._indexed = np.union1d(self._indexed, recent)
+            self._recent = set()
+        return self._indexed
+
+    def is_indexed(self, message_id):
+        with self._lock:
+            if message_id in self._recent:
+                return True
+            position = np.searchsorted(self._indexed, message_id)
+            return bool(position < len(self._indexed) and self._indexed[position] == message_id)
+
+    def add_missing(self, messages):
+        """Indexes the (message_id, content) pairs that are not in the index yet."""
+        with self._lock:
+            messages = [(message_id, content) for message_id, content in messages if not self.is_indexed(message_id)]
+            self.add([message_id for message_id, _ in messages], [content for _, content in messages])
+
+    def remove(self, message_ids):
+        """
+        Drops message_ids from the index, e.g. when their conversation is deleted or archived.
+        The vectors stay in the file, under REMOVED_ID, and are never returned again.
+        """
+        if not message_ids:
+            return
+        message_ids = np.asarray(message_ids, dtype=np.int64)
+        with self._lock:
+            if self._vectors is None:
+                return
+            slots = np.flatnonzero(np.isin(self._ids[:self.count], message_ids))
+            if len(slots):
+                self._ids[slots] = REMOVED_ID
+                self._indexed = np.setdiff1d(self._indexed_ids(), message_ids)
+                self._schedule_sync()
+
+    def add_message(self, message_id, content):
+        """Indexes one new message unless it already is."""
+        with self._lock:
+            if not self.is_indexed(message_id):
+                self.add([message_id], [content])
+
+    def catch_up(self):
+        """
+        Indexes every stored message above indexed_through that is not in the index yet: messages
+        written before the index existed, lost to a crash before the vectors were synced, or
+        imported. The first run reads every message id; later ones only those stored since.
+
+        The index lock is only held while vectors are appended, and add_missing skips messages
+        that are already indexed, so new messages are indexed meanwhile without waiting and
+        concurrent runs never index a message twice.
+
+        Returns:
+        - The number of messages that were missing from the index.
+        """
+        through = self.indexed_through
+        with DatabaseContextManager(self.db_path) as cursor:
+            try:
+                cursor.execute('SELECT id FROM messages WHERE id > ?;', (through,))
+                stored = np.fromiter((row[0] for row in cursor), dtype=np.int64)
+            except sqlite3.Error as e:
+                logger.error(f"Error reading message ids to index: {e}")
+                raise
+        with self._lock:
+            missing = np.setdiff1d(stored, self._indexed_ids()).tolist()
+        for start in range(0, len(missing), CATCH_UP_BATCH):
+            batch = missing[start:start + CATCH_UP_BATCH]
+            with DatabaseContextManager(self.db_path) as cursor:
+                try:
+                    cursor.execute(f'''
+                        SELECT id, content FROM messages WHERE id IN ({", ".join("?" for _ in batch)});
+                    ''', batch)
+                    rows = cursor.fetchall()
+                except sqlite3.Error as e:
+                    logger.error(f"Error reading messages to index: {e}")
+                    raise
+            self.add_missing(rows)
+        with self._lock:
+            if len(stored) and stored.max() > self.indexed_through:
+                self.indexed_through = int(stored.max())
+                self.sync()
+        if missing:
+            logger.info(f"Semantic index caught up with {len(missing)} messages")
+        return len(missing)
+
+    # IVF index
+
+    def _assign(self, vectors):
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def _sort_lists(self):
+        upto = self.count
+        lists = np.asarray(self._lists[:upto])
+        order = np.argsort(lists, kind="stable")
+        self._starts = np.searchsorted(lists[order], np.arange(len(self._centroids) + 1))
+        self._order = order
+        self._sorted_upto = upto
+
+    def _maybe_train(self):
+        with self._lock:
+            due = self.count >= IVF_MIN_VECTORS and (
+                self._centroids is None or self.count >= self.trained_count * IVF_RETRAIN_FACTOR
+            )
+            if not due or self._training:
+                return
+            self._training = True
+        threading.Thread(target=self._train, name=f"semantic-memory-ivf:{self.db_path}", daemon=True).start()
+
+    def _train(self, iterations=8, seed=0):
+        try:
+            count = self.count
+            nlist = int(min(4096, max(16, 2 ** round(np.log2(np.sqrt(count))))))
+            rng = np.random.default_rng(seed)
+            sample_size = min(count, nlist * 32)
+            sample = np.asarray(self._vectors[np.sort(rng.choice(count, sample_size, replace=False))], dtype=np.float32)
+
+            # Spherical k-means: centroids stay unit length so assignment is a dot product.
+            centroids = sample[rng.choice(sample_size, nlist, replace=False)]
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                norms = np.linalg.norm(sums, axis=1, keepdims=True)
+                empty = norms[:, 0] == 0
+                centroids = np.where(empty[:, None], centroids, sums / np.where(norms == 0, 1.0, norms))
+
+            lists = np.empty(count, dtype=np.int32)
+            for start in range(0, count, SCAN_CHUNK):
+                chunk = np.asarray(self._vectors[start:min(start + SCAN_CHUNK, count)], dtype=np.float32)
+                lists[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+
+            with self._lock:
+                np.save(self.centroids_path, centroids)
+                self._centroids = centroids
+                self._lists[:count] = lists
+                if self.count > count:
+                    tail = np.asarray(self._vectors[count:self.count], dtype=np.float32)
+                    self._lists[count:self.count] = self._assign(tail)
+                self._flush()
+                self.trained_count = self.count
+                self._write_meta()
+                self._sort_lists()
+            logger.info(f"Semantic IVF index trained with {nlist} lists over {count} vectors")
+        except Exception as e:
+            logger.error(f"Error training semantic IVF index: {e}", exc_info=True)
+        finally:
+            self._training = False
+
+    # Search
+
+    def _scan(self, slots, query):
+        if isinstance(slots, slice):
+            scores = np.empty(slots.stop - slots.start, dtype=np.float32)
+            for start in range(slots.start, slots.stop, SCAN_CHUNK):
+                stop = min(start + SCAN_CHUNK, slots.stop)
+                scores[start - slots.start:stop - slots.start] = np.asarray(self._vectors[start:stop], dtype=np.float32) @ query
+            return np.arange(slots.start, slots.stop), scores
+        return slots, np.asarray(self._vectors[slots], dtype=np.float32) @ query
+
+    def search(self, query_text, k=10, accept=None, min_score=None):
+        """
+        Returns up to k (message_id, score) pairs by cosine similarity to query_text, best first.
+
+        Args:
+        - query_text: Text to look for.
+        - k: Maximum number of pairs to return.
+        - accept: Optional. Called with a list of candidate message ids, best first, and returns
+          the ones that may be returned. Candidates are offered in widening rounds until k are
+          accepted or none are left, so rejected vectors never take the place of accepted ones.
+        - min_score: Optional. Only vectors scoring above it are candidates.
+        """
+        query = self.encoder.encode([query_text])[0]
+        with self._lock:
+            if self.count == 0:
+                return []
+            if self._centroids is None:
+                candidates = [self._scan(slice(0, self.count), query)]
+            else:
+                if self.count - self._sorted_upto > IVF_MAX_TAIL:
+                    self._sort_lists()
+                nearest = np.argsort(self._centroids @ query)[-IVF_NPROBE:]
+                slots = np.concatenate([self._order[self._starts[i]:self._starts[i + 1]] for i in nearest])
+                candidates = [self._scan(np.sort(slots), query), self._scan(slice(self._sorted_upto, self.count), query)]
+            ids = np.concatenate([np.asarray(self._ids[c[0]]) for c in candidates])
+            scores = np.concatenate([c[1] for c in candidates])
+
+        live = ids != REMOVED_ID
+        if min_score is not None:
+            live &= scores > min_score
+        ids, scores = ids[live], scores[live]
+        results = []
+        offered, size = 0, k if accept is None else k * SEARCH_WIDENING
+        while len(results) < k and offered < len(scores):
+            size = min(size, len(scores))
+            top = np.argpartition(scores, -size)[-size:] if size < len(scores) else np.arange(len(scores))
+            top = top[np.argsort(scores[top], kind="stable")[::-1]][offered:]
+            candidate_ids = ids[top].tolist()
+            accepted = set(candidate_ids if accept is None else accept(candidate_ids))
+            results.extend((message_id, float(scores[i])) for message_id, i in zip(candidate_ids, top) if message_id in accepted)
+            offered, size = size, size * SEARCH_WIDENING
+        return results[:k]
+
+    def recall(self, query_text, k=5, user=None, exclude_conversation_id=None):
+        """
+        Finds the stored messages most similar to query_text.
+
+        Args:
+        - query_text: Text to look for.
+        - k: Maximum number of messages to return.
+        - user: Optional. Only return messages of this user.
+        - exclude_conversation_id: Optional. Skip messages of this conversation, usually the current one.
+
+        Returns:
+        - List of dictionaries with message_id, conversation_id, role, content, timestamp and score, best match first.
+        """
+        filters, filter_params = "", []
+        if user is not None:
+            filters += " AND user = ?"
+            filter_params.append(user)
+        if exclude_conversation_id is not None:
+            filters += " AND conversation_id != ?"
+            filter_params.append(exclude_conversation_id)
+        rows = {}
+
+        def accept(message_ids):
+            # The user and conversation filters run on the candidates before the top k are taken,
+            # so messages of other users or of the current conversation never crowd out matches.
+            with DatabaseContextManager(self.db_path) as cursor:
+                try:
+                    for start in range(0, len(message_ids), CATCH_UP_BATCH):
+                        batch = message_ids[start:start + CATCH_UP_BATCH]
+                        cursor.execute(f'''
+                            SELECT id, conversation_id, role, content, timestamp FROM messages
+                            WHERE id IN ({", ".join("?" for _ in batch)}){filters};
+                        ''', batch + filter_params)
+                        rows.update((row[0], row[1:]) for row in cursor.fetchall())
+                except sqlite3.Error as e:
+                    logger.error(f"Error fetching recalled messages: {e}")
+                    raise
+            return [message_id for message_id in message_ids if message_id in rows]
+
+        return [
+            {"message_id": message_id, "conversation_id": rows[message_id][0], "role": rows[message_id][1],
+             "content": rows[message_id][2], "timestamp": rows[message_id][3], "score": score}
+            for message_id, score in self.search(query_text, k, accept, min_score=0.0)
+        ]
+
+    def close(self):
+        with self._lock:
+            self.sync()
+            self._vectors = self._ids = self._lists = None
+
+
+_memories = {}
+_memories_lock = threading.Lock()
+
+
+def get_semantic_memory(db_path, encoder=None):
+    """Returns the semantic index shared by every component working on db_path."""
+    memory = _memories.get(db_path)
+    if memory is None:
+        with _memories_lock:
+            memory = _memories.get(db_path)
+            if memory is None:
+                memory = _memories[db_path] = SemanticMemory(db_path, encoder)
+    return memory
+
+
+def close_semantic_memory(db_path):
+    with _memories_lock:
+        memory = _memories.pop(db_path, None)
+    if memory is not None:
+        memory.close()
+
+
+if __name__ == "__main__":
+    # python -m modules.chat_history.semantic_memory <persona db> [query]
+    memory = get_semantic_memory(sys.argv[1])
+    print(f"indexed {memory.catch_up()} new messages, {memory.count} total")
+    if len(sys.argv) > 2:
+        for result in memory.recall(" ".join(sys.argv[2:])):
+            print(f"{result['score']:.3f} [{result['conversation_id']}] {result['role']}: {result['content'][:100]}")
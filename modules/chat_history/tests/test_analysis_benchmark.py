@@ -0,0 +1,21 @@
+# modules/chat_history/tests/test_analysis_benchmark.py
+
+import pytest
+
+from modules.chat_history.benchmarks.analysis import run_analysis_benchmark
+
+
+@pytest.mark.parametrize("fail_batches", [False, True])
+def test_batched_analysis_names_every_conversation(fail_batches):
+    result = run_analysis_benchmark(conversations=16, fail_batches=fail_batches)
+    single, batched = result["single"], result["batched"]
+
+    assert single["wrong_names"] == 0
+    assert batched["wrong_names"] == 0
+    assert single["batch_requests"] == 0
+    assert batched["batch_requests"] > 0
+    if fail_batches:
+        # Every malformed batch costs its request, then each conversation is analyzed on its own.
+        assert batched["round_trips"] == single["round_trips"] + batched["batch_requests"]
+    else:
+        assert batched["round_trips"] < single["round_trips"]
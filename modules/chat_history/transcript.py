@@ -0,0 +1,42 @@
+# modules/chat_history/transcript.py
+
+import hashlib
+
+# Saved chat logs are measured and hashed as UTF-8 bytes.
+TRANSCRIPT_ENCODING = "utf-8"
+
+UNCHANGED = "unchanged"
+APPEND = "append"
+REWRITE = "rewrite"
+
+
+def transcript_digest(data):
+    """Returns the hex digest stored in conversations.chat_log_digest for the encoded transcript data."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def transcript_delta(saved_size, saved_digest, chat_log):
+    """
+    Works out what has to be written to save chat_log over a transcript saved earlier.
+
+    The chat log in the GUI only ever grows, so the text saved last time is normally a prefix of
+    chat_log. That is verified against the stored size and digest rather than by reading the
+    saved transcript back from the database.
+
+    Args:
+    - saved_size: Size in bytes of the transcript saved so far.
+    - saved_digest: transcript_digest() of the transcript saved so far, or None if unknown.
+    - chat_log: The full chat log being saved now.
+
+    Returns:
+    - A (mode, text, size, digest) tuple. mode is UNCHANGED, APPEND (text is only the new tail)
+      or REWRITE (text is the whole chat log); size and digest describe the full chat_log.
+    """
+    data = chat_log.encode(TRANSCRIPT_ENCODING)
+    digest = transcript_digest(data)
+    if saved_digest is not None and len(data) >= saved_size:
+        if len(data) == saved_size and digest == saved_digest:
+            return UNCHANGED, "", len(data), digest
+        if transcript_digest(data[:saved_size]) == saved_digest:
+            return APPEND, data[saved_size:].decode(TRANSCRIPT_ENCODING), len(data), digest
+    return REWRITE, chat_log, len(data), digest
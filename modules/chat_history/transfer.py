@@ -0,0 +1,353 @@
+# modules/chat_history/transfer.py
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from modules.chat_history.DatabaseContextManager import DatabaseContextManager
+from modules.chat_history.archive import get_archive, close_archive
+from modules.chat_history.codec import get_codec, close_codec
+from modules.chat_history.connection_pool import get_pool, close_pool
+from modules.chat_history.history_cache import get_history_cache
+from modules.chat_history.migrations import SCHEMA_VERSION, migrate_database
+from modules.chat_history.search import persona_database_path
+from modules.chat_history.semantic_memory import get_semantic_memory, close_semantic_memory
+from modules.chat_history.transcript import transcript_delta
+from modules.chat_history.write_behind import flush_write_behind_queue, reset_write_behind_ids
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('transfer.py')
+
+EXPORT_FORMAT = "scout-chat-history"
+EXPORT_VERSION = 1
+
+# Rows fetched per fetchmany() call while exporting; also how often export progress is saved.
+EXPORT_BATCH_SIZE = 1000
+
+# Rows inserted per transaction while importing.
+IMPORT_BATCH_SIZE = 5000
+
+# Tables exported, in the order their rows appear in the file. Parents come before children,
+# so an import can insert every batch in this order without breaking a foreign key.
+TRANSFER_TABLES = ("conversations", "messages", "function_calls", "responses")
+
+# Columns derived from others, recomputed on import instead of being exported.
+DERIVED_COLUMNS = {"conversations": ("chat_log_digest", "chat_log_size")}
+
+# Imported rows get their source id plus the target table's highest id at the start of the import,
+# so references between rows are remapped by the same offset and a resumed import inserts the
+# same ids again. Each entry maps a column to the table its id refers to.
+ID_REFERENCES = {
+    "conversations": {"id": "conversations"},
+    "messages": {"id": "messages", "function_call_id": "function_calls"},
+    "function_calls": {"id": "function_calls", "message_id": "messages"},
+    "responses": {"id": "responses", "function_call_id": "function_calls"},
+}
+
+
+def _progress_path(path, operation):
+    return f"{path}.{operation}-progress"
+
+
+def _load_progress(path, operation):
+    try:
+        with open(_progress_path(path, operation), "r", encoding="utf-8") as progress_file:
+            return json.load(progress_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_progress(path, operation, progress):
+    progress_path = _progress_path(path, operation)
+    with open(progress_path + ".tmp", "w", encoding="utf-8") as progress_file:
+        json.dump(progress, progress_file)
+    os.replace(progress_path + ".tmp", progress_path)
+
+
+def _clear_progress(path, operation):
+    if os.path.exists(_progress_path(path, operation)):
+        os.remove(_progress_path(path, operation))
+
+
+def _line(table, row):
+    return json.dumps({"table": table, "row": row}, ensure_ascii=False) + "\n"
+
+
+def _export_table(db_path, table, user, last_id):
+    """Yields (last_id, lines) batches of a table's rows with an id above last_id."""
+    codec = get_codec(db_path)
+    derived = DERIVED_COLUMNS.get(table, ())
+    query = f'SELECT * FROM {table} WHERE id > ?'
+    params = [last_id]
+    if user:
+        query += ' AND user = ?'
+        params.append(user)
+
+    with DatabaseContextManager(db_path) as cursor:
+        segments = get_pool(db_path).cursor()
+        # One statement stepped through with fetchmany, so memory stays at one batch whatever the table size.
+        cursor.execute(query + ' ORDER BY id;', params)
+        columns = [description[0] for description in cursor.description]
+        while True:
+            rows = [dict(zip(columns, row)) for row in cursor.fetchmany(EXPORT_BATCH_SIZE)]
+            if not rows:
+                break
+            if table == "conversations":
+                # Appended segments are folded back into chat_log.
+                segments.execute(f'''
+                    SELECT conversation_ref, content FROM conversation_segments
+                    WHERE conversation_ref IN ({", ".join("?" for _ in rows)}) ORDER BY conversation_ref, id;
+                ''', [row["id"] for row in rows])
+                appended = {}
+                for conversation_ref, content in segments.fetchall():
+                    appended[conversation_ref] = appended.get(conversation_ref, "") + codec.decode(content)
+                for row in rows:
+                    row["chat_log"] = codec.decode(row["chat_log"]) + appended.get(row["id"], "")
+            elif table == "responses":
+                for row in rows:
+                    row["response_data"] = codec.decode(row["response_data"])
+            for row in rows:
+                for column in derived:
+                    row.pop(column, None)
+            yield rows[-1]["id"], [_line(table, row) for row in rows]
+
+
+def _export_archive(db_path, user, last_id):
+    """Yields (last_id, lines) batches of the archived conversations with an id above last_id."""
+    archive = get_archive(db_path)
+    query = 'SELECT id, segment, offset, length FROM archived_conversations WHERE id > ?'
+    params = [last_id]
+    if user:
+        query += ' AND user = ?'
+        params.append(user)
+
+    with DatabaseContextManager(db_path) as cursor:
+        cursor.execute(query + ' ORDER BY id;', params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE // 10)
+            if not rows:
+                break
+            lines = []
+            for _, segment, offset, length in rows:
+                record = archive.read_record(segment, offset, length)
+                for table in TRANSFER_TABLES:
+                    table_rows = [record["conversation"]] if table == "conversations" else record[table]
+                    for row in table_rows:
+                        row = dict(row)
+                        for column in DERIVED_COLUMNS.get(table, ()):
+                            row.pop(column, None)
+                        lines.append(_line(table, row))
+            yield rows[-1][0], lines
+
+
+def export_history(db_path, path, user=None, resume=True):
+    """
+    Streams a persona database to a JSONL file, one line per row.
+
+    The first line is a header; every other line is {"table": ..., "row": {...}} for a row of
+    conversations, messages, function_calls or responses, with transcripts and tool responses
+    decompressed. Archived conversations are exported after the live tables, each followed by
+    its own rows. Progress is saved next to the file after every batch, and an interrupted
+    export continues from there when run again with resume=True.
+
+    Returns:
+    - The number of rows written by this run.
+    """
+    migrate_database(db_path)
+    flush_write_behind_queue(db_path)
+    phases = TRANSFER_TABLES + ("archived_conversations",)
+    progress = _load_progress(path, "export") if resume and os.path.exists(path) else None
+    if progress is None:
+        progress = {"phase": 0, "last_id": 0, "size": 0, "rows": 0}
+        with open(path, "w", encoding="utf-8") as export_file:
+            export_file.write(json.dumps({
+                "format": EXPORT_FORMAT, "version": EXPORT_VERSION, "schema_version": SCHEMA_VERSION,
+                "exported": time.strftime("%Y-%m-%d %H:%M:%S"), "user": user,
+            }) + "\n")
+            progress["size"] = export_file.tell()
+        _save_progress(path, "export", progress)
+    else:
+        logger.info(f"Resuming export of {db_path} at {phases[progress['phase']]} after id {progress['last_id']}")
+
+    written = 0
+    with open(path, "r+b") as export_file:
+        # Anything after the last saved batch was written by the interrupted run and is written again.
+        export_file.truncate(progress["size"])
+        export_file.seek(progress["size"])
+        while progress["phase"] < len(phases):
+            phase = phases[progress["phase"]]
+            if phase == "archived_conversations":
+                batches = _export_archive(db_path, user, progress["last_id"])
+            else:
+                batches = _export_table(db_path, phase, user, progress["last_id"])
+            for last_id, lines in batches:
+                export_file.write("".join(lines).encode("utf-8"))
+                export_file.flush()
+                written += len(lines)
+                progress.update(last_id=last_id, size=export_file.tell(), rows=progress["rows"] + len(lines))
+                _save_progress(path, "export", progress)
+            progress.update(phase=progress["phase"] + 1, last_id=0)
+            _save_progress(path, "export", progress)
+
+    _clear_progress(path, "export")
+    logger.info(f"Exported {progress['rows']} rows from {db_path} to {path}")
+    return written
+
+
+def _id_offsets(cursor):
+    """The highest id of every table, which imported ids are shifted by."""
+    offsets = {}
+    for table in TRANSFER_TABLES:
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table};')
+        offsets[table] = cursor.fetchone()[0]
+        cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = ?;', (table,))
+        offsets[table] = max(offsets[table], cursor.fetchone()[0])
+    # Archived conversations keep their conversations id, so imported ones must not collide with them either.
+    cursor.execute('SELECT COALESCE(MAX(id), 0) FROM archived_conversations;')
+    offsets["conversations"] = max(offsets["conversations"], cursor.fetchone()[0])
+    return offsets
+
+
+class _Importer:
+    """Buffers imported rows and writes them table by table in large transactions."""
+
+    def __init__(self, db_path, offsets):
+        self.db_path = db_path
+        self.codec = get_codec(db_path)
+        self.offsets = offsets
+        self.pending = {table: [] for table in TRANSFER_TABLES}
+        self.count = 0
+        self.skipped = 0
+        with DatabaseContextManager(db_path) as cursor:
+            self.columns = {table: [row[1] for row in cursor.execute(f"PRAGMA table_info({table});").fetchall()] for table in TRANSFER_TABLES}
+            # Conversations already in the database before this import began, saved or not, are never
+            # duplicated; rows inserted by an interrupted run of the same import have higher ids and are rewritten.
+            cursor.execute('''
+                SELECT user, conversation_id FROM conversations WHERE id <= ?
+                UNION SELECT user, conversation_id FROM archived_conversations WHERE id <= ?
+                UNION SELECT user, conversation_id FROM messages WHERE id <= ?;
+            ''', (offsets["conversations"], offsets["conversations"], offsets["messages"]))
+            self.existing = set(cursor.fetchall())
+
+    def add(self, table, row):
+        if (row.get("user"), row.get("conversation_id")) in self.existing:
+            self.skipped += 1
+            return
+        for column, referenced in ID_REFERENCES[table].items():
+            if row.get(column) is not None:
+                row[column] += self.offsets[referenced]
+        if table == "conversations":
+            _, _, row["chat_log_size"], row["chat_log_digest"] = transcript_delta(0, None, row["chat_log"])
+            row["chat_log"] = self.codec.encode(row["chat_log"])
+        elif table == "responses":
+            row["response_data"] = self.codec.encode(row["response_data"])
+        self.pending[table].append(row)
+        self.count += 1
+
+    def full(self):
+        return sum(len(rows) for rows in self.pending.values()) >= IMPORT_BATCH_SIZE
+
+    def flush(self):
+        with DatabaseContextManager(self.db_path) as cursor:
+            try:
+                for table in TRANSFER_TABLES:
+                    rows = self.pending[table]
+                    if not rows:
+                        continue
+                    columns = [column for column in self.columns[table] if column in rows[0]]
+                    # OR IGNORE: rows of a batch replayed after an interruption are already there under the same ids.
+                    cursor.executemany(
+                        f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in columns)});',
+                        [[row.get(column) for column in columns] for row in rows]
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Error importing chat history: {e}")
+                raise
+        for rows in self.pending.values():
+            rows.clear()
+
+
+def import_history(db_path, path, resume=True):
+    """
+    Loads a JSONL file written by export_history into a persona database.
+
+    Rows are inserted with executemany in transactions of IMPORT_BATCH_SIZE rows. Ids are remapped
+    past the database's own rows, so an export can be merged into a database that is already in
+    use; conversations the database already has are skipped together with their rows. Progress is
+    saved next to the file after every transaction, and an interrupted import continues from there
+    when run again with resume=True. Once done, the imported messages are added to the semantic
+    recall index and a write-behind queue on the database numbers its next rows after them.
+
+    Returns:
+    - The number of rows imported by this run.
+    """
+    migrate_database(db_path)
+    flush_write_behind_queue(db_path)
+    progress = _load_progress(path, "import") if resume else None
+    if progress is not None and progress.get("db_path") != db_path:
+        progress = None
+
+    with open(path, "rb") as import_file:
+        header = json.loads(import_file.readline())
+        if header.get("format") != EXPORT_FORMAT or header.get("version", 0) > EXPORT_VERSION:
+            raise ValueError(f"{path} is not a chat history export this version can read")
+        if progress is None:
+            with DatabaseContextManager(db_path) as cursor:
+                offsets = _id_offsets(cursor)
+            progress = {"db_path": db_path, "offsets": offsets, "position": import_file.tell(), "rows": 0}
+            _save_progress(path, "import", progress)
+        else:
+            logger.info(f"Resuming import of {path} at byte {progress['position']}")
+
+        importer = _Importer(db_path, progress["offsets"])
+        previous_rows = progress["rows"]
+        import_file.seek(progress["position"])
+        while True:
+            line = import_file.readline()
+            if line.strip():
+                entry = json.loads(line)
+                importer.add(entry["table"], entry["row"])
+            if not line or importer.full():
+                importer.flush()
+                progress.update(position=import_file.tell(), rows=previous_rows + importer.count)
+                _save_progress(path, "import", progress)
+                if not line:
+                    break
+
+    _clear_progress(path, "import")
+    # Cached histories may predate the imported rows, queued inserts must be numbered after them,
+    # and recall only finds them once they are in the semantic index.
+    get_history_cache(db_path).clear()
+    reset_write_behind_ids(db_path)
+    get_semantic_memory(db_path).catch_up()
+    logger.info(f"Imported {progress['rows']} rows from {path} into {db_path}, skipped {importer.skipped} already present")
+    return importer.count
+
+
+if __name__ == "__main__":
+    # python -m modules.chat_history.transfer export|import <persona> <file> [--user USER] [--restart]
+    parser = argparse.ArgumentParser(description="Export or import persona chat history as JSONL.")
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("persona")
+    parser.add_argument("path")
+    parser.add_argument("--user", help="only export this user's conversations")
+    parser.add_argument("--restart", action="store_true", help="ignore the progress of an interrupted run")
+    args = parser.parse_args()
+
+    database = persona_database_path(args.persona)
+    start = time.perf_counter()
+    try:
+        if args.command == "export":
+            rows = export_history(database, args.path, args.user, resume=not args.restart)
+        else:
+            rows = import_history(database, args.path, resume=not args.restart)
+        print(f"{args.command}: {rows} rows in {time.perf_counter() - start:.1f}s")
+    except (sqlite3.Error, OSError, ValueError) as e:
+        print(f"{args.command} FAILED ({e})")
+    finally:
+        close_archive(database)
+        close_semantic_memory(database)
+        close_pool(database)
+        close_codec(database)
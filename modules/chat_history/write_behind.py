@@ -0,0 +1,301 @@
+# modules/chat_history/write_behind.py
+
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+
+from modules.chat_history.connection_pool import get_pool
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('write_behind.py')
+
+# Column order of the rows queued for each table. The id is allocated by the queue so callers get
+# their message_id / function_call_id back immediately, before the row reaches the disk.
+TABLE_COLUMNS = {
+    "messages": ("id", "user", "conversation_id", "role", "content", "timestamp", "function_call_id", "token_count"),
+    "function_calls": ("id", "user", "conversation_id", "message_id", "function_name", "arguments", "timestamp"),
+    "responses": ("id", "user", "conversation_id", "function_call_id", "response_data", "timestamp"),
+}
+
+# Parents are written before children so foreign keys hold inside every batch.
+TABLE_ORDER = ("messages", "function_calls", "responses")
+
+# Attempts at committing a batch while the database is busy or locked, and the delay before the
+# first retry; it doubles after every attempt.
+WRITE_ATTEMPTS = 5
+RETRY_DELAY = 0.1
+
+_STOP = object()
+
+
+class WriteBehindError(sqlite3.DatabaseError):
+    """Raised by flush() and enqueue() when queued rows could not be written."""
+
+
+class WriteBehindQueue:
+    """
+    Buffers chat history inserts in memory and commits them from a background writer thread.
+
+    The writer drains whatever has accumulated into a single BEGIN/COMMIT with one executemany
+    per table, so a burst of tool calls costs one disk sync per batch instead of one per row.
+    Rows stay visible through pending_rows() until their batch commits, which is what gives
+    ConversationManager.get_history read-your-writes consistency.
+
+    The queue is bounded: when max_pending rows are waiting, enqueue() blocks until the writer
+    catches up.
+
+    A batch that fails while the database is busy is retried with backoff, then row by row. The
+    ids of rows that still cannot be written are kept and reported by the next flush(), which
+    raises WriteBehindError instead of letting acknowledged rows disappear silently.
+    """
+
+    def __init__(self, db_path, max_pending=1000, batch_size=256):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.rows_written = 0
+        self.batches_committed = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = {table: {} for table in TABLE_COLUMNS}
+        self._next_ids = {}
+        self._lock = threading.Lock()
+        self._failed = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"chat-history-writer:{db_path}", daemon=True)
+        self._thread.start()
+
+    def _allocate_id(self, table):
+        """Returns the next row id for table, continuing from the database's AUTOINCREMENT counter."""
+        next_id = self._next_ids.get(table)
+        if next_id is None:
+            conn = get_pool(self.db_path).connection()
+            row = conn.execute(f'''
+                SELECT MAX(
+                    COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0),
+                    COALESCE((SELECT MAX(id) FROM {table}), 0)
+                );
+            ''', (table,)).fetchone()
+            # Rows still queued from before reset_ids() are not in the table yet.
+            next_id = max(row[0], max(self._pending[table], default=0)) + 1
+        self._next_ids[table] = next_id + 1
+        return next_id
+
+    def reset_ids(self):
+        """
+        Makes the next enqueue() read each table's highest id from the database again.
+
+        Needed after rows were inserted without going through the queue, e.g. by an import,
+        since ids are otherwise only read once and then counted up in memory.
+        """
+        with self._lock:
+            self._next_ids.clear()
+
+    def enqueue(self, table, row):
+        """
+        Queues row (a tuple in TABLE_COLUMNS[table] order, without the leading id) for insertion
+        and returns the id it will be stored under.
+
+        The id is allocated and the row becomes visible through pending_rows() in one step, so
+        a reader never sees a committed row while an earlier id of the same table is unaccounted
+        for. Blocks while the queue is full.
+        """
+        if self._closed:
+            raise RuntimeError("Write-behind queue is closed")
+        if not self._thread.is_alive():
+            raise WriteBehindError("Write-behind writer thread has stopped")
+        with self._lock:
+            row_id = self._allocate_id(table)
+            row = (row_id,) + tuple(row)
+            self._pending[table][row_id] = row
+        self._queue.put((table, row))
+        return row_id
+
+    def pending_rows(self, table, user, conversation_id):
+        """Returns the queued, not yet committed rows of table for one conversation, in id order."""
+        with self._lock:
+            rows = [row for row in self._pending[table].values() if row[1] == user and row[2] == conversation_id]
+        rows.sort(key=lambda row: row[0])
+        return rows
+
+    def flush(self):
+        """
+        Blocks until every row queued so far has been committed.
+
+        Raises WriteBehindError if rows queued since the previous flush could not be written,
+        naming their tables and ids, or if the writer thread has stopped.
+        """
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                if not self._thread.is_alive():
+                    raise WriteBehindError("Write-behind writer thread has stopped with rows still queued")
+                self._queue.all_tasks_done.wait(0.5)
+        self._raise_failures()
+
+    def _raise_failures(self):
+        with self._lock:
+            failed, self._failed = self._failed, []
+        if failed:
+            rows = ", ".join(f"{table} {row_id}" for table, row_id, _ in failed[:20])
+            raise WriteBehindError(f"{len(failed)} queued rows could not be written ({rows}): {failed[-1][2]}")
+
+    def close(self):
+        """Flushes outstanding rows and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        logger.info(f"Write-behind queue closed after {self.rows_written} rows in {self.batches_committed} batches")
+        try:
+            self._raise_failures()
+        except WriteBehindError as e:
+            logger.error(str(e))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self._write(batch)
+            except Exception as e:
+                # Keep the writer alive whatever happened, so flush() and enqueue() never wait on
+                # a dead thread; the batch is reported as failed instead.
+                logger.error(f"Write-behind batch of {len(batch)} rows failed: {e}", exc_info=True)
+                for table, row in batch:
+                    self._fail(table, row, e)
+            finally:
+                with self._lock:
+                    for table, row in batch:
+                        self._pending[table].pop(row[0], None)
+                for _ in batch:
+                    self._queue.task_done()
+
+            if stop:
+                self._queue.task_done()
+                return
+
+    def _write(self, batch):
+        rows_by_table = {table: [] for table in TABLE_ORDER}
+        for table, row in batch:
+            rows_by_table[table].append(row)
+
+        conn = get_pool(self.db_path).connection()
+        try:
+            self._commit(conn, [(table, rows_by_table[table]) for table in TABLE_ORDER if rows_by_table[table]])
+            self.rows_written += len(batch)
+            self.batches_committed += 1
+        except sqlite3.OperationalError as e:
+            # Still busy or locked after every retry; row by row would only wait again.
+            logger.error(f"Write-behind batch of {len(batch)} rows failed after {WRITE_ATTEMPTS} attempts: {e}")
+            for table, row in batch:
+                self._fail(table, row, e)
+        except sqlite3.Error as e:
+            logger.error(f"Write-behind batch of {len(batch)} rows failed, retrying row by row: {e}")
+            self._write_individually(conn, batch)
+
+    def _write_individually(self, conn, batch):
+        for table in TABLE_ORDER:
+            for queued_table, row in batch:
+                if queued_table != table:
+                    continue
+                try:
+                    self._commit(conn, [(table, [row])])
+                    self.rows_written += 1
+                    self.batches_committed += 1
+                except sqlite3.Error as e:
+                    self._fail(table, row, e)
+
+    def _commit(self, conn, table_rows):
+        """Inserts the rows in one transaction, retrying with backoff while the database is busy."""
+        delay = RETRY_DELAY
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                conn.execute("BEGIN IMMEDIATE;")
+                for table, rows in table_rows:
+                    conn.executemany(self._insert_sql(table), rows)
+                conn.commit()
+                return
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                if attempt == WRITE_ATTEMPTS:
+                    raise
+                logger.warning(f"Write-behind commit failed (attempt {attempt} of {WRITE_ATTEMPTS}), retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay *= 2
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+
+    def _fail(self, table, row, error):
+        logger.error(f"Queued {table} row {row[0]} could not be written: {error}")
+        with self._lock:
+            self._failed.append((table, row[0], f"{type(error).__name__}: {error}"))
+
+    @staticmethod
+    def _insert_sql(table):
+        columns = TABLE_COLUMNS[table]
+        return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)});"
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_write_behind_queue(db_path, create=False):
+    """
+    Returns the write-behind queue for db_path.
+
+    Only ConversationManagers opened with write_behind=True create one, but once it exists every
+    manager on the same database routes its inserts through it so ids never collide.
+    """
+    write_queue = _queues.get(db_path)
+    if write_queue is None and create:
+        with _queues_lock:
+            write_queue = _queues.get(db_path)
+            if write_queue is None:
+                write_queue = _queues[db_path] = WriteBehindQueue(db_path)
+    return write_queue
+
+
+def flush_write_behind_queue(db_path):
+    write_queue = _queues.get(db_path)
+    if write_queue is not None:
+        write_queue.flush()
+
+
+def reset_write_behind_ids(db_path):
+    write_queue = _queues.get(db_path)
+    if write_queue is not None:
+        write_queue.reset_ids()
+
+
+def close_write_behind_queue(db_path):
+    with _queues_lock:
+        write_queue = _queues.pop(db_path, None)
+    if write_queue is not None:
+        write_queue.close()
+
+
+@atexit.register
+def close_all_write_behind_queues():
+    with _queues_lock:
+        queues = list(_queues.values())
+        _queues.clear()
+    for write_queue in queues:
+        write_queue.close()
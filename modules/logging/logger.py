@@ -1,37 +1,168 @@
 # modules/logging/logger.py
 
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FILE = 'modules/logging/SCOUT.log'
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Format of the log file and console: 'text', or 'jsonl' for one JSON object per record.
+LOG_FORMAT_ENV = 'SCOUT_LOG_FORMAT'
+
+# Per-module levels read at startup, e.g. SCOUT_LOG_LEVELS="convo_manager.py=DEBUG,job_scheduler.py=WARNING".
+LOG_LEVELS_ENV = 'SCOUT_LOG_LEVELS'
 
 logging_level = logging.INFO
 
+# Level of each module whose level was set explicitly; every other logger follows logging_level.
+module_levels = {}
+
+_queue = queue.SimpleQueue()
+_queue_handler = QueueHandler(_queue)
+_listener = None
+_listener_lock = threading.Lock()
+_log_format = os.environ.get(LOG_FORMAT_ENV, 'text')
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats a record as one line of JSON.
+
+    Fields logged with log_payload are kept under "fields"; a traceback is part of the message,
+    as the queue handler merges it in before the record leaves the logging thread.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": getattr(record, "event", None) or record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry["fields"] = fields
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _formatter():
+    return JsonLinesFormatter() if _log_format == 'jsonl' else logging.Formatter(LOG_FORMAT)
+
+
+def _start_listener():
+    """
+    Starts the one thread that writes every log record.
+
+    Loggers only put records on a queue; formatting, the rotating log file and the console are
+    handled here, so a log call never waits for disk or terminal I/O, and the whole process
+    keeps a single handle on the log file however many loggers there are.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        formatter = _formatter()
+
+        # Ensure the log file is created in the correct directory
+        file_handler = RotatingFileHandler(LOG_FILE, maxBytes=50*1024*1024, backupCount=5, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+
+        _listener = QueueListener(_queue, file_handler, stream_handler)
+        _listener.start()
+
+
+@atexit.register
+def stop_logging():
+    """Writes the records still queued and stops the listener thread."""
+    global _listener
+    with _listener_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def set_log_format(log_format):
+    """Switches the log file and console between 'text' and 'jsonl' output."""
+    global _log_format
+    if log_format not in ('text', 'jsonl'):
+        raise ValueError(f"Unknown log format: {log_format}")
+    _log_format = log_format
+    with _listener_lock:
+        if _listener is not None:
+            for handler in _listener.handlers:
+                handler.setFormatter(_formatter())
+
+
+def _custom_loggers():
+    return [logger for logger in list(logging.Logger.manager.loggerDict.values()) if isinstance(logger, CustomLogger)]
+
+
 def set_logging_level(level):
+    """Sets the default level, for existing loggers too, except modules given their own with set_module_level."""
     global logging_level
     logging_level = level
+    for logger in _custom_loggers():
+        if logger.name not in module_levels:
+            logger.setLevel(level)
+
 
 def get_logging_level():
     return logging_level
 
-class CustomLogger(logging.Logger):
-    def __init__(self, name):
-        super().__init__(name, logging_level)
 
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+def set_module_level(logger_name, level):
+    """Sets the level of one module's logger at runtime; level None makes it follow the default again."""
+    if level is None:
+        module_levels.pop(logger_name, None)
+        level = logging_level
+    else:
+        module_levels[logger_name] = level
+    if logger_name in logging.Logger.manager.loggerDict:
+        logging.getLogger(logger_name).setLevel(level)
 
-        # Ensure the log file is created in the correct directory
-        file_handler = RotatingFileHandler('modules/logging/SCOUT.log', maxBytes=50*1024*1024, backupCount=5, encoding='utf-8')
-        file_handler.setFormatter(formatter)
-        self.addHandler(file_handler)
 
-        stream_handler = logging.StreamHandler()
-        stream_handler.setFormatter(formatter)
-        self.addHandler(stream_handler)
+def get_module_level(logger_name):
+    return module_levels.get(logger_name, logging_level)
+
+
+def configure_module_levels(spec):
+    """Applies a "name=LEVEL,name=LEVEL" list of module levels, as in SCOUT_LOG_LEVELS."""
+    for item in spec.split(','):
+        name, _, level = item.partition('=')
+        name, level = name.strip(), level.strip().upper()
+        if not name or not level:
+            continue
+        if level.isdigit():
+            set_module_level(name, int(level))
+        elif isinstance(logging.getLevelName(level), int):
+            set_module_level(name, logging.getLevelName(level))
+
+
+class CustomLogger(logging.Logger):
+    def __init__(self, name):
+        super().__init__(name, get_module_level(name))
+        _start_listener()
+        self.addHandler(_queue_handler)
 
         # Disable propagation to the root logger
         self.propagate = False
 
+
 def setup_logger(logger_name):
     logging.setLoggerClass(CustomLogger)
     logger = logging.getLogger(logger_name)
-    logger.setLevel(logging_level)
-    return logger
\ No newline at end of file
+    logger.setLevel(get_module_level(logger_name))
+    return logger
+
+
+configure_module_levels(os.environ.get(LOG_LEVELS_ENV, ''))
@@ -0,0 +1,93 @@
+# modules/logging/structured.py
+
+import hashlib
+import itertools
+import json
+
+# Characters a field keeps in the log; longer values are cut and tagged with their length and hash.
+MAX_FIELD_CHARS = 500
+# Items of a list kept before the rest is only counted.
+MAX_FIELD_ITEMS = 50
+
+_call_counts = {}
+
+
+def _cut(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    digest = hashlib.sha1(text.encode('utf-8', 'replace')).hexdigest()[:12]
+    return f"{text[:max_chars]}... <{len(text)} chars, sha1 {digest}>"
+
+
+def _shrink(value, max_chars):
+    # Cuts long strings and lists inside a structure before it is serialized, so a long
+    # conversation is never written out in full only to be thrown away.
+    if isinstance(value, str):
+        return _cut(value, max_chars)
+    if isinstance(value, dict):
+        return {key: _shrink(item, max_chars) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [_shrink(item, max_chars) for item in value[:MAX_FIELD_ITEMS]]
+        if len(value) > MAX_FIELD_ITEMS:
+            items.append(f"... <{len(value)} items>")
+        return items
+    return value
+
+
+def truncate(value, max_chars=MAX_FIELD_CHARS):
+    """
+    Returns value as log text, at most max_chars long plus a short tag.
+
+    Strings are kept as they are and everything else is written as JSON. A longer text is cut,
+    and its full length and the start of its SHA-1 are appended, so two log lines can still tell
+    whether they saw the same payload. Strings nested in lists and dictionaries are cut the same
+    way before the whole is serialized.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes, sha1 {hashlib.sha1(value).hexdigest()[:12]}>"
+    if isinstance(value, str):
+        return _cut(value, max_chars)
+    try:
+        text = json.dumps(_shrink(value, max_chars), ensure_ascii=False, default=str)
+    except (TypeError, ValueError):
+        text = repr(value)
+    return _cut(text, max_chars)
+
+
+def log_payload(logger, level, event, sample_every=1, max_chars=MAX_FIELD_CHARS, **fields):
+    """
+    Logs event with fields, formatting nothing unless the record is actually written.
+
+    Fields are passed as values or as callables returning them; both are only rendered when
+    logger is enabled for level and the call is sampled, and each is cut to max_chars with
+    truncate(). With sample_every=n only the first of every n calls from the same logger and
+    event is written, and the record says how many were skipped. In the text format the fields
+    follow the event as key=value pairs; the jsonl format keeps them as separate keys.
+
+    Args:
+    - logger: Logger to write to.
+    - level: Logging level of the record.
+    - event: Short, constant description of what is logged; together with the logger it
+      identifies the call site for sampling.
+    - sample_every: Write one in this many calls.
+    - max_chars: Characters kept per field.
+    - fields: Values to log, by name.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample_every > 1:
+        call = next(_call_counts.setdefault((logger.name, event), itertools.count()))
+        if call % sample_every:
+            return
+        if call:
+            fields["skipped"] = sample_every - 1
+    rendered = {}
+    for name, value in fields.items():
+        if callable(value):
+            value = value()
+        if value is None or isinstance(value, (bool, int, float)):
+            rendered[name] = value
+        else:
+            rendered[name] = truncate(value, max_chars)
+    text = " ".join([event] + [f"{name}={value}" for name, value in rendered.items()])
+    logger.log(level, text, extra={"event": event, "fields": rendered}, stacklevel=2)
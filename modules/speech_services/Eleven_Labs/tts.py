@@ -6,6 +6,7 @@ import os
 import requests
 import re
 from dotenv import load_dotenv
+from modules.Analytics.tracing import traced
 from modules.logging.logger import setup_logger
 from datetime import datetime
 
@@ -160,6 +161,7 @@ def get_tts():
     logger.info(f"TTS status: {_use_tts}")
     return _use_tts
 
+@traced("tts", root=False)
 async def tts(text):
     await text_to_speech(text)
 
@@ -7,6 +7,7 @@ import os
 import re
 from datetime import datetime
 from google.cloud import texttospeech
+from modules.Analytics.tracing import traced
 from modules.logging.logger import setup_logger
 
 logger = setup_logger('tts.py')
@@ -121,6 +122,7 @@ def get_tts():
     logger.info(f"TTS status: {_use_tts}")
     return _use_tts
 
+@traced("tts", root=False)
 async def tts(text):
     await text_to_speech(text)
 
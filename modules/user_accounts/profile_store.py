@@ -0,0 +1,192 @@
+# modules/user_accounts/profile_store.py
+
+import atexit
+import copy
+import json
+import os
+import tempfile
+import threading
+from modules.logging.logger import setup_logger
+
+logger = setup_logger('profile_store.py')
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'user_profiles')
+
+# Seconds between the first unsaved change and the write, so a burst of updates is written once.
+SAVE_DELAY = 2.0
+
+
+class ProfileStore:
+    """
+    In-memory copy of one user's JSON profile, shared by everything that reads or updates it.
+
+    The file is read once and again only if it changed on disk while there were no unsaved
+    updates. update() applies a whole batch of changes under a lock, so concurrent background
+    jobs no longer overwrite each other's read-modify-write. Changes are written SAVE_DELAY
+    seconds after the first one, to a temporary file that then replaces the profile, so the file
+    on disk is always either the old or the new profile in full. Subscribers are called with
+    the new profile after every update.
+    """
+
+    def __init__(self, user, profile_dir=PROFILE_DIR, save_delay=SAVE_DELAY):
+        self.user = user
+        self.path = os.path.join(profile_dir, f"{user}.json")
+        self.save_delay = save_delay
+        self.version = 0
+        self._profile = None
+        self._mtime = None
+        self._dirty = False
+        self._timer = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        # Held for a whole write, so two flushes cannot put an older profile on disk last.
+        self._write_lock = threading.Lock()
+
+    def _disk_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        self._mtime = self._disk_mtime()
+        if self._mtime is None:
+            logger.error(f"Profile file does not exist: {self.path}")
+            self._profile = {}
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self._profile = json.load(file)
+            logger.info("Profile loaded")
+        except Exception as e:
+            logger.error(f"Error loading profile: {e}")
+            self._profile = {}
+
+    def _current(self):
+        if self._profile is None or (not self._dirty and self._disk_mtime() != self._mtime):
+            self._load()
+        return self._profile
+
+    def get(self):
+        """Returns a copy of the profile; an empty dictionary if there is none."""
+        with self._lock:
+            return copy.deepcopy(self._current())
+
+    def update(self, mutate):
+        """
+        Applies mutate(profile) to the profile as one atomic change.
+
+        mutate receives a working copy and edits it in place. If it raises, nothing is applied
+        and the exception propagates. A change that leaves the profile as it was is not saved
+        and not notified.
+
+        Returns:
+        - Whatever mutate returns.
+        """
+        with self._lock:
+            profile = copy.deepcopy(self._current())
+            result = mutate(profile)
+            if profile == self._profile:
+                return result
+            self._profile = profile
+            self.version += 1
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.save_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            snapshot = copy.deepcopy(profile)
+        self._notify(snapshot)
+        return result
+
+    def replace(self, profile):
+        """Replaces the whole profile."""
+        def mutate(current):
+            current.clear()
+            current.update(profile)
+        self.update(mutate)
+
+    def flush(self):
+        """Writes unsaved changes now."""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                text = json.dumps(self._profile, ensure_ascii=False, indent=4)
+                self._dirty = False
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=f".{self.user}.", suffix=".tmp")
+                try:
+                    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                        file.write(text)
+                        file.flush()
+                        os.fsync(file.fileno())
+                    os.replace(temp_path, self.path)
+                except BaseException:
+                    os.remove(temp_path)
+                    raise
+                with self._lock:
+                    self._mtime = self._disk_mtime()
+                logger.info("Profile updated successfully.")
+            except Exception as e:
+                logger.error(f"Error saving profile: {e}")
+                with self._lock:
+                    # Kept unsaved, so the next update or close tries again.
+                    self._dirty = True
+
+    def subscribe(self, callback):
+        """Calls callback(profile) after every update, on the thread that made it."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def _notify(self, profile):
+        with self._lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(profile)
+            except Exception as e:
+                logger.error(f"Error in profile listener: {e}", exc_info=True)
+
+    def close(self):
+        self.flush()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_profile_store(user):
+    """Returns the profile store shared by every component working with user's profile."""
+    store = _stores.get(user)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(user)
+            if store is None:
+                store = _stores[user] = ProfileStore(user)
+    return store
+
+
+def close_profile_store(user):
+    with _stores_lock:
+        store = _stores.pop(user, None)
+    if store is not None:
+        store.close()
+
+
+@atexit.register
+def close_all_profile_stores():
+    with _stores_lock:
+        stores = list(_stores.values())
+        _stores.clear()
+    for store in stores:
+        store.close()
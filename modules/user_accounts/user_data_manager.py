@@ -1,9 +1,9 @@
 # modules/user_accounts/user_data_manager.py
 
 import os
-import json
 import re
 import subprocess
+from modules.user_accounts.profile_store import get_profile_store
 from modules.logging.logger import setup_logger
 
 logger = setup_logger('user_data_manager.py')
@@ -71,37 +71,27 @@ class UserDataManager:
             user (str): The username of the user.
         """
         self.user = user
-        self.profile = self.get_profile_text()
         self.emr = self.get_emr()
         self.system_info = self.get_system_info()
         #logger.info(f"UDM instantiated with user: {self.user}, {self.profile}")
 
+    @property
+    def profile(self):
+        """The user's current profile as a formatted string."""
+        return self.get_profile_text()
+
     def get_profile(self):
         """
-        Retrieves the user's profile from a JSON file.
+        Retrieves the user's profile from the shared profile store.
+
+        The JSON file is read once per user and kept in memory, so this always returns the
+        latest profile, including updates not yet written to disk.
 
         Returns:
             dict: The user's profile as a dictionary.
         """
         logger.info("Entering get_profile() method")
-        try:
-            profile_path = os.path.join(
-                os.path.dirname(__file__), '..', '..', 'modules', 'user_accounts', 'user_profiles',
-                f"{self.user}.json"
-            )
-
-            if not os.path.exists(profile_path):
-                logger.error(f"Profile file does not exist: {profile_path}")
-                return {}
-
-            with open(profile_path, 'r', encoding='utf-8') as file:
-                profile = json.load(file)
-                logger.info("Profile found")
-                return profile
-
-        except Exception as e:
-            logger.error(f"Error loading profile: {e}")
-            return {}
+        return get_profile_store(self.user).get()
         
     def format_profile_as_text(self, profile_json):
         """